@@ -0,0 +1,160 @@
+"""
+Cache de respostas de GET versionado pelos dados (/dashboard/stats).
+
+As TVs dos supervisores pedem o mesmo período a cada refresh. Com
+@guardar(ttl), a resposta 200 fica guardada por endpoint + path/query + perfil
++ versão dos dados; a próxima igual sai do cache sem tocar no banco.
+
+Versão dos dados: contador incrementado a cada evento de escrita em
+cargas/transferencias (todo escritor publica em api/eventos_cargas.py; no
+PostgreSQL o evento chega a todos os workers). Versão nova = chaves novas; as
+entradas antigas deixam de ser usadas e saem pelo LRU/TTL. A versão é lida
+antes de calcular: uma escrita durante o cálculo deixa o resultado numa chave
+que já nasce velha.
+
+ttl em segundos, ou função chamada no request que devolve os segundos
+(None = sem expiração, só a versão invalida).
+
+Partes de uma resposta também podem ser guardadas à parte, com TTL próprio:
+chave_valor() (lida antes de calcular, como acima), obter_valor() e
+gravar_valor(). O valor precisa ser serializável em JSON.
+
+Backend: MemoriaBackend (LRU com TTL, por processo) por padrão. Um backend
+compartilhado entre workers implementa a mesma interface (obter, gravar,
+versao, incrementar_versao, limpar) e entra com usar_backend(); os valores
+guardados são tuplas simples (status, headers, corpo em bytes).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+
+from api import compacto, eventos_cargas
+from api.auth import current_role
+
+CACHE_LIGADO = os.getenv("CACHE_RESULTADOS", "1") != "0"
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_RESULTADOS_MAX_ENTRADAS", "256"))
+
+
+class MemoriaBackend:
+    """LRU com TTL no próprio processo (thread-safe)."""
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._itens: OrderedDict[str, tuple[float | None, tuple]] = OrderedDict()
+        self._versao = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave: str) -> tuple | None:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            expira_em, valor = item
+            if expira_em is not None and expira_em <= time.monotonic():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def gravar(self, chave: str, valor: tuple, ttl: float | None) -> None:
+        expira_em = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._itens[chave] = (expira_em, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_entradas:
+                self._itens.popitem(last=False)
+
+    def versao(self) -> int:
+        return self._versao
+
+    def incrementar_versao(self) -> None:
+        with self._lock:
+            self._versao += 1
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+
+_backend = MemoriaBackend()
+_observando = False
+
+
+def usar_backend(backend) -> None:
+    """Troca o backend (ex.: um compartilhado entre workers)."""
+    global _backend
+    _backend = backend
+
+
+def limpar() -> None:
+    _backend.limpar()
+
+
+def dados_alterados(*_args) -> None:
+    """Callback dos eventos de escrita: nova versão dos dados."""
+    _backend.incrementar_versao()
+
+
+def _observar_eventos() -> None:
+    global _observando
+    if not _observando:
+        _observando = True
+        eventos_cargas.observar(dados_alterados)
+
+
+def chave_valor(*partes) -> str:
+    """Chave com a versão atual dos dados; ler antes de calcular o valor."""
+    _observar_eventos()
+    return "|".join(str(p) for p in ("valor", _backend.versao(), *partes))
+
+
+def obter_valor(chave: str):
+    """Valor guardado por gravar_valor, ou None."""
+    if not CACHE_LIGADO:
+        return None
+    guardado = _backend.obter(chave)
+    return None if guardado is None else json.loads(guardado[0])
+
+
+def gravar_valor(chave: str, valor, ttl: float | None) -> None:
+    if CACHE_LIGADO:
+        _backend.gravar(chave, (json.dumps(valor).encode(),), ttl)
+
+
+def guardar(ttl):
+    """Decorator de GET (abaixo do require_capability): guarda as respostas 200."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            if request.method != "GET" or not CACHE_LIGADO:
+                return fn(*args, **kwargs)
+
+            _observar_eventos()
+            backend = _backend
+            chave = "|".join(str(p) for p in (
+                backend.versao(),
+                request.endpoint,
+                request.full_path,
+                current_role(),
+                compacto.aceita_gzip(),
+            ))
+
+            guardado = backend.obter(chave)
+            if guardado is not None:
+                status, headers, corpo = guardado
+                return current_app.response_class(corpo, status=status, headers=headers)
+
+            resposta = current_app.make_response(fn(*args, **kwargs))
+            if resposta.status_code == 200 and not resposta.is_streamed:
+                segundos = ttl() if callable(ttl) else ttl
+                backend.gravar(chave, (200, list(resposta.headers.items()), resposta.get_data()), segundos)
+            return resposta
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,125 @@
+"""
+Coalescência (single-flight) de GETs idênticos e concorrentes.
+
+Na troca de turno dezenas de telas pedem /pc/listar e /dashboard/stats no
+mesmo segundo. Com @compartilhar, o primeiro request de uma chave calcula a
+resposta; os que chegam enquanto ele roda esperam e recebem o mesmo corpo
+já serializado. A resposta pronta ainda vale por COALESCER_JANELA_MS.
+
+Chave: endpoint + path/query + If-None-Match + aceita gzip (o corpo guardado
+pode estar comprimido, api/compacto.py) + perfil (a resposta pode depender
+das permissões). Permissão continua checada por request (o decorator fica
+abaixo do require_capability).
+
+Qualquer commit neste processo, ou evento de cargas recebido de outro
+worker (api/eventos_cargas.py), descarta as respostas prontas: um GET logo
+depois de uma escrita nunca recebe o resultado de antes dela.
+Erros não são compartilhados nem guardados.
+"""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from api import compacto, eventos_cargas
+from api.auth import current_role
+
+COALESCER_JANELA = int(os.getenv("COALESCER_JANELA_MS", "1000")) / 1000
+
+# Quanto um request espera o cálculo de outro antes de calcular sozinho.
+ESPERA_MAXIMA = 30
+
+_voos: dict[tuple, "_Voo"] = {}
+_lock = threading.Lock()
+_geracao = 0
+_observando = False
+
+
+class _Voo:
+    __slots__ = ("pronto", "geracao", "concluido_em", "resposta")
+
+    def __init__(self, geracao: int):
+        self.pronto = threading.Event()
+        self.geracao = geracao
+        self.concluido_em: float | None = None
+        self.resposta: tuple | None = None  # (status, headers, corpo)
+
+
+def invalidar(*_args) -> None:
+    """Descarta as respostas prontas (voos em andamento seguem para quem já espera)."""
+    global _geracao
+    with _lock:
+        _geracao += 1
+        for chave in [k for k, v in _voos.items() if v.concluido_em is not None]:
+            del _voos[chave]
+
+
+@event.listens_for(Session, "after_commit")
+def _apos_commit(session) -> None:
+    invalidar()
+
+
+def _observar_eventos() -> None:
+    global _observando
+    if not _observando:
+        _observando = True
+        eventos_cargas.observar(invalidar)
+
+
+def _valido(voo: _Voo, agora: float) -> bool:
+    if voo.geracao != _geracao:
+        return False
+    return voo.concluido_em is None or agora - voo.concluido_em <= COALESCER_JANELA
+
+
+def _responder(resposta: tuple):
+    status, headers, corpo = resposta
+    return current_app.response_class(corpo, status=status, headers=headers)
+
+
+def compartilhar(fn):
+    """Decorator de GET: requests iguais e simultâneos compartilham um cálculo e um corpo."""
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        if request.method != "GET" or COALESCER_JANELA < 0:
+            return fn(*args, **kwargs)
+
+        _observar_eventos()
+        chave = (
+            request.endpoint,
+            request.full_path,
+            request.headers.get("If-None-Match", ""),
+            compacto.aceita_gzip(),
+            current_role(),
+        )
+        agora = time.monotonic()
+
+        with _lock:
+            voo = _voos.get(chave)
+            lider = voo is None or not _valido(voo, agora)
+            if lider:
+                voo = _Voo(_geracao)
+                _voos[chave] = voo
+
+        if not lider:
+            if voo.pronto.wait(ESPERA_MAXIMA) and voo.resposta is not None:
+                return _responder(voo.resposta)
+            return fn(*args, **kwargs)
+
+        try:
+            resposta = current_app.make_response(fn(*args, **kwargs))
+            if resposta.status_code < 400 and not resposta.is_streamed:
+                voo.resposta = (resposta.status_code, list(resposta.headers.items()), resposta.get_data())
+            return resposta
+        finally:
+            with _lock:
+                voo.concluido_em = time.monotonic()
+                if voo.resposta is None and _voos.get(chave) is voo:
+                    del _voos[chave]
+            voo.pronto.set()
+
+    return wrapped
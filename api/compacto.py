@@ -0,0 +1,89 @@
+"""
+Formato compacto das listagens grandes (/pc/listar, /transferin/listar) para
+os tablets na Wi-Fi da doca.
+
+  - format=columnar (opt-in): {"colunas": [...], "tempo": [...], "linhas": [[...]]}.
+    Nomes das colunas uma vez só, cada linha é um array na ordem de "colunas";
+    as colunas listadas em "tempo" vêm em epoch (segundos, UTC) em vez de ISO.
+    Sem o parâmetro a resposta continua no formato de objetos de sempre.
+  - @comprimir: gzip quando o cliente aceita (Accept-Encoding) e o corpo passa
+    de COMPACTO_GZIP_MIN_BYTES. Vale para os dois formatos.
+
+Os serializadores montam cada linha como lista de valores (datetimes em UTC)
+e escolhem o formato no fim: `objetos` (legado) ou `colunar`.
+"""
+import gzip
+import os
+from functools import wraps
+
+from flask import current_app, request
+
+GZIP_MIN_BYTES = int(os.getenv("COMPACTO_GZIP_MIN_BYTES", "1024"))
+GZIP_NIVEL = int(os.getenv("COMPACTO_GZIP_NIVEL", "6"))
+
+
+def colunar_pedido() -> bool:
+    return request.args.get("format") == "columnar"
+
+
+def _indices(colunas, tempo) -> list[int]:
+    return [colunas.index(c) for c in tempo]
+
+
+def objetos(colunas, linhas: list[list], tempo=()) -> list[dict]:
+    """Formato legado: um dict por linha, colunas de `tempo` em ISO."""
+    indices = _indices(colunas, tempo)
+    saida = []
+    adicionar = saida.append
+    for valores in linhas:
+        for i in indices:
+            if valores[i] is not None:
+                valores[i] = valores[i].isoformat()
+        adicionar(dict(zip(colunas, valores)))
+    return saida
+
+
+def colunar(colunas, linhas: list[list], tempo=()) -> dict:
+    """format=columnar: colunas uma vez, linhas como arrays, colunas de `tempo` em epoch."""
+    indices = _indices(colunas, tempo)
+    for valores in linhas:
+        for i in indices:
+            if valores[i] is not None:
+                valores[i] = int(valores[i].timestamp())
+    return {"colunas": list(colunas), "tempo": list(tempo), "linhas": linhas}
+
+
+def formatar(colunas, linhas: list[list], tempo=()):
+    """`colunar` se o request pediu format=columnar; senão `objetos`."""
+    if colunar_pedido():
+        return colunar(colunas, linhas, tempo)
+    return objetos(colunas, linhas, tempo)
+
+
+def aceita_gzip() -> bool:
+    return request.accept_encodings.quality("gzip") > 0
+
+
+def comprimir(fn):
+    """Decorator de GET: comprime a resposta 200 com gzip se o cliente aceitar."""
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        resposta = current_app.make_response(fn(*args, **kwargs))
+        if resposta.status_code != 200 or resposta.is_streamed or "Content-Encoding" in resposta.headers:
+            return resposta
+
+        # a representação depende do Accept-Encoding (caches intermediários)
+        resposta.vary.add("Accept-Encoding")
+        if not aceita_gzip():
+            return resposta
+
+        corpo = resposta.get_data()
+        if len(corpo) < GZIP_MIN_BYTES:
+            return resposta
+
+        # mtime=0: mesmo conteúdo, mesmos bytes
+        resposta.set_data(gzip.compress(corpo, compresslevel=GZIP_NIVEL, mtime=0))
+        resposta.headers["Content-Encoding"] = "gzip"
+        return resposta
+
+    return wrapped
@@ -0,0 +1,38 @@
+"""
+GET condicional (ETag / If-None-Match) para as listagens consultadas em polling.
+
+A versão é calculada antes de serializar, com um agregado barato do conjunto
+filtrado (COUNT + MAX(updated_at)) e os parâmetros do request: se o cliente já
+tem essa versão, responde 304 sem carregar objetos nem montar JSON.
+
+Campos relativos ao momento da resposta (tempo_sla_segundos, tempo_prazo_segundos)
+não entram na versão: o front converte para prazo absoluto ao receber.
+
+A ETag é fraca (W/"..."): a mesma versão vale com e sem gzip (api/compacto.py).
+"""
+import hashlib
+
+from flask import current_app, request
+
+# Mudar quando o formato da resposta mudar (invalida as versões em cache nos clientes).
+FORMATO = "1"
+
+
+def versao(*partes) -> str:
+    bruto = "|".join(str(p) for p in (FORMATO, request.full_path, *partes))
+    return hashlib.sha1(bruto.encode()).hexdigest()[:20]
+
+
+def nao_modificado(etag: str):
+    """Resposta 304 se o If-None-Match do request já tem `etag`; senão None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resposta = current_app.response_class(status=304)
+    return com_etag(resposta, etag)
+
+
+def com_etag(resposta, etag: str):
+    resposta.set_etag(etag, weak=True)
+    # sempre revalidar: o conteúdo muda a qualquer escrita
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta
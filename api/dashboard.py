@@ -1,11 +1,19 @@
-from flask import Blueprint, render_template, jsonify, request
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import Blueprint, current_app, render_template, jsonify, request
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
-from sqlalchemy import func
+
+from sqlalchemy import and_, case, false, func, or_, select, true
+from sqlalchemy.exc import OperationalError
 
 from db import db
 from models import Carga, Transferencia
 from api.auth import require_capability, has_capability
+from api import cache_versionado, coalescencia, resumo_diario
+from api.sla_varredura import NO_SHOW_HORAS, SLA_HORAS, instante, segundos_entre
 
 dashboard_bp = Blueprint("dashboard", __name__, url_prefix="/dashboard")
 
@@ -14,14 +22,340 @@ try:
 except Exception:
     LOCAL_TZ = timezone(timedelta(hours=-3))
 
+# Cache do /dashboard/stats (api/cache_versionado.py): a resposta inteira vale
+# por DASHBOARD_CACHE_TTL_SEGUNDOS, porque tem campos relativos a agora (atraso
+# corrente de cargas em aberto e de late stow) que mudam sem nenhuma escrita.
+# Período todo no passado: os grupos que não dependem de agora (agregados,
+# deletadas) ficam guardados à parte por DASHBOARD_CACHE_TTL_PASSADO_SEGUNDOS;
+# só as listas relativas a agora são recalculadas.
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL_SEGUNDOS", "30"))
+DASHBOARD_CACHE_TTL_PASSADO = int(os.getenv("DASHBOARD_CACHE_TTL_PASSADO_SEGUNDOS", str(6 * 3600)))
+
+# Tamanho das tabelas do /dashboard/stats (os totais vêm de COUNT à parte).
+LIMITE_ATRASADAS = 50
+LIMITE_DELETADAS = 100
+LIMITE_LATE_STOW = 100
+
+STATUS_FORA_DO_ATRASO = ("no_show",)
+
+# Grupos de consultas do /dashboard/stats (agregados, atrasadas, late stow,
+# deletadas) rodam em paralelo, cada um na própria conexão do pool.
+# DASHBOARD_CONSULTAS_PARALELAS=0 volta ao sequencial. O pool de threads é do
+# processo: no máximo DASHBOARD_CONSULTAS_WORKERS conexões extras ao mesmo tempo.
+DASHBOARD_PARALELO = os.getenv("DASHBOARD_CONSULTAS_PARALELAS", "1") != "0"
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_CONSULTAS_WORKERS", "4"))
+# Prazo do request inteiro (fila do pool + consultas); no PostgreSQL também
+# vira statement_timeout de cada grupo, para o banco não seguir trabalhando.
+DASHBOARD_PRAZO = float(os.getenv("DASHBOARD_PRAZO_SEGUNDOS", "20"))
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix="dashboard-consulta")
+
+
+class PrazoEsgotado(RuntimeError):
+    """Grupos do /dashboard/stats não terminaram dentro de DASHBOARD_PRAZO (503)."""
+
 
 def _status_pode_ficar_em_atraso(status: str | None) -> bool:
     status_norm = (status or "").strip().lower()
     # Regra de negócio:
     # - no_show sai da lista de atrasos e entra na métrica própria
     # - closed pode permanecer na lista somente quando atraso já foi registrado
-    #   (esse controle é feito pelo campo atraso_registrado no loop principal)
-    return status_norm != "no_show"
+    #   (recalculado de end_time em _cargas_atrasadas)
+    return status_norm not in STATUS_FORA_DO_ATRASO
+
+
+def _agregados_cargas(inicio: datetime, fim: datetime) -> dict:
+    """
+    Totais, séries por dia e por_login do /dashboard/stats a partir dos grupos
+    (status, dia, aa) de api/resumo_diario.py: dias consolidados vêm do rollup,
+    o resto do período é lido de cargas em uma passada. Cada status conta pela
+    própria coluna de data:
+
+      - closed: end_time (totais, unidades/notas por dia, por_login)
+      - deleted: deleted_at (total e por dia)
+      - no_show: created_at (total, units e por dia)
+      - checkin / arrival + arrival_scheduled: created_at (só totais)
+
+    Os totais saem da soma dos grupos (mesmos números das consultas separadas).
+    """
+    grupos = resumo_diario.grupos_periodo(inicio.date(), fim.date())
+
+    totais = {
+        "total_units": 0,
+        "total_units_no_show": 0,
+        "total_notas_fechadas": 0,
+        "total_notas_pendentes": 0,
+        "total_notas_andamento": 0,
+        "total_notas_deletadas": 0,
+        "total_notas_no_show": 0,
+    }
+    unidades_por_dia, notas_por_dia, notas_deletadas_por_dia, no_show_por_dia = {}, {}, {}, {}
+    logins: dict[str, list] = {}
+
+    for g in grupos:
+        qtd, units = int(g.qtd), int(g.units)
+        dia = str(g.dia)
+        if g.status == "closed":
+            totais["total_notas_fechadas"] += qtd
+            totais["total_units"] += units
+            unidades_por_dia[dia] = unidades_por_dia.get(dia, 0) + units
+            notas_por_dia[dia] = notas_por_dia.get(dia, 0) + qtd
+            if g.aa is not None:
+                acc = logins.setdefault(g.aa, [0, 0, 0, 0.0, 0])
+                acc[0] += units
+                acc[1] += qtd
+                acc[2] += int(g.segundos)
+                acc[3] += float(g.soma_uph or 0)
+                acc[4] += int(g.qtd_uph)
+        elif g.status == "deleted":
+            totais["total_notas_deletadas"] += qtd
+            notas_deletadas_por_dia[dia] = notas_deletadas_por_dia.get(dia, 0) + qtd
+        elif g.status == "no_show":
+            totais["total_notas_no_show"] += qtd
+            totais["total_units_no_show"] += units
+            no_show_por_dia[dia] = no_show_por_dia.get(dia, 0) + qtd
+        elif g.status == "checkin":
+            totais["total_notas_andamento"] += qtd
+        else:
+            totais["total_notas_pendentes"] += qtd
+
+    por_login = {
+        aa: {
+            "units": units,
+            "notas": notas,
+            "horas_produzidas": round(segundos / 3600.0, 2),
+            "produtividade_media": round(soma_uph / qtd_uph, 2) if qtd_uph else 0.0,
+        }
+        for aa, (units, notas, segundos, soma_uph, qtd_uph) in sorted(
+            logins.items(), key=lambda item: item[1][0], reverse=True
+        )
+    }
+
+    return {
+        **totais,
+        "unidades_por_dia": unidades_por_dia,
+        "notas_por_dia": notas_por_dia,
+        "notas_deletadas_por_dia": notas_deletadas_por_dia,
+        "no_show_por_dia": no_show_por_dia,
+        "por_login": por_login,
+    }
+
+
+def _to_aware_utc(dt):
+    if not dt:
+        return None
+    if getattr(dt, "tzinfo", None) is None:
+        # No banco, timestamps podem voltar como naive mesmo estando em UTC.
+        # Tratar naive como UTC evita adicionar +3h indevidos no SLA.
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def _iso(dt) -> str | None:
+    dt = _to_aware_utc(dt)
+    return dt.isoformat() if dt else None
+
+
+def _contar_e_listar(filtrada, ordem, limite: int) -> tuple[int, list]:
+    """COUNT(*) do filtro + só as `limite` primeiras linhas na ordem."""
+    total = db.session.execute(
+        select(func.count()).select_from(filtrada.order_by(None).subquery())
+    ).scalar_one()
+    linhas = db.session.execute(filtrada.order_by(*ordem).limit(limite)).all() if total else []
+    return total, linhas
+
+
+def _cargas_atrasadas(inicio: datetime, fim: datetime, agora: datetime) -> tuple[int, list[dict]]:
+    """
+    Cargas com expected no período que estão (ou ficaram) fora do SLA, direto
+    no SQL: total pelo COUNT e só as LIMITE_ATRASADAS primeiras por expected.
+
+    Prazo = expected + 4h (o filtro exige expected, então o fallback por
+    arrived_at/sla_setar_aa_deadline nunca se aplica aqui). Regras:
+
+      - no_show fica fora, assim como arrival_scheduled com +24h do expected
+        (vira no_show na próxima varredura; aqui já é tratada como tal)
+      - closed: atraso = end_time - prazo, só quando positivo (recalculado,
+        sem olhar o persistido)
+      - demais em aberto com prazo vencido: atraso corrente (agora - prazo)
+      - demais dentro do prazo: atraso persistido pela varredura, se registrado
+
+    Somente leitura: no_show/atraso persistidos por api/sla_varredura.py.
+    """
+    sla = int(SLA_HORAS.total_seconds())
+    atraso = case(
+        (Carga.status == "closed", segundos_entre(Carga.expected_arrival_date, Carga.end_time) - sla),
+        (
+            Carga.expected_arrival_date < agora - SLA_HORAS,
+            segundos_entre(Carga.expected_arrival_date, instante(agora)) - sla,
+        ),
+        (Carga.atraso_registrado == true(), Carga.atraso_segundos),
+        else_=0,
+    )
+    filtrada = select(
+        Carga.appointment_id,
+        Carga.status,
+        Carga.expected_arrival_date,
+        atraso.label("atraso"),
+        Carga.units,
+        Carga.cartons,
+        Carga.aa_responsavel,
+        Carga.atraso_comentario,
+    ).where(
+        Carga.expected_arrival_date.isnot(None),
+        Carga.expected_arrival_date >= inicio,
+        Carga.expected_arrival_date <= fim,
+        or_(Carga.status.is_(None), Carga.status.notin_(STATUS_FORA_DO_ATRASO)),
+        ~and_(Carga.status == "arrival_scheduled", Carga.expected_arrival_date < agora - NO_SHOW_HORAS),
+        # Regra: entrou em atraso assim que SLA estoura (qualquer valor > 0).
+        atraso > 0,
+    )
+    total, linhas = _contar_e_listar(filtrada, (Carga.expected_arrival_date.asc(), Carga.id.asc()), LIMITE_ATRASADAS)
+
+    return total, [
+        {
+            "appointment_id": c.appointment_id,
+            "status": c.status,
+            "expected_arrival_date": _iso(c.expected_arrival_date),
+            "tempo_atraso_segundos": int(c.atraso),
+            "units": int(c.units or 0),
+            "cartons": int(c.cartons or 0),
+            "aa_responsavel": c.aa_responsavel,
+            "atraso_comentario": c.atraso_comentario,
+        }
+        for c in linhas
+    ]
+
+
+def _cargas_deletadas(inicio: datetime, fim: datetime) -> list[dict]:
+    """Últimas LIMITE_DELETADAS cargas deletadas no período (por deleted_at)."""
+    linhas = db.session.execute(
+        select(
+            Carga.appointment_id,
+            Carga.status,
+            Carga.expected_arrival_date,
+            Carga.deleted_at,
+            Carga.units,
+            Carga.cartons,
+            Carga.aa_responsavel,
+            Carga.delete_reason,
+        )
+        .where(
+            Carga.status == "deleted",
+            Carga.deleted_at.isnot(None),
+            Carga.deleted_at >= inicio,
+            Carga.deleted_at <= fim,
+        )
+        .order_by(Carga.deleted_at.desc(), Carga.id.desc())
+        .limit(LIMITE_DELETADAS)
+    ).all()
+
+    return [
+        {
+            "appointment_id": c.appointment_id,
+            "status": c.status,
+            "expected_arrival_date": _iso(c.expected_arrival_date),
+            "deleted_at": _iso(c.deleted_at),
+            "units": int(c.units or 0),
+            "cartons": int(c.cartons or 0),
+            "aa_responsavel": c.aa_responsavel,
+            "delete_reason": c.delete_reason,
+        }
+        for c in linhas
+    ]
+
+
+def _transferencias_late_stow(inicio: datetime, fim: datetime, agora: datetime) -> tuple[int, list[dict]]:
+    """
+    Transferências com expected no período e late stow estourado: em aberto
+    com prazo vencido (atraso corrente) ou marcadas pela varredura
+    (prazo_estourado_segundos). Total pelo COUNT, lista limitada.
+    """
+    estourada_agora = and_(Transferencia.finalizada == false(), Transferencia.late_stow_deadline < agora)
+    atraso = case(
+        (estourada_agora, segundos_entre(Transferencia.late_stow_deadline, instante(agora))),
+        else_=Transferencia.prazo_estourado_segundos,
+    )
+    filtrada = select(
+        Transferencia.appointment_id,
+        Transferencia.vrid,
+        Transferencia.origem,
+        Transferencia.expected_arrival_date,
+        Transferencia.late_stow_deadline,
+        Transferencia.finalizada,
+        atraso.label("atraso"),
+        Transferencia.comentario_late_stow,
+    ).where(
+        Transferencia.expected_arrival_date.isnot(None),
+        Transferencia.expected_arrival_date >= inicio,
+        Transferencia.expected_arrival_date <= fim,
+        Transferencia.late_stow_deadline.isnot(None),
+        or_(estourada_agora, Transferencia.prazo_estourado == true()),
+    )
+    total, linhas = _contar_e_listar(
+        filtrada, (Transferencia.expected_arrival_date.asc(), Transferencia.id.asc()), LIMITE_LATE_STOW
+    )
+
+    return total, [
+        {
+            "appointment_id": t.appointment_id,
+            "vrid": t.vrid,
+            "origem": t.origem,
+            "expected_arrival_date": _iso(t.expected_arrival_date),
+            "late_stow_deadline": _iso(t.late_stow_deadline),
+            "status": "finalizada" if t.finalizada else "em_aberto",
+            "tempo_atraso_segundos": int(t.atraso or 0),
+            "comentario_late_stow": t.comentario_late_stow,
+        }
+        for t in linhas
+    ]
+
+
+def _paralelo() -> bool:
+    # sqlite:// em memória é uma conexão só (StaticPool): não há o que paralelizar
+    return DASHBOARD_PARALELO and db.engine.url.database not in (None, "", ":memory:")
+
+
+def _em_contexto(app, prazo: float, fn, *args):
+    """Roda um grupo no pool: app context (e sessão/conexão) próprio da thread."""
+    with app.app_context():
+        try:
+            restante_ms = int((prazo - time.monotonic()) * 1000)
+            if restante_ms <= 0:
+                raise PrazoEsgotado("Prazo esgotado antes de iniciar a consulta")
+            if db.session.get_bind().dialect.name == "postgresql":
+                db.session.execute(
+                    select(func.set_config("statement_timeout", str(restante_ms), true()))
+                )
+            return fn(*args)
+        except OperationalError as e:
+            # 57014 = query_canceled (statement_timeout)
+            if getattr(e.orig, "pgcode", None) == "57014":
+                raise PrazoEsgotado("Consulta do dashboard cancelada pelo statement_timeout") from e
+            raise
+        finally:
+            db.session.remove()
+
+
+def _consultar_grupos(grupos: dict) -> dict:
+    """
+    {nome: (fn, *args)} -> {nome: resultado}. Em paralelo (um grupo por
+    conexão) quando possível; PrazoEsgotado se algum não termina no prazo.
+    """
+    if not _paralelo():
+        return {nome: fn(*args) for nome, (fn, *args) in grupos.items()}
+
+    app = current_app._get_current_object()
+    prazo = time.monotonic() + DASHBOARD_PRAZO
+    futuros = {nome: _executor.submit(_em_contexto, app, prazo, fn, *args) for nome, (fn, *args) in grupos.items()}
+
+    _, pendentes = wait(futuros.values(), timeout=DASHBOARD_PRAZO)
+    if pendentes:
+        for futuro in pendentes:
+            futuro.cancel()
+        raise PrazoEsgotado("Consultas do dashboard excederam o prazo")
+    # result() repassa a exceção do grupo que falhou
+    return {nome: futuro.result() for nome, futuro in futuros.items()}
 
 
 @dashboard_bp.route("/")
@@ -30,8 +364,29 @@ def dashboard_page():
     return render_template("dashboard.html")
 
 
+def _grupos_fixos(grupos: dict, inicio: datetime, fim: datetime, agora: datetime) -> tuple[dict, dict]:
+    """
+    Período todo no passado: separa de `grupos` os que já estão guardados.
+    Retorna (guardados {nome: valor}, chaves {nome: chave} dos que faltam gravar).
+    """
+    if fim >= agora:
+        return {}, {}
+    guardados, chaves = {}, {}
+    for nome in list(grupos):
+        chave = cache_versionado.chave_valor("dashboard", nome, inicio.isoformat(), fim.isoformat())
+        valor = cache_versionado.obter_valor(chave)
+        if valor is None:
+            chaves[nome] = chave
+        else:
+            guardados[nome] = valor
+            del grupos[nome]
+    return guardados, chaves
+
+
 @dashboard_bp.route("/stats")
 @require_capability("dashboard_access")
+@cache_versionado.guardar(lambda: DASHBOARD_CACHE_TTL)
+@coalescencia.compartilhar
 def dashboard_stats():
     data_inicio = request.args.get("dataInicio")
     data_fim = request.args.get("dataFim")
@@ -66,379 +421,37 @@ def dashboard_stats():
     )
 
     agora = datetime.now(timezone.utc)
-
-    def _to_aware_utc(dt):
-        if not dt:
-            return None
-        if getattr(dt, "tzinfo", None) is None:
-            # No banco, timestamps podem voltar como naive mesmo estando em UTC.
-            # Tratar naive como UTC evita adicionar +3h indevidos no SLA.
-            return dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-
-    def _deadline_sla(c):
-        # Regra unificada: ARRIVAL e ARRIVAL_SCHEDULED usam +4h do expected.
-        expected = _to_aware_utc(c.expected_arrival_date)
-        if expected:
-            return expected + timedelta(hours=4)
-
-        # fallback para legados sem expected
-        if c.status == "arrival":
-            base = _to_aware_utc(c.sla_setar_aa_deadline)
-            if base:
-                return base
-            arrived = _to_aware_utc(c.arrived_at)
-            if arrived:
-                return arrived + timedelta(hours=4)
-
-        return None
-
-    # ==========================
-    # CLOSED (fechadas) por end_time
-    # ==========================
-    total_notas_fechadas = (
-        db.session.query(func.count(Carga.id))
-        .filter(
-            Carga.status == "closed",
-            Carga.end_time.isnot(None),
-            Carga.end_time >= inicio,
-            Carga.end_time <= fim
-        )
-        .scalar()
-    ) or 0
-
-    total_units = (
-        db.session.query(func.coalesce(func.sum(Carga.units), 0))
-        .filter(
-            Carga.status == "closed",
-            Carga.end_time.isnot(None),
-            Carga.end_time >= inicio,
-            Carga.end_time <= fim
-        )
-        .scalar()
-    ) or 0
-
-    unidades_por_dia_rows = (
-        db.session.query(
-            func.date(Carga.end_time).label("dia"),
-            func.coalesce(func.sum(Carga.units), 0).label("units")
-        )
-        .filter(
-            Carga.status == "closed",
-            Carga.end_time.isnot(None),
-            Carga.end_time >= inicio,
-            Carga.end_time <= fim
-        )
-        .group_by(func.date(Carga.end_time))
-        .order_by(func.date(Carga.end_time))
-        .all()
-    )
-    unidades_por_dia = {str(r.dia): int(r.units) for r in unidades_por_dia_rows}
-
-    notas_por_dia_rows = (
-        db.session.query(
-            func.date(Carga.end_time).label("dia"),
-            func.count(Carga.id).label("qtd")
-        )
-        .filter(
-            Carga.status == "closed",
-            Carga.end_time.isnot(None),
-            Carga.end_time >= inicio,
-            Carga.end_time <= fim
-        )
-        .group_by(func.date(Carga.end_time))
-        .order_by(func.date(Carga.end_time))
-        .all()
-    )
-    notas_por_dia = {str(r.dia): int(r.qtd) for r in notas_por_dia_rows}
-
-    por_login_rows = (
-        db.session.query(
-            Carga.aa_responsavel,
-            func.coalesce(func.sum(Carga.units), 0).label("units"),
-            func.count(Carga.id).label("notas"),
-            (func.coalesce(func.sum(Carga.tempo_total_segundos), 0) / 3600.0).label("horas_produzidas"),
-            func.coalesce(func.avg(Carga.units_por_hora), 0).label("produtividade_media")
-        )
-        .filter(
-            Carga.status == "closed",
-            Carga.end_time.isnot(None),
-            Carga.end_time >= inicio,
-            Carga.end_time <= fim,
-            Carga.aa_responsavel.isnot(None)
-        )
-        .group_by(Carga.aa_responsavel)
-        .order_by(func.sum(Carga.units).desc())
-        .all()
-    )
-    por_login = {
-        r.aa_responsavel: {
-            "units": int(r.units),
-            "notas": int(r.notas),
-            "horas_produzidas": round(float(r.horas_produzidas or 0), 2),
-            "produtividade_media": round(float(r.produtividade_media or 0), 2),
-        }
-        for r in por_login_rows
+    fixos = {
+        "agregados": (_agregados_cargas, inicio, fim),
+        "deletadas": (_cargas_deletadas, inicio, fim),
     }
-
-    # ==========================
-    # CHECKIN (andamento) por created_at
-    # ==========================
-    total_notas_andamento = (
-        db.session.query(func.count(Carga.id))
-        .filter(
-            Carga.status == "checkin",
-            Carga.created_at >= inicio,
-            Carga.created_at <= fim
-        )
-        .scalar()
-    ) or 0
-
-    # ==========================
-    # ARRIVAL + ARRIVAL_SCHEDULED (pendentes) por created_at
-    # ==========================
-    total_notas_pendentes = (
-        db.session.query(func.count(Carga.id))
-        .filter(
-            Carga.status.in_(["arrival", "arrival_scheduled"]),
-            Carga.created_at >= inicio,
-            Carga.created_at <= fim
-        )
-        .scalar()
-    ) or 0
-
-    # ==========================
-    # DELETED por deleted_at
-    # ==========================
-    total_notas_deletadas = (
-        db.session.query(func.count(Carga.id))
-        .filter(
-            Carga.status == "deleted",
-            Carga.deleted_at.isnot(None),
-            Carga.deleted_at >= inicio,
-            Carga.deleted_at <= fim
-        )
-        .scalar()
-    ) or 0
-
-    deletadas_por_dia_rows = (
-        db.session.query(
-            func.date(Carga.deleted_at).label("dia"),
-            func.count(Carga.id).label("qtd")
-        )
-        .filter(
-            Carga.status == "deleted",
-            Carga.deleted_at.isnot(None),
-            Carga.deleted_at >= inicio,
-            Carga.deleted_at <= fim
-        )
-        .group_by(func.date(Carga.deleted_at))
-        .order_by(func.date(Carga.deleted_at))
-        .all()
-    )
-    notas_deletadas_por_dia = {str(r.dia): int(r.qtd) for r in deletadas_por_dia_rows}
-
-    cargas_deletadas_rows = (
-        Carga.query
-        .filter(
-            Carga.status == "deleted",
-            Carga.deleted_at.isnot(None),
-            Carga.deleted_at >= inicio,
-            Carga.deleted_at <= fim,
-        )
-        .order_by(Carga.deleted_at.desc())
-        .all()
-    )
-
-    cargas_deletadas = []
-    for c in cargas_deletadas_rows:
-        cargas_deletadas.append({
-            "appointment_id": c.appointment_id,
-            "status": c.status,
-            "expected_arrival_date": _to_aware_utc(c.expected_arrival_date).isoformat() if c.expected_arrival_date else None,
-            "deleted_at": _to_aware_utc(c.deleted_at).isoformat() if c.deleted_at else None,
-            "units": int(c.units or 0),
-            "cartons": int(c.cartons or 0),
-            "aa_responsavel": c.aa_responsavel,
-            "delete_reason": c.delete_reason,
+    guardados, chaves = _grupos_fixos(fixos, inicio, fim, agora)
+    try:
+        grupos = _consultar_grupos({
+            **fixos,
+            "atrasadas": (_cargas_atrasadas, inicio, fim, agora),
+            "late_stow": (_transferencias_late_stow, inicio, fim, agora),
         })
+    except PrazoEsgotado as e:
+        current_app.logger.warning("Dashboard stats: %s", e)
+        return jsonify({"error": str(e)}), 503
 
-    # ==========================
-    # NO SHOW por created_at (mantendo sua lógica atual)
-    # ==========================
-    total_notas_no_show = (
-        db.session.query(func.count(Carga.id))
-        .filter(
-            Carga.status == "no_show",
-            Carga.created_at >= inicio,
-            Carga.created_at <= fim
-        )
-        .scalar()
-    ) or 0
+    for nome, chave in chaves.items():
+        cache_versionado.gravar_valor(chave, grupos[nome], DASHBOARD_CACHE_TTL_PASSADO)
+    grupos.update(guardados)
 
-    no_show_por_dia_rows = (
-        db.session.query(
-            func.date(Carga.created_at).label("dia"),
-            func.count(Carga.id).label("qtd")
-        )
-        .filter(
-            Carga.status == "no_show",
-            Carga.created_at >= inicio,
-            Carga.created_at <= fim
-        )
-        .group_by(func.date(Carga.created_at))
-        .order_by(func.date(Carga.created_at))
-        .all()
-    )
-    no_show_por_dia = {str(r.dia): int(r.qtd) for r in no_show_por_dia_rows}
-
-    total_units_no_show = (
-        db.session.query(func.coalesce(func.sum(Carga.units), 0))
-        .filter(
-            Carga.status == "no_show",
-            Carga.created_at >= inicio,
-            Carga.created_at <= fim
-        )
-        .scalar()
-    ) or 0
-
-    # Lista de atrasos respeita o filtro de data do dashboard.
-    cargas_sla = (
-        Carga.query
-        .filter(
-            Carga.expected_arrival_date.isnot(None),
-            Carga.expected_arrival_date >= inicio,
-            Carga.expected_arrival_date <= fim,
-        )
-        .order_by(Carga.expected_arrival_date.asc())
-        .all()
-    )
-
-    def _atraso_fechamento_segundos(c):
-        deadline = _deadline_sla(c)
-        end_time = _to_aware_utc(c.end_time)
-        if not deadline or not end_time:
-            return 0
-        return max(0, int((end_time - deadline).total_seconds()))
-
-    cargas_atrasadas = []
-    mudou_status = False
-    mudou_atraso = False
-    for c in cargas_sla:
-        # Apenas ARRIVAL_SCHEDULED pode virar NO_SHOW (24h após expected).
-        if c.status == "arrival_scheduled":
-            expected = _to_aware_utc(c.expected_arrival_date)
-            if expected and agora > (expected + timedelta(hours=24)):
-                c.status = "no_show"
-                mudou_status = True
-
-        if not _status_pode_ficar_em_atraso(c.status):
-            continue
-
-        deadline = _deadline_sla(c)
-        if not deadline:
-            continue
-
-        ofendeu_agora = agora > deadline
-        ofendeu_historico = bool(c.atraso_registrado)
-
-        if c.status == "closed":
-            atraso_fechamento = _atraso_fechamento_segundos(c)
-            atraso_atual = int(c.atraso_segundos or 0)
-            flag_nova = atraso_fechamento > 0
-            if atraso_atual != atraso_fechamento or bool(c.atraso_registrado) != flag_nova:
-                c.atraso_segundos = atraso_fechamento
-                c.atraso_registrado = flag_nova
-                mudou_atraso = True
-
-            ofendeu_agora = False
-            ofendeu_historico = flag_nova
-
-        if not ofendeu_agora and not ofendeu_historico:
-            continue
-
-        if ofendeu_agora:
-            atraso = int((agora - deadline).total_seconds())
-        else:
-            atraso = int(c.atraso_segundos or 0)
-
-        # Regra: entrou em atraso assim que SLA estoura (qualquer valor > 0).
-        if atraso <= 0:
-            continue
-
-        expected_utc = _to_aware_utc(c.expected_arrival_date)
-        cargas_atrasadas.append({
-            "appointment_id": c.appointment_id,
-            "status": c.status,
-            "expected_arrival_date": expected_utc.isoformat() if expected_utc else None,
-            "tempo_atraso_segundos": atraso,
-            "units": int(c.units or 0),
-            "cartons": int(c.cartons or 0),
-            "aa_responsavel": c.aa_responsavel,
-            "atraso_comentario": c.atraso_comentario,
-        })
-
-    if mudou_status or mudou_atraso:
-        db.session.commit()
-
-    transferencias_rows = (
-        Transferencia.query
-        .filter(
-            Transferencia.expected_arrival_date.isnot(None),
-            Transferencia.expected_arrival_date >= inicio,
-            Transferencia.expected_arrival_date <= fim,
-        )
-        .order_by(Transferencia.expected_arrival_date.asc())
-        .all()
-    )
-
-    transferencias_late = []
-    for t in transferencias_rows:
-        deadline = _to_aware_utc(t.late_stow_deadline)
-        if not deadline:
-            continue
-
-        estourada_agora = (not t.finalizada) and (agora > deadline)
-        estourada_historica = bool(t.prazo_estourado)
-
-        if not estourada_agora and not estourada_historica:
-            continue
-
-        if estourada_agora:
-            atraso_seg = int((agora - deadline).total_seconds())
-        else:
-            atraso_seg = int(t.prazo_estourado_segundos or 0)
-
-        transferencias_late.append({
-            "appointment_id": t.appointment_id,
-            "vrid": t.vrid,
-            "origem": t.origem,
-            "expected_arrival_date": _to_aware_utc(t.expected_arrival_date).isoformat() if t.expected_arrival_date else None,
-            "late_stow_deadline": deadline.isoformat(),
-            "status": "finalizada" if t.finalizada else "em_aberto",
-            "tempo_atraso_segundos": atraso_seg,
-            "comentario_late_stow": t.comentario_late_stow,
-        })
+    agregados = grupos["agregados"]
+    total_atrasadas, cargas_atrasadas = grupos["atrasadas"]
+    total_late, transferencias_late = grupos["late_stow"]
 
     payload = {
-        "total_units": int(total_units),
-        "total_units_no_show": int(total_units_no_show),
-        "total_notas_fechadas": int(total_notas_fechadas),
-        "total_notas_pendentes": int(total_notas_pendentes),
-        "total_notas_andamento": int(total_notas_andamento),
-        "total_notas_deletadas": int(total_notas_deletadas),
-        "total_notas_no_show": int(total_notas_no_show),
-        "unidades_por_dia": unidades_por_dia,
-        "notas_por_dia": notas_por_dia,
-        "notas_deletadas_por_dia": notas_deletadas_por_dia,
-        "no_show_por_dia": no_show_por_dia,
-        "por_login": por_login,
-        "produtividade_por_aa": por_login,
-        "total_cargas_atrasadas": len(cargas_atrasadas),
-        "cargas_atrasadas": cargas_atrasadas[:50],
-        "total_transferencias_late_stow": len(transferencias_late),
-        "transferencias_late_stow": transferencias_late[:100],
-        "cargas_deletadas": cargas_deletadas[:100],
+        **agregados,
+        "produtividade_por_aa": agregados["por_login"],
+        "total_cargas_atrasadas": total_atrasadas,
+        "cargas_atrasadas": cargas_atrasadas,
+        "total_transferencias_late_stow": total_late,
+        "transferencias_late_stow": transferencias_late,
+        "cargas_deletadas": grupos["deletadas"],
     }
 
     if not has_capability("dashboard_tables"):
@@ -0,0 +1,150 @@
+"""
+Eventos de alteração de cargas para o canal SSE do painel (/pc/stream).
+
+Quem grava chama `publicar(tipo, **dados)` ANTES do commit:
+  - PostgreSQL: vira pg_notify no canal CANAL_PG, entregue só se a transação
+    commitar e a todos os processos/workers. Em cada processo, uma thread
+    (LISTEN) repassa as notificações às filas dos streams abertos.
+  - Demais bancos (dev/testes): o evento fica pendente na sessão e é entregue
+    às filas do próprio processo no after_commit (rollback descarta).
+
+O payload é pequeno de propósito: o cliente só usa o evento como gatilho para
+buscar o delta em /pc/listar?since=<cursor>.
+
+Observadores (observar) são avisados também no after_commit do próprio
+processo no PostgreSQL, sem esperar o LISTEN: lá recebem o mesmo evento duas
+vezes, então o callback precisa ser idempotente (invalidar cache etc.).
+
+Tipos em TIPOS_FORA_DO_STREAM (escritas em transferencias) só vão para os
+observadores; as filas do /pc/stream não os recebem.
+"""
+import json
+import queue
+import select
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, select as sql_select
+from sqlalchemy.orm import Session
+
+from db import db
+
+CANAL_PG = "cargas_eventos"
+
+# Fila por stream aberto; cliente lento perde eventos (o próximo delta cobre).
+TAMANHO_FILA = 100
+
+_PENDENTES = "eventos_cargas_pendentes"
+
+TIPOS_FORA_DO_STREAM = {"transferencia"}
+
+_assinantes: set[queue.Queue] = set()
+_observadores: list = []
+_lock = threading.Lock()
+_ouvinte: threading.Thread | None = None
+
+
+def _postgres() -> bool:
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def publicar(tipo: str, **dados) -> None:
+    """Registra o evento na transação corrente (entregue no commit)."""
+    payload = json.dumps({"tipo": tipo, **dados}, default=str)
+    postgres = _postgres()
+    if postgres:
+        db.session.execute(sql_select(func.pg_notify(CANAL_PG, payload)))
+    # no PG o commit local avisa só os observadores (as filas recebem pelo LISTEN)
+    db.session.info.setdefault(_PENDENTES, []).append((payload, not postgres))
+
+
+def _notificar_observadores(payload: str) -> None:
+    for observador in _observadores:
+        observador(payload)
+
+
+def _entregar(payload: str) -> None:
+    _notificar_observadores(payload)
+
+    if json.loads(payload).get("tipo") in TIPOS_FORA_DO_STREAM:
+        return
+
+    with _lock:
+        filas = list(_assinantes)
+    for fila in filas:
+        try:
+            fila.put_nowait(payload)
+        except queue.Full:
+            pass
+
+
+@event.listens_for(Session, "after_commit")
+def _apos_commit(session) -> None:
+    for payload, para_filas in session.info.pop(_PENDENTES, []):
+        if para_filas:
+            _entregar(payload)
+        else:
+            _notificar_observadores(payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _apos_rollback(session) -> None:
+    session.info.pop(_PENDENTES, None)
+
+
+def assinar() -> queue.Queue:
+    """Fila que recebe os eventos (JSON) deste processo; sobe o LISTEN no PG."""
+    fila: queue.Queue = queue.Queue(maxsize=TAMANHO_FILA)
+    with _lock:
+        _assinantes.add(fila)
+    if _postgres():
+        _iniciar_ouvinte(current_app._get_current_object())
+    return fila
+
+
+def observar(callback) -> None:
+    """callback(payload) a cada evento recebido por este processo (inclusive de outros workers no PG)."""
+    with _lock:
+        if callback not in _observadores:
+            _observadores.append(callback)
+    if _postgres():
+        _iniciar_ouvinte(current_app._get_current_object())
+
+
+def cancelar(fila: queue.Queue) -> None:
+    with _lock:
+        _assinantes.discard(fila)
+
+
+def _ouvir(app) -> None:
+    while True:
+        try:
+            with app.app_context():
+                conexao = db.engine.raw_connection()
+            try:
+                pg = conexao.driver_connection
+                pg.autocommit = True
+                with pg.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_PG}")
+                while True:
+                    if select.select([pg], [], [], 30) == ([], [], []):
+                        continue
+                    pg.poll()
+                    while pg.notifies:
+                        _entregar(pg.notifies.pop(0).payload)
+            finally:
+                conexao.invalidate()
+        except Exception:
+            app.logger.exception("Erro no LISTEN de eventos de cargas")
+            time.sleep(5)
+
+
+def _iniciar_ouvinte(app) -> None:
+    """Uma thread de LISTEN por processo (dedicada, fora do pool da sessão)."""
+    global _ouvinte
+    with _lock:
+        if _ouvinte is not None and _ouvinte.is_alive():
+            return
+        _ouvinte = threading.Thread(target=_ouvir, args=(app,), name="eventos-cargas", daemon=True)
+        _ouvinte.start()
@@ -1,13 +1,19 @@
 # /app/api/painel.py
-from flask import Blueprint, jsonify, request, render_template, current_app
+import os
+import queue
+import threading
+
+from flask import Blueprint, Response, jsonify, request, render_template, current_app
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 
-from sqlalchemy import text
+from sqlalchemy import Float, and_, case, cast, false, func, or_, select, text, true, tuple_, update
 
 from db import db
 from models import Carga  # Operador pode ficar no models, mas aqui vamos consultar via SQL direto
-from api.auth import require_capability
+from api.auth import has_capability, require_capability
+from api import coalescencia, compacto, condicional, eventos_cargas, resumo_diario
+from api.sla_varredura import SLA_HORAS, instante, segundos_entre
 
 painel_bp = Blueprint("painel", __name__, url_prefix="/pc")
 
@@ -77,94 +83,396 @@ def painel_page():
 # =====================================================
 # CARGAS
 # =====================================================
-@painel_bp.route("/listar")
-def listar_cargas():
+# Status com contagem de SLA (+4h do Expected Arrival Date).
+STATUS_SLA_ATIVO = ("arrival", "arrival_scheduled", "checkin")
+
+# O cursor devolvido volta um pouco no tempo: escritas com updated_at carimbado
+# antes do commit (transações em andamento) não se perdem entre dois polls.
+PC_CURSOR_MARGEM = timedelta(seconds=int(os.getenv("PC_CURSOR_MARGEM_SEGUNDOS", "30")))
+
+# Hot set do painel (ativas=1): status com SLA + fechadas nas últimas horas.
+PC_FECHADAS_RECENTES = timedelta(hours=int(os.getenv("PC_FECHADAS_RECENTES_HORAS", "24")))
+
+# Página do /pc/listar?since= (keyset em expected_arrival_date, id).
+PC_LISTAR_LIMITE = int(os.getenv("PC_LISTAR_LIMITE", "1000"))
+PC_LISTAR_LIMITE_MAX = 5000
+
+# Comentário SSE enviado quando não há evento: mantém proxies abertos e
+# detecta cliente desconectado (a escrita falha e o worker libera a thread).
+PC_STREAM_HEARTBEAT = int(os.getenv("PC_STREAM_HEARTBEAT_SEGUNDOS", "25"))
+
+# Cada stream prende uma thread do gunicorn (gthread) enquanto a tela está
+# aberta. Acima de PC_STREAM_MAX streams simultâneos o /pc/stream responde 503
+# e o painel fica no polling; sobra thread para o resto (ver gunicorn.conf.py).
+PC_STREAM_MAX = int(os.getenv("PC_STREAM_MAX", "12"))
+PC_STREAM_RETRY_SEGUNDOS = int(os.getenv("PC_STREAM_RETRY_SEGUNDOS", "60"))
+_vagas_stream = threading.BoundedSemaphore(PC_STREAM_MAX)
+
+
+# Leitura enxuta do painel: só as colunas que a tela usa, como tuplas (sem
+# hidratar Carga nem carregar delete_reason/comentários que o painel não mostra).
+COLUNAS_PAINEL = (
+    Carga.id,
+    Carga.appointment_id,
+    Carga.truck_type,
+    Carga.truck_tipo,
+    Carga.expected_arrival_date,
+    Carga.status,
+    Carga.units,
+    Carga.cartons,
+    Carga.aa_responsavel,
+    Carga.start_time,
+    Carga.tempo_total_segundos,
+    Carga.atraso_segundos,
+    Carga.atraso_registrado,
+    Carga.atraso_comentario,
+    Carga.priority_score,
+    Carga.arrived_at,
+)
+
+_SLA_SEGUNDOS = 4 * 3600
+_ZERO = timedelta(0)
+
+
+def _utc(dt: datetime | None) -> datetime | None:
+    """_to_aware_utc sem o astimezone quando o valor já vem em UTC (caso do PostgreSQL com timezone=UTC)."""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    if dt.utcoffset() == _ZERO:
+        return dt
+    return dt.astimezone(timezone.utc)
+
+
+# Campos da resposta, na ordem das linhas de _valores_linhas (e das "colunas" no format=columnar).
+CAMPOS_PAINEL = (
+    "id",
+    "appointment_id",
+    "truck_type",
+    "truck_tipo",
+    "expected_arrival_date",
+    "status",
+    "units",
+    "cartons",
+    "aa_responsavel",
+    "start_time",
+    "tempo_total_segundos",
+    # tempo do SLA (front decide se mostra vermelho quando negativo)
+    "tempo_sla_segundos",
+    # atraso: corrente para cargas em aberto, persistido no fechamento
+    "atraso_segundos",
+    "atraso_registrado",
+    "atraso_comentario",
+    "priority_score",
+)
+CAMPOS_TEMPO_PAINEL = ("expected_arrival_date", "start_time")
+
+
+def _valores_linhas(linhas, agora: datetime) -> list[list]:
+    """
+    Tuplas de COLUNAS_PAINEL -> listas de valores na ordem de CAMPOS_PAINEL
+    (datetimes em UTC; api/compacto.py converte para ISO ou epoch).
+    O prazo do SLA é calculado em epoch (sem timedelta por linha); o atraso
+    de cargas em aberto também é o corrente (a varredura só grava o marcador
+    de quando estourou e o valor no fechamento).
+    """
+    agora_ts = agora.timestamp()
+    utc = _utc
+    saida = []
+    adicionar = saida.append
+
+    for (
+        carga_id, appointment_id, truck_type, truck_tipo, expected, status, units, cartons,
+        aa_responsavel, start_time, tempo_total, atraso_segundos, atraso_registrado,
+        atraso_comentario, priority_score, arrived_at,
+    ) in linhas:
+        expected = utc(expected)
+
+        tempo_sla_segundos = None
+        atraso_segundos = int(atraso_segundos or 0)
+        atraso_registrado = bool(atraso_registrado)
+        if status in STATUS_SLA_ATIVO:
+            # mesma regra de _deadline_sla_por_expected: expected + 4h, fallback arrived_at + 4h
+            base = expected or utc(arrived_at)
+            if base is not None:
+                tempo_sla_segundos = int(base.timestamp() + _SLA_SEGUNDOS - agora_ts)
+                if tempo_sla_segundos < 0:
+                    atraso_segundos = max(atraso_segundos, -tempo_sla_segundos)
+                    atraso_registrado = True
+
+        adicionar([
+            carga_id,
+            appointment_id,
+            truck_type,
+            truck_tipo,
+            expected,
+            status,
+            int(units or 0),
+            int(cartons or 0),
+            aa_responsavel,
+            utc(start_time),
+            int(tempo_total) if tempo_total is not None else None,
+            tempo_sla_segundos,
+            atraso_segundos,
+            atraso_registrado,
+            atraso_comentario,
+            float(priority_score or 0),
+        ])
+
+    return saida
+
+
+def _serializar_linhas(linhas, agora: datetime) -> list[dict]:
+    """Formato de objetos (legado) da resposta do /pc/listar."""
+    return compacto.objetos(CAMPOS_PAINEL, _valores_linhas(linhas, agora), CAMPOS_TEMPO_PAINEL)
+
+
+def _formatar_linhas(linhas, agora: datetime):
+    """Objetos ou format=columnar, conforme o request."""
+    return compacto.formatar(CAMPOS_PAINEL, _valores_linhas(linhas, agora), CAMPOS_TEMPO_PAINEL)
+
+
+def _ler_painel(query) -> list:
+    """Executa a query filtrada do painel em Core, trazendo só COLUNAS_PAINEL."""
+    return db.session.execute(query.with_entities(*COLUNAS_PAINEL).statement).all()
+
+
+def _parse_cursor(raw: str | None) -> datetime | None:
+    """Cursor ISO devolvido pelo próprio /pc/listar; vazio/inválido = snapshot completo."""
     try:
-        agora = datetime.now(timezone.utc)
+        cursor = datetime.fromisoformat((raw or "").strip())
+    except ValueError:
+        return None
+    return _to_aware_utc(cursor)
 
-        cargas = Carga.query.order_by(Carga.expected_arrival_date.asc()).all()
-        lista = []
-        mudou_algo = False
 
-        for c in cargas:
-            expected = c.expected_arrival_date
-            if expected and expected.tzinfo is None:
-                expected = expected.replace(tzinfo=timezone.utc)
+class FiltroInvalido(ValueError):
+    """Parâmetro de filtro/paginação do /pc/listar inválido (400)."""
+
+
+def _parse_limite_expected(raw: str, fim_do_dia: bool) -> datetime:
+    """`de`/`ate`: data local (YYYY-MM-DD, dia inteiro) ou datetime ISO."""
+    try:
+        valor = datetime.fromisoformat(raw)
+    except ValueError:
+        raise FiltroInvalido(f"Data inválida: {raw}")
+
+    if len(raw) == 10 and fim_do_dia:
+        valor = valor + timedelta(days=1)
+    if valor.tzinfo is None:
+        valor = valor.replace(tzinfo=LOCAL_TZ)
+    return valor.astimezone(timezone.utc)
 
-            # ✅ NO SHOW só para ARRIVAL_SCHEDULED (24h após expected)
-            if c.status == "arrival_scheduled" and expected:
-                if agora > (expected + timedelta(hours=24)):
-                    c.status = "no_show"
-                    mudou_algo = True
 
-            tempo_sla_segundos = None
+def _parse_pagina(raw: str) -> tuple[datetime, int]:
+    """Token `proxima` devolvido pelo próprio /pc/listar: "<expected ISO>|<id>"."""
+    try:
+        expected, carga_id = raw.rsplit("|", 1)
+        return _to_aware_utc(datetime.fromisoformat(expected)), int(carga_id)
+    except ValueError:
+        raise FiltroInvalido("Parâmetro 'apos' inválido")
+
+
+def _filtrar_intervalo(query, args):
+    """de/ate (expected_arrival_date) e appointment (prefixo)."""
+    de = (args.get("de") or "").strip()
+    if de:
+        query = query.filter(Carga.expected_arrival_date >= _parse_limite_expected(de, fim_do_dia=False))
+
+    ate = (args.get("ate") or "").strip()
+    if ate:
+        limite = _parse_limite_expected(ate, fim_do_dia=True)
+        if len(ate) == 10:
+            query = query.filter(Carga.expected_arrival_date < limite)
+        else:
+            query = query.filter(Carga.expected_arrival_date <= limite)
 
-            # ✅ Regra de SLA única:
-            # ARRIVAL, ARRIVAL_SCHEDULED e CHECKIN ofendem em +4h do Expected Arrival Date.
-            if c.status in ("arrival", "arrival_scheduled", "checkin"):
-                deadline = _deadline_sla_por_expected(c)
+    appointment = (args.get("appointment") or "").strip()
+    if appointment:
+        escapado = appointment.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(Carga.appointment_id.like(f"{escapado}%", escape="\\"))
 
-                if deadline:
-                    tempo_sla_segundos = int((deadline - agora).total_seconds())
+    return query
 
-                    # ✅ registrador de atraso persistente
-                    if tempo_sla_segundos < 0:
-                        atraso_atual = abs(tempo_sla_segundos)
-                        if (not c.atraso_registrado) or (atraso_atual > int(c.atraso_segundos or 0)):
-                            c.atraso_segundos = atraso_atual
-                            c.atraso_registrado = True
-                            mudou_algo = True
 
-            if c.status == "closed":
-                atraso_real = _atraso_fechamento_segundos(c)
-                atraso_atual = int(c.atraso_segundos or 0)
-                flag_atual = bool(c.atraso_registrado)
-                flag_nova = atraso_real > 0
+def _condicoes_conjunto(args, agora: datetime) -> list:
+    """status (repetido ou separado por vírgula), aa (exato) e ativas=1 (hot set)."""
+    condicoes = []
 
-                if atraso_atual != atraso_real or flag_atual != flag_nova:
-                    c.atraso_segundos = atraso_real
-                    c.atraso_registrado = flag_nova
-                    mudou_algo = True
+    status = [s.strip().lower() for v in args.getlist("status") for s in v.split(",") if s.strip()]
+    if status:
+        condicoes.append(Carga.status.in_(status))
 
-            start_time_utc = _to_aware_utc(c.start_time)
+    aa = (args.get("aa") or "").strip()
+    if aa:
+        condicoes.append(Carga.aa_responsavel == aa)
 
-            lista.append({
-                "id": c.id,
-                "appointment_id": c.appointment_id,
+    if args.get("ativas") == "1":
+        # cada ramo casa com um índice parcial (ix_cargas_ativas / ix_cargas_fechadas_end_time)
+        condicoes.append(or_(
+            Carga.status.in_(STATUS_SLA_ATIVO),
+            and_(Carga.status == "closed", Carga.end_time >= agora - PC_FECHADAS_RECENTES),
+        ))
 
-                "truck_type": getattr(c, "truck_type", None),
-                "truck_tipo": getattr(c, "truck_tipo", None),
+    return condicoes
+
+
+def _filtrar_cargas(query, args, agora: datetime):
+    """
+    Filtros do servidor, os mesmos no snapshot e no delta: _filtrar_intervalo
+    + _condicoes_conjunto.
+    """
+    return _filtrar_intervalo(query, args).filter(*_condicoes_conjunto(args, agora))
 
-                "expected_arrival_date": expected.isoformat() if expected else None,
-                "status": c.status,
 
-                "units": int(c.units or 0),
-                "cartons": int(c.cartons or 0),
-                "aa_responsavel": c.aa_responsavel,
-                "start_time": start_time_utc.isoformat() if start_time_utc else None,
-                "tempo_total_segundos": int(c.tempo_total_segundos) if c.tempo_total_segundos is not None else None,
+def _ids_fora_do_conjunto(alteradas, condicoes: list) -> list[int]:
+    """
+    Delta: cargas alteradas desde o cursor que não casam mais com
+    status/aa/ativas (ex.: saiu de checkin com filtro de status). Vão só os
+    ids, em "removidas", para o cliente tirar da tela.
+    """
+    if not condicoes:
+        return []
+    # coalesce: comparação com NULL (ex.: aa_responsavel limpo) também é "fora"
+    fora = alteradas.filter(~func.coalesce(and_(*condicoes), false()))
+    return [carga_id for (carga_id,) in fora.with_entities(Carga.id).order_by(Carga.id)]
 
-                # ✅ tempo do SLA (front decide se mostra vermelho quando negativo)
-                "tempo_sla_segundos": tempo_sla_segundos,
 
-                # ✅ atraso persistido
-                "atraso_segundos": int(c.atraso_segundos or 0),
-                "atraso_registrado": bool(c.atraso_registrado),
-                "atraso_comentario": c.atraso_comentario,
+def _parse_limite(raw: str | None) -> int:
+    if not raw:
+        return PC_LISTAR_LIMITE
+    try:
+        limite = int(raw)
+    except ValueError:
+        raise FiltroInvalido("Parâmetro 'limite' inválido")
+    return max(1, min(limite, PC_LISTAR_LIMITE_MAX))
 
-                "priority_score": float(c.priority_score or 0),
-            })
 
-        if mudou_algo:
-            db.session.commit()
+@painel_bp.route("/listar")
+@coalescencia.compartilhar
+@compacto.comprimir
+def listar_cargas():
+    """
+    Sem `since`: lista (formato legado, um array), sem paginação.
+    Com `since`: {"cargas", "cursor", "completo", "proxima"}. since vazio (ou
+    inválido) devolve o snapshot; since=<cursor> devolve só as cargas
+    alteradas depois dele. O próximo poll usa o "cursor" da resposta.
+
+    Filtros: ver _filtrar_cargas (iguais no snapshot e no delta). Com `since`,
+    a resposta vem em páginas de `limite` (padrão PC_LISTAR_LIMITE) ordenadas
+    por (expected_arrival_date, id); havendo mais, "proxima" é o valor de
+    `apos` para a página seguinte (mantendo o cursor da primeira página).
+    No delta, "removidas" (só na primeira página) traz os ids alterados que
+    saíram do filtro (status/aa/ativas).
+
+    Somente leitura: no_show/atraso são gravados pela varredura (api/sla_varredura.py),
+    que atualiza updated_at e assim entra no próximo delta.
+
+    ETag = COUNT + MAX(updated_at) do conjunto filtrado (api/condicional.py);
+    If-None-Match igual responde 304.
+
+    format=columnar: a lista (o array legado, ou "cargas" com since) vem no
+    formato colunar de api/compacto.py; gzip conforme Accept-Encoding.
+    """
+    incremental = "since" in request.args
 
-        return jsonify(lista), 200
+    try:
+        agora = datetime.now(timezone.utc)
+        since = _parse_cursor(request.args.get("since")) if incremental else None
+
+        query = _filtrar_cargas(Carga.query, request.args, agora)
+        versionada = query
+        if since is not None:
+            query = query.filter(Carga.updated_at > since)
+            # alteradas no intervalo, dentro ou fora de status/aa/ativas (as de fora vão em "removidas")
+            versionada = _filtrar_intervalo(Carga.query, request.args).filter(Carga.updated_at > since)
+
+        # Versão do conjunto filtrado antes de carregar/serializar (If-None-Match -> 304).
+        total, ultima_escrita = versionada.with_entities(func.count(Carga.id), func.max(Carga.updated_at)).one()
+        etag = condicional.versao(total, ultima_escrita)
+        nao_modificado = condicional.nao_modificado(etag)
+        if nao_modificado is not None:
+            return nao_modificado
+
+        query = query.order_by(Carga.expected_arrival_date.asc(), Carga.id.asc())
+
+        if not incremental:
+            return condicional.com_etag(jsonify(_formatar_linhas(_ler_painel(query), agora)), etag), 200
+
+        apos = (request.args.get("apos") or "").strip()
+        if apos:
+            query = query.filter(tuple_(Carga.expected_arrival_date, Carga.id) > tuple_(*_parse_pagina(apos)))
+
+        removidas = []
+        if since is not None and not apos:
+            removidas = _ids_fora_do_conjunto(versionada, _condicoes_conjunto(request.args, agora))
+
+        limite = _parse_limite(request.args.get("limite"))
+        linhas = _ler_painel(query.limit(limite + 1))
+
+        proxima = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            proxima = f"{_utc(linhas[-1].expected_arrival_date).isoformat()}|{linhas[-1].id}"
+
+        return condicional.com_etag(jsonify({
+            "cargas": _formatar_linhas(linhas, agora),
+            "cursor": (agora - PC_CURSOR_MARGEM).isoformat(),
+            "completo": since is None,
+            "proxima": proxima,
+            "removidas": removidas,
+        }), etag), 200
+
+    except FiltroInvalido as e:
+        return jsonify({"error": str(e)}), 400
 
     except Exception:
         current_app.logger.exception("Erro em /pc/listar")
+        if incremental:
+            return jsonify({"cargas": [], "cursor": None, "completo": False, "proxima": None, "removidas": []}), 200
         return jsonify([]), 200
 
 
+@painel_bp.route("/stream")
+def stream_cargas():
+    """
+    Server-Sent Events: um evento "carga" por alteração commitada (ações do
+    painel, upload, varredura de SLA). O painel usa o evento só como gatilho
+    para o delta de /pc/listar?since=; se o stream cair, volta ao polling.
+    Sem vaga (PC_STREAM_MAX), 503 com Retry-After: o painel segue no polling.
+    """
+    vagas = _vagas_stream
+    if not vagas.acquire(blocking=False):
+        return jsonify({"error": "Limite de streams atingido; use o polling."}), 503, {
+            "Retry-After": str(PC_STREAM_RETRY_SEGUNDOS),
+        }
+
+    fila = eventos_cargas.assinar()
+
+    def gerar():
+        try:
+            # retry: espera do EventSource antes de reconectar
+            yield "retry: 5000\n: conectado\n\n"
+            while True:
+                try:
+                    payload = fila.get(timeout=PC_STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: carga\ndata: {payload}\n\n"
+        finally:
+            eventos_cargas.cancelar(fila)
+
+    resposta = Response(gerar(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # call_on_close roda mesmo se o gerador nunca começou (cliente caiu antes)
+    resposta.call_on_close(vagas.release)
+    return resposta
+
+
 @painel_bp.route("/adicionar", methods=["POST"])
 @require_capability("painel_set_aa")
 def adicionar_carga():
@@ -213,87 +521,176 @@ def adicionar_carga():
     )
 
     db.session.add(carga)
+    db.session.flush()
+    eventos_cargas.publicar("adicionar", id=carga.id)
     db.session.commit()
 
     return jsonify({"message": "Carga adicionada com sucesso", "id": carga.id}), 201
 
 
-@painel_bp.route("/checkin/<int:carga_id>", methods=["POST"])
-@require_capability("painel_set_aa")
-def checkin(carga_id):
-    dados = request.get_json(silent=True) or {}
-    aa_login = (dados.get("aa_responsavel") or "").strip()
+# =====================================================
+# TRANSIÇÕES (UPDATE condicional, um statement)
+# =====================================================
+def _transicionar(ids, status_origem, valores: dict, *condicoes, retornar=()) -> list:
+    """
+    UPDATE cargas SET ... WHERE id IN (:ids) AND status IN (:origem) [AND ...] RETURNING ...
+    Sem leitura prévia: dois cliques simultâneos não se sobrescrevem, o segundo
+    não casa com o WHERE. Devolve as linhas do RETURNING (só as que mudaram).
 
-    if not aa_login:
-        return jsonify({"error": "AA não informado"}), 400
+    As transições só preenchem datas vazias (end_time/deleted_at = agora), então
+    as datas devolvidas cobrem o dia de antes e o de depois no rollup do dashboard.
+    """
+    stmt = (
+        update(Carga)
+        .where(Carga.id.in_(ids), Carga.status.in_(status_origem), *condicoes)
+        .values(**valores)
+        .returning(Carga.id, Carga.created_at, Carga.end_time, Carga.deleted_at, *retornar)
+        .execution_options(synchronize_session=False)
+    )
+    linhas = db.session.execute(stmt).all()
+    resumo_diario.invalidar_dias(resumo_diario.dias_das_linhas(linhas))
+    return linhas
 
-    carga = Carga.query.get(carga_id)
-    if not carga:
-        return jsonify({"error": "Carga não encontrada"}), 404
 
-    carga.status = "checkin"
-    carga.aa_responsavel = aa_login
-    carga.start_time = datetime.now(timezone.utc)
+def _valores_checkin(dados: dict, agora: datetime) -> tuple[dict, tuple]:
+    aa_login = (dados.get("aa_responsavel") or "").strip()
+    if not aa_login:
+        raise ValueError("AA não informado")
+    return {"status": "checkin", "aa_responsavel": aa_login, "start_time": agora, "updated_at": agora}, ()
+
 
-    db.session.commit()
-    return jsonify({"message": "Checkin realizado"})
+def _valores_finalizar(dados: dict, agora: datetime) -> tuple[dict, tuple]:
+    fim = instante(agora)
 
+    tempo_total = segundos_entre(Carga.start_time, fim)
+    units_por_hora = case(
+        # round(x * 100) / 100: round(double, n) não existe no PostgreSQL
+        (tempo_total > 0, func.round(cast(func.coalesce(Carga.units, 0) * 360000, Float) / tempo_total) / 100.0),
+        else_=0,
+    )
 
-@painel_bp.route("/finalizar/<int:carga_id>", methods=["POST"])
-@require_capability("painel_finalize")
-def finalizar(carga_id):
-    carga = Carga.query.get(carga_id)
-    if not carga:
+    # Persistência da métrica: se ofendeu no fechamento, fica registrada para sempre.
+    atraso_atual = (
+        segundos_entre(func.coalesce(Carga.expected_arrival_date, Carga.arrived_at), fim)
+        - int(SLA_HORAS.total_seconds())
+    )
+    ofendeu = atraso_atual > 0
+
+    return {
+        "status": "closed",
+        "end_time": fim,
+        "tempo_total_segundos": tempo_total,
+        "units_por_hora": units_por_hora,
+        "atraso_registrado": case((ofendeu, true()), else_=Carga.atraso_registrado),
+        "atraso_segundos": case(
+            (and_(ofendeu, or_(Carga.atraso_registrado == false(), atraso_atual > Carga.atraso_segundos)), atraso_atual),
+            else_=Carga.atraso_segundos,
+        ),
+        "updated_at": fim,
+    }, (Carga.start_time.isnot(None),)
+
+
+def _valores_deletar(dados: dict, agora: datetime) -> tuple[dict, tuple]:
+    motivo = (dados.get("motivo") or "").strip()
+    if not motivo:
+        raise ValueError("Motivo é obrigatório")
+    return {"status": "deleted", "delete_reason": motivo, "deleted_at": agora, "updated_at": agora}, ()
+
+
+def _valores_carga_chegou(dados: dict, agora: datetime) -> tuple[dict, tuple]:
+    return {
+        "status": "arrival",
+        "arrived_at": agora,
+        "sla_setar_aa_deadline": agora + SLA_HORAS,
+        "updated_at": agora,
+    }, ()
+
+
+# ação -> (capability, status de origem, montagem do SET/condições extras, mensagem do 409)
+TRANSICOES = {
+    "checkin": (
+        "painel_set_aa", ("arrival_scheduled", "arrival"), _valores_checkin,
+        "Checkin só é possível para cargas em ARRIVAL/ARRIVAL_SCHEDULED",
+    ),
+    "finalizar": (
+        "painel_finalize", ("checkin",), _valores_finalizar,
+        "Carga não iniciada (só CHECKIN pode ser finalizada)",
+    ),
+    "deletar": (
+        "painel_delete", STATUS_SLA_ATIVO, _valores_deletar,
+        "Só cargas em aberto (ARRIVAL_SCHEDULED/ARRIVAL/CHECKIN) podem ser deletadas",
+    ),
+    "carga_chegou": (
+        "painel_carga_chegou", ("arrival_scheduled",), _valores_carga_chegou,
+        "Carga não está em ARRIVAL_SCHEDULED.",
+    ),
+}
+
+# Máximo de itens por /pc/bulk.
+PC_BULK_MAX = 500
+
+
+def _status_atuais(ids) -> dict[int, str]:
+    return dict(db.session.execute(select(Carga.id, Carga.status).where(Carga.id.in_(ids))).all())
+
+
+def _transicao_recusada(carga_id: int, acao: str):
+    """404 se a carga não existe; 409 (com o status atual) se a pré-condição falhou."""
+    status = _status_atuais([carga_id]).get(carga_id)
+    db.session.rollback()
+    if status is None:
         return jsonify({"error": "Carga não encontrada"}), 404
+    return jsonify({"error": TRANSICOES[acao][3], "status": status}), 409
+
 
-    start_time = _to_aware_utc(carga.start_time)
-    if not start_time:
-        return jsonify({"error": "Carga não iniciada"}), 400
+def _executar_transicao(acao: str, carga_id: int, dados: dict, retornar=()):
+    """Transição de uma carga: (linha do RETURNING, None) ou (None, resposta de erro)."""
+    _, origem, montar, _ = TRANSICOES[acao]
+    try:
+        valores, condicoes = montar(dados, datetime.now(timezone.utc))
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
 
-    end_time = datetime.now(timezone.utc)
+    linhas = _transicionar([carga_id], origem, valores, *condicoes, retornar=retornar)
+    if not linhas:
+        return None, _transicao_recusada(carga_id, acao)
 
-    tempo_total_segundos = int((end_time - start_time).total_seconds())
-    units = carga.units or 0
+    eventos_cargas.publicar(acao, id=carga_id)
+    db.session.commit()
+    return linhas[0], None
 
-    tempo_total_horas = tempo_total_segundos / 3600
-    units_por_hora = round(units / tempo_total_horas, 2) if tempo_total_horas > 0 else 0
 
-    carga.status = "closed"
-    carga.end_time = end_time
-    carga.tempo_total_segundos = tempo_total_segundos
-    carga.units_por_hora = units_por_hora
+@painel_bp.route("/checkin/<int:carga_id>", methods=["POST"])
+@require_capability("painel_set_aa")
+def checkin(carga_id):
+    _, erro = _executar_transicao("checkin", carga_id, request.get_json(silent=True) or {})
+    if erro:
+        return erro
+    return jsonify({"message": "Checkin realizado"})
 
-    # Persistência da métrica: se ofendeu no fechamento, fica registrada para sempre.
-    deadline = _deadline_sla_por_expected(carga)
-    if deadline and end_time > deadline:
-        atraso_atual = int((end_time - deadline).total_seconds())
-        if (not carga.atraso_registrado) or (atraso_atual > int(carga.atraso_segundos or 0)):
-            carga.atraso_registrado = True
-            carga.atraso_segundos = atraso_atual
 
-    db.session.commit()
-    return jsonify({"message": "Carga finalizada"})
+@painel_bp.route("/finalizar/<int:carga_id>", methods=["POST"])
+@require_capability("painel_finalize")
+def finalizar(carga_id):
+    linha, erro = _executar_transicao(
+        "finalizar", carga_id, {}, retornar=(Carga.tempo_total_segundos, Carga.units_por_hora)
+    )
+    if erro:
+        return erro
+    return jsonify({
+        "message": "Carga finalizada",
+        "tempo_total_segundos": linha.tempo_total_segundos,
+        "units_por_hora": linha.units_por_hora,
+    })
 
 
 
 @painel_bp.route("/deletar/<int:carga_id>", methods=["POST"])
 @require_capability("painel_delete")
 def deletar_carga(carga_id):
-    data = request.get_json(silent=True) or {}
-    motivo = (data.get("motivo") or "").strip()
-
-    if not motivo:
-        return jsonify({"error": "Motivo é obrigatório"}), 400
-
-    carga = Carga.query.get(carga_id)
-    if not carga:
-        return jsonify({"error": "Carga não encontrada"}), 404
-
-    carga.status = "deleted"
-    carga.delete_reason = motivo
-    carga.deleted_at = datetime.now(timezone.utc)
-
-    db.session.commit()
+    _, erro = _executar_transicao("deletar", carga_id, request.get_json(silent=True) or {})
+    if erro:
+        return erro
     return jsonify({"message": "Carga marcada como deletada"})
 
 
@@ -302,24 +699,108 @@ def deletar_carga(carga_id):
 @require_capability("painel_carga_chegou")
 def carga_chegou(carga_id):
     try:
-        c = Carga.query.get_or_404(carga_id)
-
-        if c.status != "arrival_scheduled":
-            return jsonify({"message": "Carga não está em ARRIVAL_SCHEDULED."}), 400
-
-        agora = datetime.now(timezone.utc)
-        c.status = "arrival"
-        c.arrived_at = agora
-        c.sla_setar_aa_deadline = agora + timedelta(hours=4)
-
-        db.session.commit()
+        _, erro = _executar_transicao("carga_chegou", carga_id, {})
+        if erro:
+            return erro
         return jsonify({"message": "Status atualizado para ARRIVAL e SLA de 4h iniciado."}), 200
 
     except Exception:
+        db.session.rollback()
         current_app.logger.exception("Erro em /pc/carga-chegou")
         return jsonify({"message": "Erro interno."}), 500
 
 
+@painel_bp.route("/bulk", methods=["POST"])
+def bulk():
+    """
+    Várias transições em uma transação: {"acoes": [{"id", "action", "payload"}, ...]}
+    (ou a lista direto). action: checkin | finalizar | deletar | carga_chegou.
+
+    Itens com a mesma ação e o mesmo payload viram um único UPDATE ... WHERE id IN (...).
+    Resposta: {"resultados": [{"id", "action", "ok", "codigo", "error"?, "status"?}], "ok", "falhas"},
+    na ordem do pedido; codigo segue os endpoints individuais (400/403/404/409).
+    """
+    data = request.get_json(silent=True)
+    itens = data.get("acoes") if isinstance(data, dict) else data
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"error": "Lista de ações vazia ou inválida"}), 400
+    if len(itens) > PC_BULK_MAX:
+        return jsonify({"error": f"Máximo de {PC_BULK_MAX} ações por requisição"}), 400
+
+    agora = datetime.now(timezone.utc)
+    resultados = []
+    grupos: dict[tuple, list[int]] = {}
+    montados: dict[tuple, tuple] = {}
+    vistos: set[int] = set()
+
+    for item in itens:
+        item = item if isinstance(item, dict) else {}
+        acao = (item.get("action") or "").strip().lower()
+        resultado = {"id": item.get("id"), "action": acao, "ok": False}
+        resultados.append(resultado)
+
+        try:
+            carga_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            resultado.update(codigo=400, error="id inválido")
+            continue
+        resultado["id"] = carga_id
+
+        if acao not in TRANSICOES:
+            resultado.update(codigo=400, error="Ação inválida")
+            continue
+        capacidade, origem, montar, _ = TRANSICOES[acao]
+        if not has_capability(capacidade):
+            resultado.update(codigo=403, error="Sem permissão para esta ação")
+            continue
+        if carga_id in vistos:
+            resultado.update(codigo=400, error="id repetido na requisição")
+            continue
+
+        payload = item.get("payload") if isinstance(item.get("payload"), dict) else {}
+        try:
+            valores, condicoes = montar(payload, agora)
+        except ValueError as e:
+            resultado.update(codigo=400, error=str(e))
+            continue
+
+        vistos.add(carga_id)
+        chave = (acao, tuple(sorted((k, str(v)) for k, v in payload.items())))
+        grupos.setdefault(chave, []).append(carga_id)
+        montados[chave] = (origem, valores, condicoes)
+
+    alteradas: set[int] = set()
+    try:
+        for chave, ids in grupos.items():
+            origem, valores, condicoes = montados[chave]
+            alteradas.update(r.id for r in _transicionar(ids, origem, valores, *condicoes))
+
+        recusadas = vistos - alteradas
+        status_atuais = _status_atuais(recusadas) if recusadas else {}
+
+        if alteradas:
+            eventos_cargas.publicar("bulk", ids=sorted(alteradas))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Erro em /pc/bulk")
+        return jsonify({"error": "Erro interno."}), 500
+
+    for resultado in resultados:
+        if "codigo" in resultado:
+            continue
+        carga_id = resultado["id"]
+        if carga_id in alteradas:
+            resultado.update(ok=True, codigo=200)
+        elif carga_id not in status_atuais:
+            resultado.update(codigo=404, error="Carga não encontrada")
+        else:
+            resultado.update(codigo=409, error=TRANSICOES[resultado["action"]][3], status=status_atuais[carga_id])
+
+    ok = sum(1 for r in resultados if r["ok"])
+    return jsonify({"resultados": resultados, "ok": ok, "falhas": len(resultados) - ok}), 200
+
+
 @painel_bp.route("/comentar-atraso/<int:carga_id>", methods=["POST"])
 @require_capability("painel_comment")
 def comentar_atraso(carga_id):
@@ -339,6 +820,7 @@ def comentar_atraso(carga_id):
     carga.atraso_comentario = comentario
     carga.atraso_comentado_em = datetime.now(timezone.utc)
 
+    eventos_cargas.publicar("comentar_atraso", id=carga.id)
     db.session.commit()
     return jsonify({"message": "Comentário de atraso salvo"}), 200
 
@@ -353,8 +835,13 @@ def expert_manage_carga(carga_id):
     data = request.get_json(silent=True) or {}
     action = (data.get("action") or "").strip().lower()
 
+    # dias em que a carga conta hoje no rollup do dashboard (a edição não mexe nas datas)
+    resumo_diario.invalidar_dias(resumo_diario.dias_das_linhas([carga]))
+
     if action == "hard_delete":
         db.session.delete(carga)
+        # remoção definitiva não aparece no delta: o cliente refaz o snapshot
+        eventos_cargas.publicar("hard_delete", id=carga_id, snapshot=True)
         db.session.commit()
         return jsonify({"message": "Carga deletada do banco com sucesso"}), 200
 
@@ -380,6 +867,7 @@ def expert_manage_carga(carga_id):
                     continue
             setattr(carga, field, value)
 
+        eventos_cargas.publicar("editar", id=carga.id)
         db.session.commit()
         return jsonify({"message": "Carga atualizada com sucesso"}), 200
 
@@ -0,0 +1,306 @@
+"""
+Rollup diário das métricas do /dashboard/stats (cargas_daily_stats).
+
+Dias passados quase não mudam: o dashboard lê do rollup os dias consolidados
+e só calcula ao vivo, a partir de cargas, o resto do período (hoje, dias
+futuros, dias ainda não consolidados ou invalidados). O resultado é o mesmo
+da leitura ao vivo.
+
+Grupos: (dia UTC, status, AA) com notas, units, tempo e units/hora; cada
+status conta pela própria coluna de data:
+  - closed: end_time (guarda o AA)
+  - deleted: deleted_at
+  - no_show, checkin, arrival/arrival_scheduled: created_at
+
+Manutenção:
+  - Quem grava em cargas chama invalidar_dias/invalidar_onde na mesma
+    transação, com os dias das linhas tocadas (transições do painel, edição
+    expert, upload, varredura de SLA): o dia volta a ser calculado ao vivo.
+  - A varredura (api/sla_varredura.py) reconsolida os dias pendentes, de
+    ontem para trás até o primeiro dia do rollup. Histórico pela CLI:
+      flask --app app consolidar-resumo-diario [--desde 2025-01-01]
+
+Concorrência: invalidar e consolidar passam pela linha do dia em
+cargas_daily_stats_dias (upsert, que trava a linha, antes de ler cargas):
+uma escrita concorrente com a consolidação ou entra na leitura ou deixa o
+dia invalidado depois dela.
+"""
+import os
+from datetime import date, datetime, time, timezone, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, case, delete, func, or_, select, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db import db
+from models import Carga, ResumoDiarioCarga, ResumoDiarioDia
+
+STATUS_PENDENTES = ("arrival", "arrival_scheduled")
+STATUS_POR_CREATED = ("no_show", "checkin", *STATUS_PENDENTES)
+
+# Dias reconsolidados por varredura / por transação da CLI.
+DIAS_POR_LOTE = int(os.getenv("RESUMO_DIAS_POR_VARREDURA", "31"))
+
+_UM_DIA = timedelta(days=1)
+
+
+def _insert_on_conflict(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise RuntimeError(f"Upsert em lote não suportado para o banco '{dialect}'.")
+
+
+def _hoje(agora: datetime | None = None) -> date:
+    return (agora or datetime.now(timezone.utc)).astimezone(timezone.utc).date()
+
+
+def _dia(dt: datetime | None) -> date | None:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        # SQLite devolve naive (UTC)
+        return dt.date()
+    return dt.astimezone(timezone.utc).date()
+
+
+def _faixas(dias) -> list[tuple[date, date]]:
+    """Dias ordenados -> faixas contíguas (primeiro, último)."""
+    faixas: list[list[date]] = []
+    for d in sorted(dias):
+        if faixas and d - faixas[-1][1] == _UM_DIA:
+            faixas[-1][1] = d
+        else:
+            faixas.append([d, d])
+    return [(a, b) for a, b in faixas]
+
+
+def _intervalo_utc(primeiro: date, ultimo: date) -> tuple[datetime, datetime]:
+    return (
+        datetime.combine(primeiro, time.min, tzinfo=timezone.utc),
+        datetime.combine(ultimo, time.max, tzinfo=timezone.utc),
+    )
+
+
+# =====================================================
+# Leitura
+# =====================================================
+def grupos_ao_vivo(intervalos) -> list:
+    """
+    Grupos (status, dia, aa, qtd, units, segundos, soma_uph, qtd_uph)
+    lidos de cargas em uma passada, para uma lista de intervalos UTC (inicio, fim).
+    """
+    if not intervalos:
+        return []
+
+    def no_periodo(coluna):
+        return or_(*(and_(coluna >= inicio, coluna <= fim) for inicio, fim in intervalos))
+
+    fechada = Carga.status == "closed"
+    linhas = (
+        select(
+            Carga.status.label("status"),
+            case(
+                (fechada, func.date(Carga.end_time)),
+                (Carga.status == "deleted", func.date(Carga.deleted_at)),
+                (Carga.status.in_(STATUS_POR_CREATED), func.date(Carga.created_at)),
+            ).label("dia"),
+            case((fechada, Carga.aa_responsavel)).label("aa"),
+            Carga.units,
+            Carga.tempo_total_segundos,
+            Carga.units_por_hora,
+        )
+        .where(or_(
+            and_(fechada, no_periodo(Carga.end_time)),
+            and_(Carga.status == "deleted", no_periodo(Carga.deleted_at)),
+            and_(Carga.status.in_(STATUS_POR_CREATED), no_periodo(Carga.created_at)),
+        ))
+        .subquery()
+    )
+    return db.session.execute(
+        select(
+            linhas.c.status,
+            linhas.c.dia,
+            linhas.c.aa,
+            func.count().label("qtd"),
+            func.coalesce(func.sum(linhas.c.units), 0).label("units"),
+            func.coalesce(func.sum(linhas.c.tempo_total_segundos), 0).label("segundos"),
+            func.coalesce(func.sum(linhas.c.units_por_hora), 0).label("soma_uph"),
+            func.count(linhas.c.units_por_hora).label("qtd_uph"),
+        )
+        .group_by(linhas.c.status, linhas.c.dia, linhas.c.aa)
+        .order_by(linhas.c.dia)
+    ).all()
+
+
+def _dias_consolidados(primeiro: date, ultimo: date) -> set[date]:
+    return set(db.session.execute(
+        select(ResumoDiarioDia.dia).where(
+            ResumoDiarioDia.consolidado == true(),
+            ResumoDiarioDia.dia >= primeiro,
+            ResumoDiarioDia.dia <= ultimo,
+        )
+    ).scalars())
+
+
+def grupos_periodo(primeiro: date, ultimo: date) -> list:
+    """
+    Grupos de grupos_ao_vivo para os dias [primeiro, ultimo]: os dias
+    consolidados vêm do rollup, o resto é lido de cargas. Ordenados por dia.
+    """
+    consolidados = _dias_consolidados(primeiro, ultimo)
+
+    ao_vivo = []
+    dia = primeiro
+    while dia <= ultimo:
+        if dia not in consolidados:
+            ao_vivo.append(dia)
+        dia += _UM_DIA
+
+    grupos = list(grupos_ao_vivo([_intervalo_utc(a, b) for a, b in _faixas(ao_vivo)]))
+    if consolidados:
+        r = ResumoDiarioCarga
+        grupos.extend(
+            g for g in db.session.execute(
+                select(
+                    r.status,
+                    r.dia,
+                    func.nullif(r.aa_responsavel, "").label("aa"),
+                    r.notas.label("qtd"),
+                    r.units,
+                    r.tempo_total_segundos.label("segundos"),
+                    r.soma_units_por_hora.label("soma_uph"),
+                    r.qtd_units_por_hora.label("qtd_uph"),
+                ).where(r.dia >= min(consolidados), r.dia <= max(consolidados))
+            ).all()
+            if g.dia in consolidados
+        )
+        grupos.sort(key=lambda g: str(g.dia))
+    return grupos
+
+
+# =====================================================
+# Manutenção
+# =====================================================
+def _marcar_dias(dias: list[date], consolidado: bool, agora: datetime | None = None) -> None:
+    """Upsert das linhas dos dias (trava as linhas até o commit)."""
+    table = ResumoDiarioDia.__table__
+    stmt = _insert_on_conflict(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.dia],
+        set_={"consolidado": stmt.excluded.consolidado, "calculado_em": stmt.excluded.calculado_em},
+    )
+    # sempre na mesma ordem: duas transações travando vários dias não se cruzam
+    db.session.execute(stmt, [
+        {"dia": d, "consolidado": consolidado, "calculado_em": agora} for d in sorted(dias)
+    ])
+
+
+def invalidar_dias(dias, agora: datetime | None = None) -> None:
+    """Dias que mudaram (antes de hoje) voltam a ser calculados ao vivo. Sem commit."""
+    hoje = _hoje(agora)
+    passados = {d for d in dias if d is not None and d < hoje}
+    if passados:
+        _marcar_dias(list(passados), consolidado=False)
+
+
+def dias_das_linhas(linhas) -> set[date]:
+    """Dias em que cada linha (created_at, end_time, deleted_at) pode contar."""
+    dias = set()
+    for linha in linhas:
+        dias.update((_dia(linha.created_at), _dia(linha.end_time), _dia(linha.deleted_at)))
+    dias.discard(None)
+    return dias
+
+
+def invalidar_onde(*condicoes, agora: datetime | None = None) -> None:
+    """invalidar_dias para as cargas que casam com `condicoes` (chamar antes de alterar as datas)."""
+    linhas = db.session.execute(
+        select(Carga.created_at, Carga.end_time, Carga.deleted_at).where(*condicoes)
+    ).all()
+    invalidar_dias(dias_das_linhas(linhas), agora)
+
+
+def consolidar(dias, agora: datetime | None = None) -> int:
+    """Recalcula os dias (antes de hoje) no rollup e commita. Retorna quantos dias."""
+    agora = agora or datetime.now(timezone.utc)
+    hoje = _hoje(agora)
+    dias = sorted({d for d in dias if d < hoje})
+    if not dias:
+        return 0
+
+    _marcar_dias(dias, consolidado=False)
+    db.session.execute(delete(ResumoDiarioCarga).where(ResumoDiarioCarga.dia.in_(dias)))
+
+    grupos = grupos_ao_vivo([_intervalo_utc(a, b) for a, b in _faixas(dias)])
+    if grupos:
+        db.session.execute(ResumoDiarioCarga.__table__.insert(), [
+            {
+                "dia": g.dia if isinstance(g.dia, date) else date.fromisoformat(g.dia),
+                "status": g.status,
+                "aa_responsavel": g.aa or "",
+                "notas": int(g.qtd),
+                "units": int(g.units),
+                "tempo_total_segundos": int(g.segundos),
+                "soma_units_por_hora": float(g.soma_uph),
+                "qtd_units_por_hora": int(g.qtd_uph),
+            }
+            for g in grupos
+        ])
+
+    db.session.execute(
+        update(ResumoDiarioDia)
+        .where(ResumoDiarioDia.dia.in_(dias))
+        .values(consolidado=True, calculado_em=agora)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return len(dias)
+
+
+def consolidar_pendentes(agora: datetime | None = None, limite: int = DIAS_POR_LOTE) -> int:
+    """
+    Varredura: consolida até `limite` dias pendentes, os mais recentes primeiro,
+    de ontem até o primeiro dia já registrado no rollup.
+    """
+    ontem = _hoje(agora) - _UM_DIA
+    primeiro = db.session.execute(select(func.min(ResumoDiarioDia.dia))).scalar()
+    primeiro = min(primeiro, ontem) if primeiro else ontem
+
+    consolidados = _dias_consolidados(primeiro, ontem)
+    pendentes = []
+    dia = ontem
+    while dia >= primeiro and len(pendentes) < limite:
+        if dia not in consolidados:
+            pendentes.append(dia)
+        dia -= _UM_DIA
+
+    return consolidar(pendentes, agora)
+
+
+@click.command("consolidar-resumo-diario")
+@click.option("--desde", help="Primeiro dia (YYYY-MM-DD). Padrão: a carga mais antiga.")
+@click.option("--ate", help="Último dia (YYYY-MM-DD). Padrão: ontem.")
+@with_appcontext
+def consolidar_resumo_command(desde, ate):
+    """Recalcula o rollup do dashboard (cargas_daily_stats) para um período."""
+    ultimo = date.fromisoformat(ate) if ate else _hoje() - _UM_DIA
+    if desde:
+        primeiro = date.fromisoformat(desde)
+    else:
+        mais_antiga = db.session.execute(select(func.min(Carga.created_at))).scalar()
+        primeiro = _dia(mais_antiga) or ultimo
+
+    total = 0
+    inicio = primeiro
+    while inicio <= ultimo:
+        fim = min(ultimo, inicio + (DIAS_POR_LOTE - 1) * _UM_DIA)
+        total += consolidar([inicio + i * _UM_DIA for i in range((fim - inicio).days + 1)])
+        inicio = fim + _UM_DIA
+
+    current_app.logger.info("Resumo diário consolidado: %s dias (%s a %s)", total, primeiro, ultimo)
+    click.echo(f"dias consolidados: {total} ({primeiro} a {ultimo})")
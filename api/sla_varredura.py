@@ -0,0 +1,280 @@
+"""
+Varredura de SLA em segundo plano.
+
+As transições que dependem só da passagem do tempo (no_show, atraso
+persistente, prazo de late stow, sincronização das transferências do dia)
+rodam aqui com poucos UPDATEs em lote, em vez de a cada GET do painel,
+dashboard e transferin. Os GETs ficam somente leitura.
+
+No fim, reconsolida os dias pendentes do rollup do dashboard
+(api/resumo_diario.py).
+
+Roda em uma thread do processo que serve HTTP (a cada
+SLA_VARREDURA_INTERVALO_SEGUNDOS; SLA_VARREDURA=0 desliga), iniciada pelo
+gunicorn.conf.py (post_worker_init) ou pelo `python app.py`, nunca pelos
+comandos `flask ...`. No PostgreSQL só um processo varre: o que segura o
+advisory lock SLA_VARREDURA_LOCK numa conexão dedicada; os outros tentam de
+novo a cada intervalo (assumem se o líder cair). Também pela CLI:
+  flask --app app varrer-sla
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Integer, case, cast, false, func, literal, or_, select, text, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db import db
+from models import Carga, Transferencia
+from api import eventos_cargas, resumo_diario
+
+try:
+    LOCAL_TZ = ZoneInfo("America/Sao_Paulo")
+except Exception:
+    LOCAL_TZ = timezone(timedelta(hours=-3))
+
+SLA_VARREDURA_INTERVALO = int(os.getenv("SLA_VARREDURA_INTERVALO_SEGUNDOS", "60"))
+
+STATUS_SLA_ATIVO = ("arrival", "arrival_scheduled", "checkin")
+
+SLA_HORAS = timedelta(hours=4)
+NO_SHOW_HORAS = timedelta(hours=24)
+
+# Prazo de late stow em aberto é regravado no máximo a cada 5 min:
+# os GETs calculam o atraso corrente; o persistido só precisa acompanhar.
+GRANULARIDADE_ATRASO = 300
+
+# Fechadas recalculadas a cada varredura (histórico: scripts/recalculate_atraso_flags.py).
+JANELA_FECHADAS = timedelta(hours=48)
+
+# Chave do advisory lock (PostgreSQL) que elege o processo que varre.
+SLA_VARREDURA_LOCK = 0x534C4131
+
+_SEGURA_LOCK = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted"
+    " AND pid = pg_backend_pid() AND classid = 0 AND objid = :chave AND objsubid = 1)"
+)
+
+_thread: threading.Thread | None = None
+_conexao_lider = None
+
+
+def instante(valor: datetime):
+    """Timestamp do Python como literal SQL tipado (timestamptz)."""
+    return literal(valor, db.DateTime(timezone=True))
+
+
+def segundos_entre(inicio, fim):
+    """(fim - inicio) em segundos inteiros, como expressão SQL."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        return cast(func.round(func.extract("epoch", fim - inicio)), Integer)
+    return cast(func.round((func.julianday(fim) - func.julianday(inicio)) * 86400), Integer)
+
+
+def _insert_on_conflict(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise RuntimeError(f"Upsert em lote não suportado para o banco '{dialect}'.")
+
+
+def _executar(stmt) -> int:
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount or 0
+
+
+def _marcar_no_show(agora: datetime) -> int:
+    """ARRIVAL_SCHEDULED vira NO_SHOW 24h após o expected."""
+    condicoes = (Carga.status == "arrival_scheduled", Carga.expected_arrival_date < agora - NO_SHOW_HORAS)
+    resumo_diario.invalidar_onde(*condicoes, agora=agora)
+    return _executar(update(Carga).where(*condicoes).values(status="no_show", updated_at=agora))
+
+
+def _registrar_atraso_ativo(agora: datetime) -> int:
+    """
+    ARRIVAL/ARRIVAL_SCHEDULED/CHECKIN com +4h do expected: marca o atraso
+    persistente uma única vez. O atraso corrente é calculado pelo painel a
+    cada GET (regravá-lo aqui geraria eventos/deltas a cada varredura).
+    """
+    atraso = segundos_entre(Carga.expected_arrival_date, instante(agora - SLA_HORAS))
+    return _executar(
+        update(Carga)
+        .where(
+            Carga.status.in_(STATUS_SLA_ATIVO),
+            Carga.expected_arrival_date < agora - SLA_HORAS,
+            Carga.atraso_registrado == false(),
+        )
+        .values(atraso_registrado=True, atraso_segundos=atraso, updated_at=agora)
+    )
+
+
+def _recalcular_atraso_fechadas(agora: datetime) -> int:
+    """CLOSED: atraso = max(0, end_time - (expected + 4h)); sem end_time, 0."""
+    bruto = segundos_entre(Carga.expected_arrival_date, Carga.end_time) - int(SLA_HORAS.total_seconds())
+    atraso = case((bruto > 0, bruto), else_=0)
+    registrado = case((bruto > 0, true()), else_=false())
+    return _executar(
+        update(Carga)
+        .where(
+            Carga.status == "closed",
+            or_(Carga.end_time >= agora - JANELA_FECHADAS, Carga.end_time.is_(None)),
+            or_(Carga.atraso_segundos != atraso, Carga.atraso_registrado != registrado),
+        )
+        .values(atraso_segundos=atraso, atraso_registrado=registrado, updated_at=agora)
+    )
+
+
+def _sincronizar_transferencias(agora: datetime) -> int:
+    """Cargas de transferência com expected no dia (horário local) -> transferencias."""
+    ref_local = agora.astimezone(LOCAL_TZ)
+    inicio = ref_local.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+    fim = ref_local.replace(hour=23, minute=59, second=59, microsecond=999999).astimezone(timezone.utc)
+
+    origem = select(
+        Carga.appointment_id,
+        Carga.id,
+        Carga.expected_arrival_date,
+        Carga.status,
+        func.coalesce(Carga.units, 0),
+        func.coalesce(Carga.cartons, 0),
+        # INSERT ... SELECT não aplica os defaults Python do model
+        false(),
+        false(),
+        false(),
+        literal(0),
+        instante(agora),
+        instante(agora),
+    ).where(
+        Carga.expected_arrival_date >= inicio,
+        Carga.expected_arrival_date <= fim,
+        or_(Carga.truck_tipo == "Transferência", Carga.truck_type == "TRANSSHIP"),
+    )
+
+    table = Transferencia.__table__
+    stmt = _insert_on_conflict(table).from_select(
+        [
+            "appointment_id", "carga_id", "expected_arrival_date", "status_carga", "units", "cartons",
+            "info_preenchida", "finalizada", "prazo_estourado", "prazo_estourado_segundos", "created_at",
+            "updated_at",
+        ],
+        origem,
+    )
+    campos = ("carga_id", "expected_arrival_date", "status_carga", "units", "cartons")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.appointment_id],
+        set_={**{c: stmt.excluded[c] for c in campos}, "updated_at": stmt.excluded.updated_at},
+        where=or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in campos)),
+    )
+    return db.session.execute(stmt).rowcount or 0
+
+
+def _marcar_prazo_estourado(agora: datetime) -> int:
+    """Transferência em aberto com late stow vencido."""
+    atraso = segundos_entre(Transferencia.late_stow_deadline, instante(agora))
+    return _executar(
+        update(Transferencia)
+        .where(
+            Transferencia.finalizada == false(),
+            Transferencia.late_stow_deadline < agora,
+            or_(
+                Transferencia.prazo_estourado == false(),
+                Transferencia.prazo_estourado_segundos + GRANULARIDADE_ATRASO <= atraso,
+            ),
+        )
+        .values(prazo_estourado=True, prazo_estourado_segundos=atraso, updated_at=agora)
+    )
+
+
+def varrer(agora: datetime | None = None) -> dict:
+    """Aplica todas as transições e commita. Retorna linhas afetadas por etapa."""
+    agora = agora or datetime.now(timezone.utc)
+
+    resultado = {
+        # no_show antes do atraso: no_show não entra mais no atraso ativo
+        "no_show": _marcar_no_show(agora),
+        "atraso_ativo": _registrar_atraso_ativo(agora),
+        "atraso_fechadas": _recalcular_atraso_fechadas(agora),
+        "transferencias_sincronizadas": _sincronizar_transferencias(agora),
+        "prazo_estourado": _marcar_prazo_estourado(agora),
+    }
+    if resultado["no_show"] or resultado["atraso_ativo"] or resultado["atraso_fechadas"]:
+        eventos_cargas.publicar("sla", **resultado)
+    elif resultado["transferencias_sincronizadas"] or resultado["prazo_estourado"]:
+        # só transferencias mudaram: avisa os observadores (cache do dashboard), não o painel
+        eventos_cargas.publicar("transferencia", **resultado)
+    db.session.commit()
+
+    # rollup do dashboard: dias que viraram passado ou foram invalidados (commita sozinho)
+    resultado["resumo_dias"] = resumo_diario.consolidar_pendentes(agora)
+    return resultado
+
+
+def _sou_lider() -> bool:
+    """
+    PostgreSQL: True se este processo segura (ou acabou de pegar) o advisory
+    lock da varredura. O lock é de sessão, numa conexão que fica com a
+    thread; a posse é conferida em pg_locks a cada chamada (uma reconexão
+    silenciosa do pool perde o lock). Se o líder cair, outro processo assume.
+    Outros bancos: sempre True (um processo só).
+    """
+    global _conexao_lider
+    if db.engine.dialect.name != "postgresql":
+        return True
+
+    conexao = _conexao_lider or db.engine.connect()
+    try:
+        lider = bool(conexao.execute(_SEGURA_LOCK, {"chave": SLA_VARREDURA_LOCK}).scalar()) or bool(
+            conexao.scalar(select(func.pg_try_advisory_lock(SLA_VARREDURA_LOCK)))
+        )
+        conexao.commit()
+    except Exception:
+        conexao.invalidate()
+        conexao.close()
+        _conexao_lider = None
+        raise
+
+    if not lider:
+        conexao.close()
+    _conexao_lider = conexao if lider else None
+    return lider
+
+
+def _loop(app) -> None:
+    while True:
+        with app.app_context():
+            try:
+                if _sou_lider():
+                    varrer()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Erro na varredura de SLA")
+            finally:
+                db.session.remove()
+        time.sleep(SLA_VARREDURA_INTERVALO)
+
+
+def iniciar_agendador(app) -> None:
+    """Sobe a thread da varredura (uma por processo; chamar só de quem serve HTTP)."""
+    global _thread
+    if os.getenv("SLA_VARREDURA", "1") == "0" or SLA_VARREDURA_INTERVALO <= 0:
+        return
+    if _thread is not None and _thread.is_alive():
+        return
+
+    _thread = threading.Thread(target=_loop, args=(app,), name="sla-varredura", daemon=True)
+    _thread.start()
+
+
+@click.command("varrer-sla")
+@with_appcontext
+def varrer_sla_command():
+    """Executa uma varredura de SLA agora."""
+    resultado = varrer()
+    current_app.logger.info("Varredura de SLA: %s", resultado)
+    click.echo(" | ".join(f"{k}: {v}" for k, v in resultado.items()))
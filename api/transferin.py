@@ -2,11 +2,12 @@ from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 
 from flask import Blueprint, jsonify, render_template, request
-from sqlalchemy import or_
+from sqlalchemy import false, func
 
 from db import db
 from models import Carga, Transferencia
 from api.auth import require_capability
+from api import compacto, condicional, eventos_cargas
 
 try:
     LOCAL_TZ = ZoneInfo("America/Sao_Paulo")
@@ -15,6 +16,27 @@ except Exception:
 
 transferin_bp = Blueprint("transferin", __name__, url_prefix="/transferin")
 
+# Campos da resposta do /transferin/listar, na ordem das linhas (e das "colunas" no format=columnar).
+CAMPOS_TRANSFERENCIA = (
+    "id",
+    "appointment_id",
+    "expected_arrival_date",
+    "status_carga",
+    "units",
+    "cartons",
+    "vrid",
+    "late_stow_deadline",
+    "origem",
+    "info_preenchida",
+    "finalizada",
+    "finished_at",
+    "prazo_estourado",
+    "prazo_estourado_segundos",
+    "tempo_prazo_segundos",
+    "comentario_late_stow",
+)
+CAMPOS_TEMPO_TRANSFERENCIA = ("expected_arrival_date", "late_stow_deadline", "finished_at")
+
 ORIGENS_VALIDAS = {"CNF2", "FOR2", "GIG1", "GRU9", "POA1", "REC1", "REC3", "XBRA", "XCV9"}
 
 
@@ -26,71 +48,6 @@ def _to_aware_utc(dt):
     return dt.astimezone(timezone.utc)
 
 
-def _to_local_day_bounds_utc(ref_utc=None):
-    ref_utc = ref_utc or datetime.now(timezone.utc)
-    ref_local = ref_utc.astimezone(LOCAL_TZ)
-    inicio_local = ref_local.replace(hour=0, minute=0, second=0, microsecond=0)
-    fim_local = ref_local.replace(hour=23, minute=59, second=59, microsecond=999999)
-    return inicio_local.astimezone(timezone.utc), fim_local.astimezone(timezone.utc)
-
-
-def _sync_transferencias_do_dia() -> bool:
-    inicio_utc, fim_utc = _to_local_day_bounds_utc()
-
-    cargas_transfer = (
-        Carga.query
-        .filter(
-            Carga.expected_arrival_date.isnot(None),
-            Carga.expected_arrival_date >= inicio_utc,
-            Carga.expected_arrival_date <= fim_utc,
-            or_(Carga.truck_tipo == "Transferência", Carga.truck_type == "TRANSSHIP")
-        )
-        .all()
-    )
-
-    mudou = False
-
-    for carga in cargas_transfer:
-        t = Transferencia.query.filter_by(appointment_id=carga.appointment_id).first()
-        if not t:
-            t = Transferencia(
-                appointment_id=carga.appointment_id,
-                carga_id=carga.id,
-                expected_arrival_date=_to_aware_utc(carga.expected_arrival_date),
-                status_carga=carga.status,
-                units=int(carga.units or 0),
-                cartons=int(carga.cartons or 0),
-                created_at=datetime.now(timezone.utc),
-            )
-            db.session.add(t)
-            mudou = True
-        else:
-            before = (
-                t.carga_id,
-                _to_aware_utc(t.expected_arrival_date),
-                t.status_carga,
-                int(t.units or 0),
-                int(t.cartons or 0),
-            )
-            t.carga_id = carga.id
-            t.expected_arrival_date = _to_aware_utc(carga.expected_arrival_date)
-            t.status_carga = carga.status
-            t.units = int(carga.units or 0)
-            t.cartons = int(carga.cartons or 0)
-
-            after = (
-                t.carga_id,
-                _to_aware_utc(t.expected_arrival_date),
-                t.status_carga,
-                int(t.units or 0),
-                int(t.cartons or 0),
-            )
-            if before != after:
-                mudou = True
-
-    return mudou
-
-
 def _atualizar_estado_prazo(t: Transferencia, agora_utc: datetime):
     deadline = _to_aware_utc(t.late_stow_deadline)
     if not deadline:
@@ -117,23 +74,39 @@ def transferin_page():
 
 @transferin_bp.route("/listar")
 @require_capability("transferin_view")
+@compacto.comprimir
 def listar_transferencias():
-    mudou_sync = _sync_transferencias_do_dia()
-
+    # Somente leitura: sincronização do dia e prazo_estourado vêm da varredura (api/sla_varredura.py).
+    # format=columnar / gzip: api/compacto.py.
     appointment_q = (request.args.get("appointment") or "").strip().lower()
     origem_q = (request.args.get("origem") or "").strip().upper()
     status_q = (request.args.get("status") or "").strip().lower()
 
+    # Versão da tabela antes de carregar/serializar (If-None-Match -> 304).
+    # prazo_estourado também vem do relógio (vencida_agora): quantas em aberto já
+    # passaram do prazo entra na versão, senão o 304 esconde o prazo que venceu.
+    agora = datetime.now(timezone.utc)
+    total, ultima_escrita, vencidas = db.session.query(
+        func.count(Transferencia.id),
+        func.max(Transferencia.updated_at),
+        func.count(Transferencia.id).filter(
+            Transferencia.finalizada == false(),
+            Transferencia.late_stow_deadline < agora,
+        ),
+    ).one()
+    etag = condicional.versao(total, ultima_escrita, vencidas)
+    nao_modificado = condicional.nao_modificado(etag)
+    if nao_modificado is not None:
+        return nao_modificado
+
     transferencias = Transferencia.query.order_by(Transferencia.expected_arrival_date.asc()).all()
 
-    agora = datetime.now(timezone.utc)
-    mudou = False
     out = []
 
     for t in transferencias:
-        _atualizar_estado_prazo(t, agora)
-        if t.prazo_estourado:
-            mudou = True
+        deadline = _to_aware_utc(t.late_stow_deadline)
+        vencida_agora = bool(deadline and not t.finalizada and agora > deadline)
+        prazo_estourado = bool(t.prazo_estourado) or vencida_agora
 
         if appointment_q and appointment_q not in (t.appointment_id or "").lower():
             continue
@@ -143,7 +116,7 @@ def listar_transferencias():
         status_card = "pendente"
         if t.info_preenchida:
             status_card = "preenchida"
-        if t.prazo_estourado and not t.finalizada:
+        if prazo_estourado and not t.finalizada:
             status_card = "atrasada"
         if t.finalizada:
             status_card = "finalizada"
@@ -151,32 +124,28 @@ def listar_transferencias():
         if status_q and status_q != status_card:
             continue
 
-        deadline = _to_aware_utc(t.late_stow_deadline)
         tempo_prazo_segundos = int((deadline - agora).total_seconds()) if deadline and not t.finalizada else None
 
-        out.append({
-            "id": t.id,
-            "appointment_id": t.appointment_id,
-            "expected_arrival_date": _to_aware_utc(t.expected_arrival_date).isoformat() if t.expected_arrival_date else None,
-            "status_carga": t.status_carga,
-            "units": int(t.units or 0),
-            "cartons": int(t.cartons or 0),
-            "vrid": t.vrid,
-            "late_stow_deadline": deadline.isoformat() if deadline else None,
-            "origem": t.origem,
-            "info_preenchida": bool(t.info_preenchida),
-            "finalizada": bool(t.finalizada),
-            "finished_at": _to_aware_utc(t.finished_at).isoformat() if t.finished_at else None,
-            "prazo_estourado": bool(t.prazo_estourado),
-            "prazo_estourado_segundos": int(t.prazo_estourado_segundos or 0),
-            "tempo_prazo_segundos": tempo_prazo_segundos,
-            "comentario_late_stow": t.comentario_late_stow,
-        })
-
-    if mudou or mudou_sync:
-        db.session.commit()
-
-    return jsonify(out)
+        out.append([
+            t.id,
+            t.appointment_id,
+            _to_aware_utc(t.expected_arrival_date),
+            t.status_carga,
+            int(t.units or 0),
+            int(t.cartons or 0),
+            t.vrid,
+            deadline,
+            t.origem,
+            bool(t.info_preenchida),
+            bool(t.finalizada),
+            _to_aware_utc(t.finished_at),
+            prazo_estourado,
+            int((agora - deadline).total_seconds()) if vencida_agora else int(t.prazo_estourado_segundos or 0),
+            tempo_prazo_segundos,
+            t.comentario_late_stow,
+        ])
+
+    return condicional.com_etag(jsonify(compacto.formatar(CAMPOS_TRANSFERENCIA, out, CAMPOS_TEMPO_TRANSFERENCIA)), etag)
 
 
 @transferin_bp.route("/atualizar/<int:transfer_id>", methods=["POST"])
@@ -231,6 +200,7 @@ def atualizar_transferencia(transfer_id):
 
     _atualizar_estado_prazo(t, datetime.now(timezone.utc))
 
+    eventos_cargas.publicar("transferencia", id=t.id)
     db.session.commit()
     return jsonify({"message": "Informações da transferência atualizadas"})
 
@@ -246,6 +216,7 @@ def finalizar_transferencia(transfer_id):
     t.finished_at = datetime.now(timezone.utc)
     _atualizar_estado_prazo(t, t.finished_at)
 
+    eventos_cargas.publicar("transferencia", id=t.id)
     db.session.commit()
     return jsonify({"message": "Transferência finalizada"})
 
@@ -270,6 +241,7 @@ def comentar_transferencia(transfer_id):
 
     t.comentario_late_stow = comentario
     t.comentario_late_stow_em = datetime.now(timezone.utc)
+    eventos_cargas.publicar("transferencia", id=t.id)
     db.session.commit()
     return jsonify({"message": "Comentário salvo"}), 200
 
@@ -352,6 +324,8 @@ def adicionar_transferencia():
     )
     _atualizar_estado_prazo(t, agora)
     db.session.add(t)
+    # a carga nova também aparece no painel
+    eventos_cargas.publicar("adicionar", id=carga.id)
     db.session.commit()
 
     return jsonify({"message": "Transferência adicionada com sucesso", "id": t.id}), 201
@@ -1,11 +1,21 @@
-from flask import Blueprint, render_template, request, jsonify, current_app
+import os
+import tempfile
+from collections.abc import Callable, Iterable, Iterator
+
+from flask import Blueprint, render_template, request, jsonify, current_app, url_for
+from werkzeug.datastructures import FileStorage
 import pandas as pd
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 
+from sqlalchemy import case, or_, select
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+
 from db import db
 from models import Carga
 from api.auth import require_capability
+from api import eventos_cargas, resumo_diario, upload_backfill, upload_jobs
 
 upload_bp = Blueprint("upload", __name__, url_prefix="/upload")
 
@@ -14,27 +24,27 @@ try:
 except Exception:
     LOCAL_TZ = timezone(timedelta(hours=-3))
 
+# Quantidade de linhas por statement no upsert em lote (limita tamanho do SQL/binds).
+UPSERT_CHUNK_SIZE = 1000
 
-@upload_bp.route("/")
-@require_capability("upload")
-def upload_page():
-    return render_template("upload.html")
+# Linhas por lote de ingestão (ler -> normalizar -> gravar -> commit).
+# Também limita o identity map da sessão e o tempo de lock em cargas.
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "2000"))
 
+# Onde o arquivo enviado fica até o job de ingestão terminar.
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or tempfile.gettempdir()
 
-def _get_col(row, *names, default=None):
-    # tenta match direto
-    for n in names:
-        if n in row and pd.notna(row.get(n)):
-            return row.get(n)
+# Máximo de mensagens "Linha N: ..." guardadas por upload.
+MAX_ERROS_RESUMO = 30
 
-    # tenta case-insensitive
-    row_keys_lower = {str(k).strip().lower(): k for k in row.index}
-    for n in names:
-        key = row_keys_lower.get(str(n).strip().lower())
-        if key is not None and pd.notna(row.get(key)):
-            return row.get(key)
+# Status operacionais que o upload nunca sobrescreve.
+STATUS_PRESERVADOS_NO_UPLOAD = ("checkin", "closed")
 
-    return default
+
+@upload_bp.route("/")
+@require_capability("upload")
+def upload_page():
+    return render_template("upload.html")
 
 
 def _normalize_type(raw):
@@ -118,171 +128,931 @@ def _status_do_sistema(plan_status_raw: object) -> str | None:
     return "arrival"
 
 
-@upload_bp.route("/processar", methods=["POST"])
-@require_capability("upload")
-def processar_planilha():
-    file = request.files.get("file")
-    if not file:
-        return jsonify({"message": "Nenhum arquivo enviado.", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 400
+# =====================================================
+# Normalização vetorizada (coluna a coluna)
+# =====================================================
+# Campos da planilha já normalizados; entram no fingerprint da linha.
+COLUNAS_ORIGEM = [
+    "appointment_id",
+    "expected_arrival_date",
+    "priority_last_update",
+    "priority_score",
+    "prioridade_maxima",
+    "status",
+    "cartons",
+    "units",
+    "truck_type",
+    "truck_tipo",
+]
+
+# Colunas gravadas em cargas pelo upload.
+COLUNAS_REGISTRO = COLUNAS_ORIGEM + ["upload_fingerprint"]
+
+_EPOCH_UTC = pd.Timestamp(0, tz="UTC")
+
+# tz_localize vetorizado é bem mais rápido com o nome da zona do que com o objeto ZoneInfo.
+_TZ_LOCAL_VETORIAL = "America/Sao_Paulo" if isinstance(LOCAL_TZ, ZoneInfo) else LOCAL_TZ
+
+# Formato da exportação do sistema ("2026/02/15 00:00 BRT", sem o sufixo).
+_FORMATO_DATA_EXPORT = "%Y/%m/%d %H:%M"
+_RE_SUFIXO_BRT = r"(?i)\s*BRT$"
+_RE_OFFSET_EXPLICITO = r"(?i)(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+def _resolver_coluna(df: pd.DataFrame, *names):
+    """Resolve o header uma única vez: match exato e depois case-insensitive."""
+    for n in names:
+        if n in df.columns:
+            return n
+
+    cols_lower = {str(c).strip().lower(): c for c in df.columns}
+    for n in names:
+        key = cols_lower.get(str(n).strip().lower())
+        if key is not None:
+            return key
+
+    return None
+
+
+def _coluna(df: pd.DataFrame, *names) -> pd.Series:
+    key = _resolver_coluna(df, *names)
+    if key is None:
+        return pd.Series(pd.NA, index=df.index, dtype="object")
+    return df[key]
+
+
+def _coluna_por_posicao(df: pd.DataFrame, pos: int) -> pd.Series:
+    if len(df.columns) <= pos:
+        return pd.Series(pd.NA, index=df.index, dtype="object")
+    return df.iloc[:, pos]
+
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """Série como texto aparado, com vazio tratado como ausente."""
+    s = serie.astype("string").str.strip()
+    return s.mask(s == "")
+
+
+def _numero(serie: pd.Series) -> pd.Series:
+    return pd.to_numeric(_texto(serie), errors="coerce").astype("Float64")
+
+
+def _datas_utc(serie: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de _to_utc_aware: remove o sufixo "BRT", converte com um
+    único to_datetime e localiza datas sem tz no horário da operação.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        d = serie
+        if d.dt.tz is None:
+            d = d.dt.tz_localize(_TZ_LOCAL_VETORIAL, ambiguous="NaT", nonexistent="shift_forward")
+        return d.dt.tz_convert(timezone.utc)
+
+    texto = _texto(serie).str.replace(_RE_SUFIXO_BRT, "", regex=True)
+    com_offset = texto.str.contains(_RE_OFFSET_EXPLICITO, regex=True).fillna(False).astype(bool)
+
+    # Caminho rápido: formato fixo da exportação; o restante cai no parser genérico.
+    local = pd.to_datetime(texto.where(~com_offset), format=_FORMATO_DATA_EXPORT, errors="coerce")
+    restante = texto.notna() & ~com_offset & local.isna()
+    if restante.any():
+        local = local.astype("datetime64[ns]")
+        local[restante] = pd.to_datetime(texto[restante], format="mixed", errors="coerce")
+
+    out = local.dt.tz_localize(_TZ_LOCAL_VETORIAL, ambiguous="NaT", nonexistent="shift_forward").dt.tz_convert(timezone.utc).copy()
+
+    if com_offset.any():
+        out[com_offset] = pd.to_datetime(texto[com_offset], format="mixed", utc=True, errors="coerce")
+
+    return out
+
+
+def _tipos(serie: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """Versão vetorizada de _normalize_type."""
+    up = (
+        _texto(serie).str.upper()
+        .str.replace("TRASNSSHIP", "TRANSSHIP", regex=False)
+        .str.replace("TRANS SHIP", "TRANSSHIP", regex=False)
+        .str.replace("TRANS-SHIP", "TRANSSHIP", regex=False)
+    )
+    tipo = up.map({"OTHER": "VDD", "CARP": "VDD", "TRANSSHIP": "Transferência"}, na_action="ignore")
+    return up, tipo.astype("string")
+
+
+def _status_planilha(serie: pd.Series) -> pd.Series:
+    """Versão vetorizada de _status_do_sistema (None = CLOSED/DELETED, ignorar)."""
+    s = _texto(serie).str.upper().str.replace("ARRIVED", "ARRIVAL", regex=False)
+    status = pd.Series("arrival", index=serie.index, dtype="string")
+    status[s == "ARRIVAL_SCHEDULED"] = "arrival_scheduled"
+    status[s.isin(["CLOSED", "DELETED"]).fillna(False).astype(bool)] = pd.NA
+    return status
+
+
+def _fingerprints(norm: pd.DataFrame) -> pd.Series:
+    """
+    Hash estável (hex, 16 chars) dos campos de origem normalizados, por linha.
+    Os valores são levados a uma forma canônica antes do hash para que CSV e
+    Excel da mesma carga gerem o mesmo fingerprint.
+    """
+    canonico = pd.DataFrame({
+        "appointment_id": norm["appointment_id"].astype(object).fillna(""),
+        "expected_arrival_date": ((norm["expected_arrival_date"] - _EPOCH_UTC).dt.total_seconds()).fillna(-1).astype("int64"),
+        "priority_last_update": ((norm["priority_last_update"] - _EPOCH_UTC).dt.total_seconds()).fillna(-1).astype("int64"),
+        "priority_score": norm["priority_score"].astype("float64").round(6),
+        "prioridade_maxima": norm["prioridade_maxima"].astype(bool),
+        "status": norm["status"].astype(object).fillna(""),
+        "cartons": norm["cartons"].astype("int64"),
+        "units": norm["units"].astype("int64"),
+        "truck_type": norm["truck_type"].astype(object).fillna(""),
+        "truck_tipo": norm["truck_tipo"].astype(object).fillna(""),
+    }, index=norm.index)
+
+    hashes = pd.util.hash_pandas_object(canonico[COLUNAS_ORIGEM], index=False)
+    return hashes.map("{:016x}".format)
+
 
+def _normalizar_planilha(
+    df: pd.DataFrame,
+    agora: datetime,
+    vistos: set[str] | None = None,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Normaliza a planilha (ou um lote dela) com operações de coluna.
+
+    `vistos` guarda os appointments de lotes anteriores do mesmo arquivo e é
+    atualizado aqui, para que repetições entre lotes também sejam contadas.
+
+    Retorna (norm, resumo):
+      - norm: uma linha por linha da planilha, com as colunas de COLUNAS_REGISTRO,
+        "linha" (número da linha no arquivo), "valida" (máscara) e "erro" (mensagem ou None)
+      - resumo: {"repetidas_no_arquivo": int}
+    """
+    appointment = _texto(_coluna_por_posicao(df, 0))
+    truck_type, truck_tipo = _tipos(_coluna_por_posicao(df, 1))
+
+    expected_coluna = _coluna(df, "Expected Arrival Date")
+    expected_raw = _texto(expected_coluna)
+    expected = _datas_utc(expected_coluna)
+    priority_last_update = _datas_utc(_coluna(df, "Priority Score Last Updated Date"))
+
+    units_num = _numero(_coluna(df, "Units", "UNITS", "units"))
+    units = units_num.fillna(0).apply(int).astype("int64")
+    cartons = _numero(_coluna(df, "Cartons", "CARTONS", "cartons")).fillna(0).apply(int).astype("int64")
+    priority_score = _numero(_coluna(df, "Priority Score")).fillna(0).astype("float64")
+
+    status = _status_planilha(_coluna(df, "Status", "STATUS"))
+
+    # regra: arrival_scheduled passou 24h -> no_show
+    no_show = (status == "arrival_scheduled").fillna(False) & (expected + timedelta(hours=24) < agora).fillna(False)
+    status[no_show.astype(bool)] = "no_show"
+
+    prioridade_maxima = (priority_last_update < expected).fillna(False).astype(bool)
+
+    tem_appointment = appointment.notna()
+    com_id = appointment[tem_appointment]
+    repetida = com_id.duplicated(keep="first")
+    if vistos is not None:
+        repetida |= com_id.isin(vistos)
+        vistos.update(com_id.unique())
+    repetidas = int(repetida.sum())
+
+    erro = pd.Series(None, index=df.index, dtype="object")
+    data_invalida = tem_appointment & expected_raw.notna() & expected.isna()
+    erro[data_invalida] = "Expected Arrival Date inválida (" + expected_raw[data_invalida].astype(str) + ")"
+
+    valida = (
+        tem_appointment
+        & expected.notna()
+        & (units > 0)
+        & status.notna()
+    ).astype(bool)
+
+    norm = pd.DataFrame({
+        "linha": df.index.to_numpy() + 2,
+        "appointment_id": appointment,
+        "expected_arrival_date": expected,
+        "priority_last_update": priority_last_update,
+        "priority_score": priority_score,
+        "prioridade_maxima": prioridade_maxima,
+        "status": status,
+        "cartons": cartons,
+        "units": units,
+        "truck_type": truck_type,
+        "truck_tipo": truck_tipo,
+        "valida": valida,
+        "erro": erro,
+    }, index=df.index)
+    norm["upload_fingerprint"] = _fingerprints(norm)
+
+    return norm, {"repetidas_no_arquivo": repetidas}
+
+
+def _registros(norm: pd.DataFrame) -> list[dict]:
+    """Linhas válidas como dicts prontos para o banco (tipos Python, None no lugar de NA)."""
+    validas = norm.loc[norm["valida"], COLUNAS_REGISTRO]
+    validas = validas.astype(object).where(validas.notna(), None)
+    return validas.to_dict("records")
+
+
+def _fingerprints_existentes(appointment_ids) -> dict[str, str | None]:
+    """
+    appointment_id -> upload_fingerprint das cargas já existentes (consulta em lote).
+    Cargas anteriores ao fingerprint voltam com None e são sempre regravadas.
+    """
+    ids = list(dict.fromkeys(a for a in appointment_ids if a))
+    existentes: dict[str, str | None] = {}
+
+    for i in range(0, len(ids), UPSERT_CHUNK_SIZE):
+        chunk = ids[i:i + UPSERT_CHUNK_SIZE]
+        existentes.update(
+            db.session.execute(
+                select(Carga.appointment_id, Carga.upload_fingerprint).where(Carga.appointment_id.in_(chunk))
+            ).tuples().all()
+        )
+
+    return existentes
+
+
+def _insert_on_conflict(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise RuntimeError(f"Upsert em lote não suportado para o banco '{dialect}'.")
+
+
+def _executar_isolando(stmt, registros: list[dict], inicio: int = 0) -> list[tuple[int, Exception]]:
+    """
+    Executa o statement dentro de um SAVEPOINT. Se o banco recusar, desfaz só o
+    savepoint e divide o lote ao meio até isolar as linhas problemáticas.
+    Retorna (posição em registros, erro) das linhas que não foram gravadas.
+    """
     try:
-        df = pd.read_excel(file)
-    except Exception as e:
-        return jsonify({"message": f"Erro ao ler arquivo Excel: {str(e)}", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 400
+        with db.session.begin_nested():
+            db.session.execute(stmt, registros)
+        return []
+    except (IntegrityError, DataError) as e:
+        if len(registros) == 1:
+            return [(inicio, e)]
+
+    meio = len(registros) // 2
+    return (
+        _executar_isolando(stmt, registros[:meio], inicio)
+        + _executar_isolando(stmt, registros[meio:], inicio + meio)
+    )
+
+
+def _upsert_cargas(registros: list[dict], agora: datetime) -> list[tuple[int, Exception]]:
+    """
+    INSERT ... ON CONFLICT (appointment_id) DO UPDATE em lotes.
+    Mantém a regra do upload: checkin/closed não têm o status sobrescrito.
+    Linhas cujo upload_fingerprint não mudou não são reescritas.
+    Cada statement roda em um savepoint: linhas recusadas pelo banco voltam como
+    (posição em registros, erro) e o restante continua na transação.
+    Exige índice único em cargas.appointment_id
+    (ver scripts/ensure_appointment_unique_index.py).
+    """
+    if not registros:
+        return []
+
+    table = Carga.__table__
+    stmt = _insert_on_conflict(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.appointment_id],
+        set_={
+            "expected_arrival_date": stmt.excluded.expected_arrival_date,
+            "priority_last_update": stmt.excluded.priority_last_update,
+            "priority_score": stmt.excluded.priority_score,
+            "prioridade_maxima": stmt.excluded.prioridade_maxima,
+            # IN (...) geraria parâmetro "expanding", incompatível com executemany.
+            "status": case(
+                (or_(*(table.c.status == s for s in STATUS_PRESERVADOS_NO_UPLOAD)), table.c.status),
+                else_=stmt.excluded.status,
+            ),
+            "cartons": stmt.excluded.cartons,
+            "units": stmt.excluded.units,
+            "truck_type": stmt.excluded.truck_type,
+            "truck_tipo": stmt.excluded.truck_tipo,
+            "upload_fingerprint": stmt.excluded.upload_fingerprint,
+            # on_conflict_do_update não aplica o onupdate do model
+            "updated_at": stmt.excluded.updated_at,
+        },
+        # defesa extra: se outro upload já gravou o mesmo conteúdo, não gera nova versão da linha
+        where=table.c.upload_fingerprint.is_distinct_from(stmt.excluded.upload_fingerprint),
+    )
+
+    novos_defaults = {
+        "created_at": agora,
+        "atraso_registrado": False,
+        "atraso_segundos": 0,
+        # hora da escrita (não do início do upload): cursor do painel incremental
+        "updated_at": datetime.now(timezone.utc),
+    }
+
+    falhas: list[tuple[int, Exception]] = []
+    for i in range(0, len(registros), UPSERT_CHUNK_SIZE):
+        chunk = [{**novos_defaults, **r} for r in registros[i:i + UPSERT_CHUNK_SIZE]]
+        falhas.extend(_executar_isolando(stmt, chunk, i))
+
+    return falhas
+
+
+def _mensagem_falha_banco(e: Exception) -> str:
+    """Primeira linha do erro do driver (sem o SQL e os parâmetros)."""
+    texto = str(getattr(e, "orig", None) or e).strip()
+    return texto.splitlines()[0] if texto else type(e).__name__
+
+
+def _is_csv(file) -> bool:
+    nome = (file.filename or "").lower()
+    return nome.endswith(".csv") or file.mimetype in ("text/csv", "application/csv")
+
+
+def _ler_planilha(file) -> Iterator[pd.DataFrame]:
+    """
+    Lê o arquivo em lotes de UPLOAD_CHUNK_ROWS linhas.
+
+    - CSV (formato da exportação do sistema): leitura em streaming, memória constante.
+      Tudo como texto para não perder zeros/precisão do Appointment ID; a coluna
+      vazia gerada pela vírgula final ("Unnamed: N") é descartada.
+    - Excel: o workbook é lido inteiro (openpyxl), mas normalização e gravação
+      seguem em lotes.
+    """
+    if _is_csv(file):
+        return pd.read_csv(
+            file.stream,
+            dtype=str,
+            encoding="utf-8-sig",
+            chunksize=UPLOAD_CHUNK_ROWS,
+            usecols=lambda c: not str(c).startswith("Unnamed:"),
+        )
+
+    df = pd.read_excel(file)
+    return (df.iloc[i:i + UPLOAD_CHUNK_ROWS] for i in range(0, len(df), UPLOAD_CHUNK_ROWS))
+
+
+def _novo_resumo() -> dict:
+    return {
+        "linhas": 0,
+        "inseridas": 0,
+        "atualizadas": 0,
+        "inalteradas": 0,
+        "ignoradas": 0,
+        "repetidas_no_arquivo": 0,
+        # linhas válidas descartadas porque uma linha posterior do mesmo appointment venceu
+        "repetidas": 0,
+        "erros": [],
+    }
+
+
+def _somar_resumo(total: dict, lote: dict) -> None:
+    for k, v in lote.items():
+        if k == "erros":
+            # mantém só as primeiras mensagens (memória constante em arquivos grandes)
+            total["erros"].extend(v[:max(0, MAX_ERROS_RESUMO - len(total["erros"]))])
+        else:
+            total[k] += v
+
 
-    inseridas = 0
-    atualizadas = 0
-    ignoradas = 0
-    repetidas_no_arquivo = 0
-    erros: list[str] = []
+def _ingerir_lote(df: pd.DataFrame, agora: datetime, vistos: set[str]) -> dict:
+    """Normaliza e grava um lote (sem commit); retorna as contagens do lote."""
+    norm, resumo_lote = _normalizar_planilha(df, agora, vistos)
+    return _gravar_lote(norm, resumo_lote, agora)
 
-    agora = datetime.now(timezone.utc)
 
-    seen_appointments: set[str] = set()
+def _gravar_lote(norm: pd.DataFrame, resumo_lote: dict, agora: datetime) -> dict:
+    """Grava um lote já normalizado (sem commit); retorna as contagens do lote."""
+    validas = norm.loc[norm["valida"], ["appointment_id", "upload_fingerprint"]]
 
-    for idx, row in df.iterrows():
+    # Mesmo appointment repetido no lote: a última linha vence; as anteriores vão para "repetidas"
+    # (a vencedora conta como inserida/atualizada/inalterada pelo que de fato é gravado).
+    ultimas = validas.drop_duplicates("appointment_id", keep="last")
+    repetidas_lote = int(len(validas) - len(ultimas))
+
+    # Uma leitura em lote dos appointments já existentes (em vez de 1 SELECT por linha).
+    # Lotes anteriores já foram commitados, então aparecem aqui como existentes.
+    existentes = _fingerprints_existentes(ultimas["appointment_id"])
+
+    existe = ultimas["appointment_id"].isin(existentes.keys())
+    inalterada = existe & (ultimas["appointment_id"].map(existentes) == ultimas["upload_fingerprint"])
+
+    # Só gera escrita para o que é novo ou mudou desde o último upload.
+    a_gravar = ultimas.index[~inalterada]
+
+    # Existentes que serão reescritas: os dias delas no rollup do dashboard voltam ao vivo.
+    reescritas = ultimas.loc[existe & ~inalterada, "appointment_id"].tolist()
+    if reescritas:
+        resumo_diario.invalidar_onde(Carga.appointment_id.in_(reescritas))
+    falhas = _upsert_cargas(_registros(norm.loc[a_gravar]), agora)
+
+    # Linhas recusadas pelo banco viram erro/ignorada; o restante do lote segue gravado.
+    recusadas = pd.Series(False, index=ultimas.index)
+    if falhas:
+        norm = norm.copy()
+        for pos, e in falhas:
+            idx = a_gravar[pos]
+            recusadas[idx] = True
+            norm.loc[idx, "erro"] = f"não gravada no banco ({_mensagem_falha_banco(e)})"
+
+    inalteradas = int(inalterada.sum())
+    atualizadas = int((existe & ~inalterada & ~recusadas).sum())
+
+    return {
+        "linhas": int(len(norm)),
+        "inseridas": int((~existe & ~recusadas).sum()),
+        "atualizadas": atualizadas,
+        "inalteradas": inalteradas,
+        "ignoradas": int((~norm["valida"]).sum()) + len(falhas),
+        "repetidas_no_arquivo": resumo_lote["repetidas_no_arquivo"],
+        "repetidas": repetidas_lote,
+        "erros": _mensagens_erro(norm),
+    }
+
+
+def _mensagens_erro(norm: pd.DataFrame) -> list[str]:
+    com_erro = norm[norm["erro"].notna()]
+    if "arquivo" in com_erro:
+        # upload com vários arquivos: a linha sozinha não diz de qual planilha veio
+        return [f"{r.arquivo} - Linha {r.linha}: {r.erro}" for r in com_erro.itertuples()]
+    return [f"Linha {r.linha}: {r.erro}" for r in com_erro.itertuples()]
+
+
+def _publicar_lote(lote: dict) -> None:
+    """Evento para o painel (/pc/stream) quando o lote grava algo; vai junto com o commit."""
+    if lote["inseridas"] or lote["atualizadas"]:
+        eventos_cargas.publicar("upload", inseridas=lote["inseridas"], atualizadas=lote["atualizadas"])
+
+
+def _ingerir(
+    lotes: Iterable[pd.DataFrame],
+    agora: datetime,
+    resumo: dict,
+    ao_commitar: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    Processa lote a lote com commit ao fim de cada um (transações curtas).
+    Linhas recusadas pelo banco ficam em `erros` sem derrubar o lote (savepoints).
+    `resumo` só recebe lotes já commitados, então continua válido se um lote falhar.
+    `ao_commitar(resumo)` é chamado após cada lote (progresso do job).
+    """
+    vistos: set[str] = set()
+
+    for df in lotes:
+        lote = _ingerir_lote(df, agora, vistos)
+        _publicar_lote(lote)
+        db.session.commit()
+        _somar_resumo(resumo, lote)
+        if ao_commitar:
+            ao_commitar(resumo)
+
+    return resumo
+
+
+class ErroLeituraArquivo(Exception):
+    """Falha ao ler/normalizar uma das planilhas (nada foi gravado)."""
+
+
+def _normalizar_arquivo(file, agora: datetime) -> tuple[pd.DataFrame | None, dict]:
+    """Lê e normaliza um arquivo inteiro (todos os lotes), sem tocar no banco."""
+    vistos: set[str] = set()
+    partes = []
+    repetidas = 0
+
+    for df in _ler_planilha(file):
+        norm, resumo_lote = _normalizar_planilha(df, agora, vistos)
+        partes.append(norm)
+        repetidas += resumo_lote["repetidas_no_arquivo"]
+
+    if not partes:
+        return None, {"repetidas_no_arquivo": 0}
+
+    return pd.concat(partes), {"repetidas_no_arquivo": repetidas}
+
+
+def _parsear_arquivo(caminho: str, nome: str, mimetype: str | None, agora: datetime) -> tuple[pd.DataFrame | None, dict]:
+    """Roda em um processo do pool de parsing (upload com vários arquivos)."""
+    with open(caminho, "rb") as fh:
+        norm, resumo = _normalizar_arquivo(FileStorage(stream=fh, filename=nome, content_type=mimetype), agora)
+
+    if norm is not None:
+        norm["arquivo"] = nome
+    return norm, resumo
+
+
+def _ingerir_arquivos(
+    arquivos: list[tuple[str, str, str | None]],
+    agora: datetime,
+    resumo: dict,
+    ao_commitar: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    Vários arquivos: parse/normalização em paralelo (um arquivo por processo),
+    depois um único merge e a gravação em lotes de UPLOAD_CHUNK_ROWS com commit.
+    Na ordem do envio, o último arquivo que traz um appointment_id vence.
+    """
+    futuros = [
+        (nome, upload_jobs.submeter_parsing(_parsear_arquivo, caminho, nome, mimetype, agora))
+        for caminho, nome, mimetype in arquivos
+    ]
+
+    partes = []
+    repetidas = 0
+    for nome, futuro in futuros:
         try:
-            # A = Appointment ID | B = Type (garante mesmo se header mudar)
-            appointment_id = row.iloc[0] if len(row) > 0 else None
-            if appointment_id is None or pd.isna(appointment_id):
-                ignoradas += 1
-                continue
+            norm, resumo_arquivo = futuro.result()
+        except Exception as e:
+            raise ErroLeituraArquivo(f"Erro ao ler arquivo {nome}: {str(e)}") from e
+        if norm is not None:
+            partes.append(norm)
+        repetidas += resumo_arquivo["repetidas_no_arquivo"]
 
-            appointment_str = str(appointment_id).strip()
-            if not appointment_str:
-                ignoradas += 1
-                continue
+    if not partes:
+        return resumo
 
-            if appointment_str in seen_appointments:
-                repetidas_no_arquivo += 1
-            else:
-                seen_appointments.add(appointment_str)
+    # índices se repetem entre arquivos; _gravar_lote precisa de índice único
+    merged = pd.concat(partes, ignore_index=True)
 
-            type_raw = row.iloc[1] if len(row) > 1 else None
-            truck_type, truck_tipo = _normalize_type(type_raw)
+    # Last-write-wins no merge inteiro, antes de fatiar: o mesmo appointment não
+    # pode cair em dois lotes. As linhas vencidas vão para "repetidas".
+    validas = merged.loc[merged["valida"], "appointment_id"]
+    vencidas = validas.index[validas.duplicated(keep="last")]
+    merged = merged.drop(vencidas).reset_index(drop=True)
+    _somar_resumo(resumo, {"linhas": len(vencidas), "repetidas": len(vencidas), "repetidas_no_arquivo": repetidas})
 
-            # Datas
-            expected_arrival = _to_utc_aware(_get_col(row, "Expected Arrival Date", default=None))
-            priority_last_update = _to_utc_aware(_get_col(row, "Priority Score Last Updated Date", default=None))
+    for i in range(0, len(merged), UPLOAD_CHUNK_ROWS):
+        lote = _gravar_lote(merged.iloc[i:i + UPLOAD_CHUNK_ROWS], {"repetidas_no_arquivo": 0}, agora)
+        _publicar_lote(lote)
+        db.session.commit()
+        _somar_resumo(resumo, lote)
+        if ao_commitar:
+            ao_commitar(resumo)
 
-            # sem expected_arrival não dá pra SLA / no_show
-            if not expected_arrival:
-                ignoradas += 1
-                continue
+    return resumo
 
-            # Units / Cartons
-            units_raw = _get_col(row, "Units", "UNITS", "units", default=0)
-            cartons_raw = _get_col(row, "Cartons", "CARTONS", "cartons", default=0)
 
-            try:
-                units_val = 0 if pd.isna(units_raw) else int(float(units_raw))
-            except Exception:
-                units_val = 0
+# Colunas NOT NULL de cargas: a staging (CREATE TABLE AS) não herda a restrição,
+# então o backfill recusa essas linhas antes do COPY em vez de abortar no merge.
+_OBRIGATORIAS = [c for c in COLUNAS_REGISTRO if not Carga.__table__.c[c].nullable]
 
-            try:
-                cartons_val = 0 if pd.isna(cartons_raw) else int(float(cartons_raw))
-            except Exception:
-                cartons_val = 0
 
-            # regra de negócio: cargas com units <= 0 são ignoradas
-            if units_val <= 0:
-                ignoradas += 1
-                continue
+def _recusar_obrigatorias_vazias(norm: pd.DataFrame) -> pd.DataFrame:
+    """Linhas válidas com coluna obrigatória vazia viram ignoradas, com a mensagem em "erro"."""
+    vazias = norm[_OBRIGATORIAS].isna() & norm["valida"].to_numpy()[:, None]
+    recusadas = vazias.any(axis=1)
+    if not recusadas.any():
+        return norm
+
+    norm = norm.copy()
+    norm.loc[recusadas, "valida"] = False
+    norm.loc[recusadas, "erro"] = [
+        f"não gravada no banco (campo obrigatório vazio: {', '.join(vazias.columns[linha])})"
+        for linha in vazias[recusadas].to_numpy()
+    ]
+    return norm
+
+
+def _backfill_arquivos(
+    arquivos: list[tuple[str, str, str | None]],
+    agora: datetime,
+    resumo: dict,
+    ao_copiar: Callable[[dict], None] | None = None,
+) -> dict:
+    """
+    Backfill (PostgreSQL): lotes normalizados vão por COPY para a staging e
+    são aplicados em cargas com um único statement, em uma única transação.
+    `resumo` só recebe as contagens depois do commit; `ao_copiar(parcial)`
+    reporta o andamento da carga na staging.
+    """
+    if not upload_backfill.suportado():
+        raise RuntimeError("Backfill via COPY disponível apenas no PostgreSQL.")
+
+    upload_backfill.criar_staging(COLUNAS_REGISTRO)
+    parcial = _novo_resumo()
+    copiadas = 0
 
-            # Priority score
-            priority_score_raw = _get_col(row, "Priority Score", default=0) or 0
+    for caminho, nome, mimetype in arquivos:
+        vistos: set[str] = set()
+        with open(caminho, "rb") as fh:
+            file = FileStorage(stream=fh, filename=nome, content_type=mimetype)
             try:
-                priority_score = float(priority_score_raw)
-            except Exception:
-                priority_score = 0.0
+                lotes = _ler_planilha(file)
+            except Exception as e:
+                raise ErroLeituraArquivo(f"Erro ao ler arquivo {nome}: {str(e)}") from e
+
+            for df in lotes:
+                norm, resumo_lote = _normalizar_planilha(df, agora, vistos)
+                if len(arquivos) > 1:
+                    norm["arquivo"] = nome
+
+                norm = _recusar_obrigatorias_vazias(norm)
+                upload_backfill.copiar_para_staging(norm.loc[norm["valida"], COLUNAS_REGISTRO])
+                copiadas += int(norm["valida"].sum())
+                _somar_resumo(parcial, {
+                    "linhas": int(len(norm)),
+                    "ignoradas": int((~norm["valida"]).sum()),
+                    "repetidas_no_arquivo": resumo_lote["repetidas_no_arquivo"],
+                    "erros": _mensagens_erro(norm),
+                })
+                if ao_copiar:
+                    ao_copiar(parcial)
+
+    resumo_diario.invalidar_dias(upload_backfill.dias_afetados(), agora)
+    aplicado = upload_backfill.aplicar_staging(COLUNAS_REGISTRO, agora, STATUS_PRESERVADOS_NO_UPLOAD)
+    _publicar_lote(aplicado)
+    db.session.commit()
+
+    # Como em _gravar_lote: linhas repetidas (vencidas pela última) vão para "repetidas".
+    _somar_resumo(resumo, {
+        **parcial,
+        "inseridas": aplicado["inseridas"],
+        "atualizadas": aplicado["atualizadas"],
+        "repetidas": copiadas - aplicado["distintas"],
+        "inalteradas": aplicado["distintas"] - aplicado["inseridas"] - aplicado["atualizadas"],
+    })
+    return resumo
+
+
+# =====================================================
+# Preview (dry-run): diff do upload sem gravar nada
+# =====================================================
+# Exemplos devolvidos por categoria no preview.
+PREVIEW_MAX_EXEMPLOS = 20
+
+# Campos comparados para mostrar o que muda em cada atualização.
+COLUNAS_DIFF = [c for c in COLUNAS_ORIGEM if c != "appointment_id"]
 
-            # STATUS (lógica do sistema)
-            plan_status = _get_col(row, "Status", "STATUS", default=None)
-            status = _status_do_sistema(plan_status)
 
-            # CLOSED/DELETED -> ignorar
-            if status is None:
-                ignoradas += 1
+def _cargas_existentes(appointment_ids) -> pd.DataFrame:
+    """
+    Estado atual das cargas do arquivo (leitura em lote, só SELECT),
+    indexado por appointment_id, com COLUNAS_ORIGEM + upload_fingerprint.
+    """
+    ids = list(dict.fromkeys(a for a in appointment_ids if a))
+    colunas = [getattr(Carga, c) for c in COLUNAS_REGISTRO]
+    linhas = []
+
+    for i in range(0, len(ids), UPSERT_CHUNK_SIZE):
+        chunk = ids[i:i + UPSERT_CHUNK_SIZE]
+        linhas.extend(db.session.execute(select(*colunas).where(Carga.appointment_id.in_(chunk))).all())
+
+    return pd.DataFrame(linhas, columns=COLUNAS_REGISTRO).set_index("appointment_id")
+
+
+def _valor_json(v):
+    if v is None or v is pd.NaT or (not isinstance(v, str) and pd.isna(v)):
+        return None
+    if isinstance(v, datetime):
+        # SQLite devolve datetime sem tz; o que o upload grava é sempre UTC.
+        return (v if v.tzinfo else v.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    if hasattr(v, "item"):
+        return v.item()
+    return v
+
+
+def _motivo_ignorada(r) -> str:
+    if isinstance(r.erro, str):
+        return r.erro
+    if pd.isna(r.appointment_id):
+        return "sem Appointment ID"
+    if pd.isna(r.expected_arrival_date):
+        return "sem Expected Arrival Date"
+    if pd.isna(r.status):
+        return "status CLOSED/DELETED na planilha"
+    return "Units zerado"
+
+
+def _preview_upload(norm: pd.DataFrame, repetidas: int) -> dict:
+    """
+    O que o upload faria, com uma leitura em lote de cargas e nenhuma escrita.
+    Contagens seguem as mesmas regras de _gravar_lote; "no_show" conta o que
+    ficaria no_show depois do upload: cargas novas já inseridas como no_show
+    ("no_show_novas") mais existentes que passariam a no_show (checkin/closed
+    nunca mudam de status).
+    """
+    validas = norm.loc[norm["valida"]]
+    ultimas = validas.drop_duplicates("appointment_id", keep="last")
+    repetidas_lote = int(len(validas) - len(ultimas))
+
+    existentes = _cargas_existentes(ultimas["appointment_id"])
+    ids = ultimas["appointment_id"]
+
+    existe = ids.isin(existentes.index)
+    inalterada = existe & (ids.map(existentes["upload_fingerprint"]) == ultimas["upload_fingerprint"])
+    atualizada = existe & ~inalterada
+    status_atual = ids.map(existentes["status"])
+    preservada = status_atual.isin(STATUS_PRESERVADOS_NO_UPLOAD)
+    chega_no_show = (ultimas["status"] == "no_show").fillna(False)
+    nova_no_show = ~existe & chega_no_show
+    vira_no_show = atualizada & ~preservada & chega_no_show & (status_atual != "no_show")
+
+    n = PREVIEW_MAX_EXEMPLOS
+
+    def _linha(r) -> dict:
+        item = {"linha": int(r.linha), "appointment_id": r.appointment_id}
+        if "arquivo" in norm:
+            item["arquivo"] = r.arquivo
+        return item
+
+    def _mudancas(r) -> dict:
+        atual = existentes.loc[r.appointment_id]
+        campos = {}
+        for c in COLUNAS_DIFF:
+            if c == "status" and atual["status"] in STATUS_PRESERVADOS_NO_UPLOAD:
                 continue
+            antes, depois = _valor_json(atual[c]), _valor_json(getattr(r, c))
+            if antes != depois:
+                campos[c] = {"antes": antes, "depois": depois}
+        return campos
+
+    exemplos = {
+        "inseridas": [
+            {**_linha(r), "status": r.status, "expected_arrival_date": _valor_json(r.expected_arrival_date), "units": int(r.units)}
+            for r in ultimas[~existe].head(n).itertuples()
+        ],
+        "atualizadas": [
+            {**_linha(r), "campos": _mudancas(r)}
+            for r in ultimas[atualizada].head(n).itertuples()
+        ],
+        "no_show": [
+            {**_linha(r), "status_atual": _valor_json(status_atual[r.Index]), "expected_arrival_date": _valor_json(r.expected_arrival_date)}
+            for r in ultimas[vira_no_show | nova_no_show].head(n).itertuples()
+        ],
+        "ignoradas": [
+            {**_linha(r), "motivo": _motivo_ignorada(r)}
+            for r in norm[~norm["valida"]].head(n).itertuples()
+        ],
+    }
+
+    return {
+        "preview": True,
+        "message": "Preview do upload: nada foi gravado.",
+        "linhas": int(len(norm)),
+        "inseridas": int((~existe).sum()),
+        "atualizadas": int(atualizada.sum()),
+        "inalteradas": int(inalterada.sum()),
+        "ignoradas": int((~norm["valida"]).sum()),
+        "no_show": int(vira_no_show.sum()) + int(nova_no_show.sum()),
+        "no_show_novas": int(nova_no_show.sum()),
+        "repetidas_no_arquivo": repetidas,
+        "repetidas": repetidas_lote,
+        "erros": _mensagens_erro(norm)[:MAX_ERROS_RESUMO],
+        "exemplos": exemplos,
+    }
+
+
+def _preview_arquivos(files: list, agora: datetime) -> dict:
+    """Normaliza os arquivos do request (na ordem, último vence) e calcula o diff."""
+    partes = []
+    repetidas = 0
+
+    for file in files:
+        norm, resumo_arquivo = _normalizar_arquivo(file, agora)
+        if norm is None:
+            continue
+        if len(files) > 1:
+            norm["arquivo"] = file.filename or ""
+        partes.append(norm)
+        repetidas += resumo_arquivo["repetidas_no_arquivo"]
+
+    if not partes:
+        return {**_novo_resumo(), "preview": True, "message": "Preview do upload: nada foi gravado.", "no_show": 0, "exemplos": {}}
+
+    return _preview_upload(pd.concat(partes, ignore_index=True), repetidas)
+
+
+def _salvar_arquivo_temporario(file) -> str:
+    _, ext = os.path.splitext(file.filename or "")
+    fd, caminho = tempfile.mkstemp(prefix="upload-", suffix=ext.lower(), dir=UPLOAD_TMP_DIR)
+    os.close(fd)
+    file.save(caminho)
+    return caminho
+
 
-            # regra: arrival_scheduled passou 24h -> no_show
-            if status == "arrival_scheduled":
-                if agora > (expected_arrival + timedelta(hours=24)):
-                    status = "no_show"
-
-            prioridade_maxima = False
-            if priority_last_update:
-                prioridade_maxima = priority_last_update < expected_arrival
-
-            # UPSERT por appointment_id
-            carga = Carga.query.filter_by(appointment_id=appointment_str).first()
-            if carga:
-                carga.expected_arrival_date = expected_arrival
-                carga.priority_last_update = priority_last_update
-                carga.priority_score = priority_score
-                carga.prioridade_maxima = prioridade_maxima
-
-                # ✅ não sobrescreve checkin/closed se já estiver rodando
-                if carga.status not in ("checkin", "closed"):
-                    carga.status = status
-
-                carga.cartons = cartons_val
-                carga.units = units_val
-                carga.truck_type = truck_type
-                carga.truck_tipo = truck_tipo
-
-                atualizadas += 1
+def _executar_job(job_id: str, app, arquivos: list[tuple[str, str, str | None]], backfill: bool = False) -> None:
+    """Roda no pool de upload_jobs, fora do request. `arquivos`: (caminho, nome, mimetype)."""
+    resumo = _novo_resumo()
+
+    def _progresso(r: dict) -> None:
+        upload_jobs.atualizar_job(job_id, **r)
+
+    with app.app_context():
+        try:
+            upload_jobs.atualizar_job(job_id, status="processando", message="Processando planilha.")
+            agora = datetime.now(timezone.utc)
+
+            if backfill:
+                try:
+                    _backfill_arquivos(arquivos, agora, resumo, ao_copiar=_progresso)
+                except ErroLeituraArquivo as e:
+                    db.session.rollback()
+                    upload_jobs.atualizar_job(job_id, status="erro", message=str(e), **_novo_resumo())
+                    return
+            elif len(arquivos) > 1:
+                try:
+                    _ingerir_arquivos(arquivos, agora, resumo, ao_commitar=_progresso)
+                except ErroLeituraArquivo as e:
+                    upload_jobs.atualizar_job(job_id, status="erro", message=str(e))
+                    return
             else:
-                carga = Carga(
-                    appointment_id=appointment_str,
-                    expected_arrival_date=expected_arrival,
-                    priority_last_update=priority_last_update,
-                    priority_score=priority_score,
-                    prioridade_maxima=prioridade_maxima,
-                    status=status,
-                    cartons=cartons_val,
-                    units=units_val,
-                    truck_type=truck_type,
-                    truck_tipo=truck_tipo,
-                    created_at=agora,
-
-                    aa_responsavel=None,
-                    start_time=None,
-                    end_time=None,
-                    tempo_total_segundos=None,
-                    units_por_hora=None,
-
-                    arrived_at=None,
-                    sla_setar_aa_deadline=None,
-                    atraso_registrado=False,
-                    atraso_segundos=0,
-                )
-                db.session.add(carga)
-                inseridas += 1
+                caminho, nome, mimetype = arquivos[0]
+                with open(caminho, "rb") as fh:
+                    file = FileStorage(stream=fh, filename=nome, content_type=mimetype)
+                    try:
+                        lotes = _ler_planilha(file)
+                    except Exception as e:
+                        tipo = "CSV" if _is_csv(file) else "Excel"
+                        upload_jobs.atualizar_job(job_id, status="erro", message=f"Erro ao ler arquivo {tipo}: {str(e)}")
+                        return
+
+                    _ingerir(lotes, agora, resumo, ao_commitar=_progresso)
+
+            upload_jobs.atualizar_job(job_id, status="concluido", message="Upload concluído com sucesso!", **resumo)
+
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("Erro ao salvar upload (job %s)", job_id)
+            # Só chega aqui erro fora do savepoint (ex.: conexão caiu): lotes anteriores
+            # já foram commitados; o lote em andamento foi descartado.
+            upload_jobs.atualizar_job(
+                job_id,
+                status="erro",
+                message=f"Erro ao salvar no banco após {resumo['linhas']} linhas gravadas: {str(e)}",
+                **resumo,
+            )
+
+        finally:
+            db.session.remove()
+            for caminho, _, _ in arquivos:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+
+
+def _parametro_ligado(nome: str) -> bool:
+    """Flag da query string ou do form ("1"/"true")."""
+    return (request.args.get(nome) or request.form.get(nome) or "").strip().lower() in ("1", "true")
+
+
+@upload_bp.route("/processar", methods=["POST"])
+@require_capability("upload")
+def processar_planilha():
+    # Vários arquivos no mesmo campo "file" (input multiple) são processados juntos.
+    files = [f for f in request.files.getlist("file") if f]
+    if not files:
+        return jsonify({"message": "Nenhum arquivo enviado.", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 400
 
+    # preview=1: responde na hora com o diff, sem job e sem transação de escrita.
+    if _parametro_ligado("preview"):
+        try:
+            return jsonify(_preview_arquivos(files, datetime.now(timezone.utc))), 200
         except Exception as e:
-            ignoradas += 1
-            erros.append(f"Linha {idx+2}: {str(e)}")
+            current_app.logger.exception("Erro no preview de upload")
+            return jsonify({"message": f"Erro ao ler arquivo: {str(e)}", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 400
+        finally:
+            db.session.rollback()
 
+    backfill = _parametro_ligado("backfill")
+    if backfill and not upload_backfill.suportado():
+        return jsonify({"message": "Backfill via COPY disponível apenas no PostgreSQL.", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 400
+
+    arquivos = []
     try:
-        db.session.commit()
+        for file in files:
+            arquivos.append((_salvar_arquivo_temporario(file), file.filename or "", file.mimetype))
     except Exception as e:
-        db.session.rollback()
-        current_app.logger.exception("Erro ao salvar upload")
-        return jsonify({
-            "message": f"Erro ao salvar no banco: {str(e)}",
-            "inseridas": 0,
-            "atualizadas": 0,
-            "ignoradas": int(len(df)),
-            "erros": erros[:30],
-        }), 500
+        current_app.logger.exception("Erro ao salvar arquivo de upload")
+        for caminho, _, _ in arquivos:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        return jsonify({"message": f"Erro ao receber arquivo: {str(e)}", "inseridas": 0, "atualizadas": 0, "ignoradas": 0, "erros": []}), 500
+
+    job_id = upload_jobs.criar_job(", ".join(nome for _, nome, _ in arquivos))
+    upload_jobs.submeter(
+        job_id,
+        _executar_job,
+        current_app._get_current_object(),
+        arquivos,
+        # backfill=1: COPY para staging + um único merge (PostgreSQL, arquivos grandes)
+        backfill,
+    )
 
     return jsonify({
-        "message": "Upload concluído com sucesso!",
-        "inseridas": inseridas,
-        "atualizadas": atualizadas,
-        "ignoradas": ignoradas,
-        "repetidas_no_arquivo": repetidas_no_arquivo,
+        "message": "Upload recebido. Processando em segundo plano.",
+        "job_id": job_id,
+        "status_url": url_for("upload.upload_status", job_id=job_id),
         "observacao": "Quando o mesmo Appointment ID aparece mais de uma vez, o sistema atualiza o registro já existente em vez de criar uma nova carga.",
-        "erros": erros[:30],
-    }), 200
+    }), 202
+
+
+@upload_bp.route("/status/<job_id>")
+@require_capability("upload")
+def upload_status(job_id):
+    job = upload_jobs.obter_job(job_id)
+    if not job:
+        return jsonify({"error": "Job de upload não encontrado"}), 404
+
+    job["erros"] = job["erros"][:30]
+    return jsonify(job), 200
@@ -0,0 +1,108 @@
+"""
+Carga em massa para backfills (meses de appointments).
+
+As linhas já normalizadas por api/upload.py são enviadas a uma tabela
+temporária com COPY FROM STDIN e aplicadas em cargas com um único
+INSERT ... SELECT ... ON CONFLICT, com as mesmas regras do upsert em lote
+(checkin/closed mantêm o status; fingerprint igual não regrava).
+
+Só PostgreSQL. Tudo roda em uma transação: a staging some no commit/rollback.
+"""
+import io
+from datetime import date, datetime
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from db import db
+
+STAGING = "cargas_staging"
+
+
+def suportado() -> bool:
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def criar_staging(colunas: list[str]) -> None:
+    """Tabela temporária com os tipos de cargas para `colunas` + ordem de chegada."""
+    db.session.execute(text(
+        f"CREATE TEMP TABLE {STAGING} ON COMMIT DROP AS "
+        f"SELECT {', '.join(colunas)} FROM cargas WITH NO DATA"
+    ))
+    # ordem em que as linhas chegaram: no merge, a última de cada appointment vence
+    db.session.execute(text(f"ALTER TABLE {STAGING} ADD COLUMN ordem BIGSERIAL"))
+
+
+def copiar_para_staging(registros: pd.DataFrame) -> None:
+    """COPY de um lote (colunas na ordem de criar_staging); vazio vira NULL."""
+    if registros.empty:
+        return
+
+    buf = io.StringIO()
+    registros.to_csv(buf, header=False, index=False, date_format="%Y-%m-%d %H:%M:%S%z")
+    buf.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {STAGING} ({', '.join(registros.columns)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def dias_afetados() -> set[date]:
+    """
+    Dias (UTC) de created_at/end_time/deleted_at das cargas que a staging vai
+    reescrever (fingerprint diferente), calculados no banco: para o rollup.
+    """
+    return set(db.session.execute(text(f"""
+        SELECT DISTINCT (v.instante AT TIME ZONE 'UTC')::date
+        FROM cargas c
+        CROSS JOIN LATERAL (VALUES (c.created_at), (c.end_time), (c.deleted_at)) AS v(instante)
+        WHERE v.instante IS NOT NULL
+          AND EXISTS (
+            SELECT 1 FROM {STAGING} s
+            WHERE s.appointment_id = c.appointment_id
+              AND s.upload_fingerprint IS DISTINCT FROM c.upload_fingerprint
+          )
+    """)).scalars())
+
+
+def aplicar_staging(colunas: list[str], agora: datetime, status_preservados) -> dict:
+    """
+    Aplica a staging em cargas (sem commit) em um único statement.
+    Retorna {"distintas", "inseridas", "atualizadas"}; o que sobra de
+    "distintas" tinha o mesmo fingerprint e não foi regravado.
+    """
+    lista = ", ".join(colunas)
+    atualizar = ",\n            ".join(
+        "status = CASE WHEN cargas.status IN :preservados THEN cargas.status ELSE EXCLUDED.status END"
+        if c == "status" else f"{c} = EXCLUDED.{c}"
+        for c in colunas if c != "appointment_id"
+    )
+
+    sql = text(f"""
+        WITH ultimas AS (
+            SELECT DISTINCT ON (appointment_id) {lista}
+            FROM {STAGING}
+            ORDER BY appointment_id, ordem DESC
+        ), gravadas AS (
+            INSERT INTO cargas ({lista}, created_at, atraso_registrado, atraso_segundos, updated_at)
+            SELECT {lista}, :agora, false, 0, clock_timestamp() FROM ultimas
+            ON CONFLICT (appointment_id) DO UPDATE SET
+            {atualizar},
+            updated_at = EXCLUDED.updated_at
+            WHERE cargas.upload_fingerprint IS DISTINCT FROM EXCLUDED.upload_fingerprint
+            RETURNING (xmax = 0) AS inserida
+        )
+        SELECT
+            (SELECT COUNT(*) FROM ultimas) AS distintas,
+            COUNT(*) FILTER (WHERE inserida) AS inseridas,
+            COUNT(*) FILTER (WHERE NOT inserida) AS atualizadas
+        FROM gravadas
+    """).bindparams(bindparam("preservados", expanding=True))
+
+    r = db.session.execute(sql, {"agora": agora, "preservados": list(status_preservados)}).mappings().one()
+    return {k: int(v) for k, v in r.items()}
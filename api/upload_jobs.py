@@ -0,0 +1,129 @@
+"""
+Jobs de upload em segundo plano.
+
+O POST de /upload/processar salva o arquivo em disco, registra um job aqui e
+devolve o job_id; a ingestão roda em um pool de threads fora do request.
+Quando o upload traz várias planilhas, o parse/normalização de cada arquivo
+vai para um pool de processos (CPU-bound, não fica preso no GIL).
+
+O estado fica em memória do processo: funciona com o gunicorn.conf.py padrão
+(1 worker, concorrência por threads). Com WEB_CONCURRENCY > 1 o polling pode
+cair em outro processo e receber 404 (o upload.js para e mostra erro).
+"""
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone, timedelta
+
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+
+# Processos para parse de planilhas em uploads com vários arquivos.
+UPLOAD_PARSE_WORKERS = int(os.getenv("UPLOAD_PARSE_WORKERS") or min(4, os.cpu_count() or 1))
+
+# Jobs finalizados ficam consultáveis por este tempo.
+JOB_RETENCAO = timedelta(hours=int(os.getenv("UPLOAD_JOB_RETENCAO_HORAS", "6")))
+
+STATUS_FINAIS = ("concluido", "erro")
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job")
+_jobs: dict[str, dict] = {}
+_lock = threading.Lock()
+
+# Criado sob demanda: só uploads com vários arquivos pagam o custo de subir os processos.
+_parse_executor: ProcessPoolExecutor | None = None
+
+
+def _limpar_antigos(agora: datetime) -> None:
+    expirados = [
+        job_id for job_id, job in _jobs.items()
+        if job["status"] in STATUS_FINAIS and job["finalizado_em"] and agora - job["finalizado_em"] > JOB_RETENCAO
+    ]
+    for job_id in expirados:
+        _jobs.pop(job_id, None)
+
+
+def criar_job(arquivo: str) -> str:
+    agora = datetime.now(timezone.utc)
+    job_id = uuid.uuid4().hex
+
+    with _lock:
+        _limpar_antigos(agora)
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "arquivo": arquivo,
+            "status": "pendente",
+            "message": "Aguardando processamento.",
+            "linhas": 0,
+            "inseridas": 0,
+            "atualizadas": 0,
+            "inalteradas": 0,
+            "ignoradas": 0,
+            "repetidas_no_arquivo": 0,
+            "repetidas": 0,
+            "erros": [],
+            "criado_em": agora,
+            "iniciado_em": None,
+            "finalizado_em": None,
+        }
+
+    return job_id
+
+
+def atualizar_job(job_id: str, **campos) -> None:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        if campos.get("status") == "processando" and not job["iniciado_em"]:
+            job["iniciado_em"] = datetime.now(timezone.utc)
+        if campos.get("status") in STATUS_FINAIS:
+            job["finalizado_em"] = datetime.now(timezone.utc)
+        for k, v in campos.items():
+            job[k] = list(v) if isinstance(v, list) else v
+
+
+def obter_job(job_id: str) -> dict | None:
+    """Cópia do estado atual do job (segura para serializar fora do lock)."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job)
+        snapshot["erros"] = list(job["erros"])
+
+    for k in ("criado_em", "iniciado_em", "finalizado_em"):
+        if snapshot[k]:
+            snapshot[k] = snapshot[k].isoformat()
+    return snapshot
+
+
+def submeter(job_id: str, fn, *args) -> None:
+    _executor.submit(fn, job_id, *args)
+
+
+def _pool_parsing(descartar: ProcessPoolExecutor | None = None) -> ProcessPoolExecutor:
+    global _parse_executor
+    with _lock:
+        if _parse_executor is not None and _parse_executor is descartar:
+            _parse_executor.shutdown(wait=False, cancel_futures=True)
+            _parse_executor = None
+        if _parse_executor is None:
+            # spawn: os jobs rodam em threads com conexões abertas, fork herdaria esse estado.
+            _parse_executor = ProcessPoolExecutor(
+                max_workers=max(1, UPLOAD_PARSE_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_executor
+
+
+def submeter_parsing(fn, *args) -> Future:
+    """Executa fn(*args) no pool de processos; fn e args precisam ser picklable."""
+    pool = _pool_parsing()
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        # um worker morreu (ex.: OOM) em um upload anterior; sobe um pool novo
+        return _pool_parsing(descartar=pool).submit(fn, *args)
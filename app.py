@@ -7,6 +7,7 @@ from api.painel import painel_bp
 from api.dashboard import dashboard_bp
 from api.transferin import transferin_bp
 from api.auth import auth_bp, current_capabilities, current_role, refresh_session_role_from_db
+from api import resumo_diario, sla_varredura
 
 from db import init_db
 import models  # garante que os models sejam importados (Carga etc.)
@@ -17,8 +18,10 @@ def create_app() -> Flask:
     app.secret_key = os.getenv("SECRET_KEY", "dock-view-dev-secret")
 
     # Configs básicas
-    app.config["JSON_SORT_KEYS"] = False
-    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
+    # Flask 3 ignora JSON_SORT_KEYS/JSONIFY_PRETTYPRINT_REGULAR: vale o provider.
+    # JSON compacto (sem indentação) mesmo em debug: as listagens são grandes.
+    app.json.sort_keys = False
+    app.json.compact = True
 
     # CORS
     CORS(app)
@@ -34,6 +37,11 @@ def create_app() -> Flask:
     app.register_blueprint(transferin_bp)
     app.register_blueprint(auth_bp)
 
+    # SLA/no_show/late stow: aplicados em segundo plano, GETs só leem
+    app.cli.add_command(sla_varredura.varrer_sla_command)
+    app.cli.add_command(resumo_diario.consolidar_resumo_command)
+    # a thread da varredura sobe só ao servir (gunicorn.conf.py / __main__), não nos comandos flask
+
     @app.context_processor
     def inject_auth_context():
         return {
@@ -97,4 +105,5 @@ app = create_app()
 # ✅ Rodar localmente
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    sla_varredura.iniciar_agendador(app)
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,32 @@
+# Configuração do gunicorn (lida automaticamente do diretório de trabalho).
+#
+# /pc/stream (SSE) mantém uma conexão aberta por tela do painel. Com o worker
+# sync cada tela prenderia um worker inteiro; com gthread cada stream ocupa uma
+# thread e o timeout vale para o heartbeat do worker, não para a duração do request.
+#
+# Dimensionamento: GUNICORN_THREADS >= PC_STREAM_MAX + threads para os demais
+# requests (listar, dashboard, upload, ações do painel). Com os padrões, 32
+# threads = 12 streams + 20 livres. Acima de PC_STREAM_MAX o /pc/stream
+# responde 503 e as telas extras ficam no polling de /pc/listar; ao subir
+# PC_STREAM_MAX, suba GUNICORN_THREADS junto.
+#
+# Um worker só: os jobs de upload (api/upload_jobs.py) ficam na memória do
+# processo, e com vários workers o polling de /upload/status cai em outro
+# processo (404). A concorrência vem das threads (GUNICORN_THREADS).
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 75
+
+
+def post_worker_init(worker):
+    # Varredura de SLA só em quem serve HTTP (não nos comandos flask); no
+    # PostgreSQL o advisory lock deixa um único worker varrendo.
+    from api import sla_varredura
+
+    sla_varredura.iniciar_agendador(worker.wsgi)
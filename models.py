@@ -7,7 +7,8 @@ class Carga(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
 
-    appointment_id = db.Column(db.String(80), nullable=False, index=True)
+    # Único: o upload faz INSERT ... ON CONFLICT (appointment_id).
+    appointment_id = db.Column(db.String(80), nullable=False, unique=True, index=True)
 
     truck_type = db.Column(db.String(30))
     truck_tipo = db.Column(db.String(30))
@@ -44,8 +45,38 @@ class Carga(db.Model):
     delete_reason = db.Column(db.Text, nullable=True)
     deleted_at = db.Column(db.DateTime(timezone=True), nullable=True)
 
+    # Hash dos campos da planilha no último upload (linhas iguais não são regravadas)
+    upload_fingerprint = db.Column(db.String(16), nullable=True)
+
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    # Última escrita na linha: cursor do /pc/listar?since= (escritas fora do ORM precisam setar)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        index=True,
+    )
+
+    __table_args__ = (
+        # Hot set do painel (/pc/listar?ativas=1): só as cargas em aberto, já na ordem da listagem.
+        db.Index(
+            "ix_cargas_ativas",
+            expected_arrival_date,
+            id,
+            postgresql_where=status.in_(("arrival_scheduled", "arrival", "checkin")),
+            sqlite_where=status.in_(("arrival_scheduled", "arrival", "checkin")),
+        ),
+        # Fechadas recentes do hot set.
+        db.Index(
+            "ix_cargas_fechadas_end_time",
+            end_time,
+            postgresql_where=status == "closed",
+            sqlite_where=status == "closed",
+        ),
+    )
+
 
 class Operador(db.Model):
     __tablename__ = "op"
@@ -86,3 +117,36 @@ class Transferencia(db.Model):
     comentario_late_stow_em = db.Column(db.DateTime(timezone=True), nullable=True)
 
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    # Última escrita na linha: versão (ETag) do /transferin/listar (escritas fora do ORM precisam setar)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        nullable=False,
+    )
+
+
+class ResumoDiarioCarga(db.Model):
+    """Rollup do /dashboard/stats: um grupo (dia UTC, status, AA) de cargas (api/resumo_diario.py)."""
+    __tablename__ = "cargas_daily_stats"
+
+    dia = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    # '' quando sem AA (só closed guarda o AA)
+    aa_responsavel = db.Column(db.String(80), primary_key=True, default="")
+
+    notas = db.Column(db.Integer, default=0, nullable=False)
+    units = db.Column(db.BigInteger, default=0, nullable=False)
+    tempo_total_segundos = db.Column(db.BigInteger, default=0, nullable=False)
+    soma_units_por_hora = db.Column(db.Float, default=0, nullable=False)
+    qtd_units_por_hora = db.Column(db.Integer, default=0, nullable=False)
+
+
+class ResumoDiarioDia(db.Model):
+    """Dias do rollup: consolidado=False (ou sem linha) = calcular ao vivo a partir de cargas."""
+    __tablename__ = "cargas_daily_stats_dias"
+
+    dia = db.Column(db.Date, primary_key=True)
+    consolidado = db.Column(db.Boolean, default=False, nullable=False)
+    calculado_em = db.Column(db.DateTime(timezone=True), nullable=True)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Backfill de planilhas grandes (meses de appointments) em cargas.
+
+Mesma normalização do upload, mas as linhas vão por COPY para uma tabela
+temporária e são aplicadas com um único INSERT ... ON CONFLICT (ver
+api/upload_backfill.py). Só PostgreSQL; tudo ou nada (uma transação).
+
+Uso:
+  python scripts/backfill_cargas.py export_jan.csv export_fev.csv
+  python scripts/backfill_cargas.py historico.xlsx --chunk-rows 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import Flask
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from db import init_db
+import models  # registra Carga no metadata
+from api import upload
+from api.upload import _backfill_arquivos, _novo_resumo
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser()
+    p.add_argument("arquivos", nargs="+", type=Path, help="Planilhas (CSV da exportação ou Excel), na ordem: a última vence")
+    p.add_argument("--chunk-rows", type=int, default=upload.UPLOAD_CHUNK_ROWS, help="Linhas por lote de COPY")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    upload.UPLOAD_CHUNK_ROWS = args.chunk_rows
+
+    faltando = [str(a) for a in args.arquivos if not a.is_file()]
+    if faltando:
+        sys.exit(f"Arquivo não encontrado: {', '.join(faltando)}")
+
+    app = Flask(__name__)
+    init_db(app)
+
+    inicio = time.perf_counter()
+
+    def _progresso(r: dict) -> None:
+        print(f"- staging: {r['linhas']} linhas lidas ({time.perf_counter() - inicio:.1f}s)")
+
+    with app.app_context():
+        resumo = _backfill_arquivos(
+            [(str(a), a.name, None) for a in args.arquivos],
+            datetime.now(timezone.utc),
+            _novo_resumo(),
+            ao_copiar=_progresso,
+        )
+
+    print(
+        f"Backfill concluído em {time.perf_counter() - inicio:.1f}s | linhas: {resumo['linhas']} | "
+        f"inseridas: {resumo['inseridas']} | atualizadas: {resumo['atualizadas']} | "
+        f"inalteradas: {resumo['inalteradas']} | ignoradas: {resumo['ignoradas']}"
+    )
+    for erro in resumo["erros"]:
+        print(f"  {erro}")
+
+
+if __name__ == "__main__":
+    main()
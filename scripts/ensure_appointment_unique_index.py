@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Garante índice único em cargas.appointment_id (necessário para o upsert em lote do upload).
+
+Uso (dry-run):
+  python scripts/ensure_appointment_unique_index.py
+
+Aplicar:
+  python scripts/ensure_appointment_unique_index.py --apply
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from db import db
+from db import init_db
+from flask import Flask
+
+
+DUPLICADOS_SQL = """
+SELECT appointment_id, COUNT(*) AS qtd, ARRAY_AGG(id ORDER BY id) AS ids
+FROM cargas
+GROUP BY appointment_id
+HAVING COUNT(*) > 1
+ORDER BY COUNT(*) DESC
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser()
+    p.add_argument("--apply", action="store_true", help="Cria o índice. Sem essa flag executa dry-run")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = Flask(__name__)
+    init_db(app)
+
+    with app.app_context():
+        duplicados = db.session.execute(text(DUPLICADOS_SQL)).mappings().all()
+
+        if duplicados:
+            print(f"Appointments duplicados: {len(duplicados)} (resolva antes de criar o índice)")
+            for r in duplicados[:20]:
+                print(f"- appt={r['appointment_id']} qtd={r['qtd']} ids={r['ids']}")
+            if len(duplicados) > 20:
+                print(f"... +{len(duplicados)-20} appointments")
+            return
+
+        print("Nenhum appointment duplicado em cargas.")
+
+        if not args.apply:
+            print("Dry-run concluído. Use --apply para criar o índice único.")
+            return
+
+        # O índice não-único antigo (index=True) tem o mesmo nome; é substituído.
+        db.session.execute(text("DROP INDEX IF EXISTS ix_cargas_appointment_id"))
+        db.session.execute(text("CREATE UNIQUE INDEX ix_cargas_appointment_id ON cargas (appointment_id)"))
+        db.session.commit()
+        print("Índice único ix_cargas_appointment_id criado.")
+
+
+if __name__ == "__main__":
+    main()
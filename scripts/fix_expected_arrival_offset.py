@@ -10,6 +10,10 @@ Aplicar:
 
 Filtro por appointments:
   python scripts/fix_expected_arrival_offset.py --offset-hours 3 --appointments 92265056969,75525056969 --apply
+
+O UPDATE grava updated_at (ETag e delta since= do /pc/listar), invalida os
+dias do rollup do dashboard (api/resumo_diario.py) e publica um evento de
+cargas no commit (painéis abertos buscam o delta).
 """
 
 from __future__ import annotations
@@ -29,6 +33,8 @@ from db import db
 from db import init_db
 from flask import Flask
 
+from api import eventos_cargas, resumo_diario
+
 
 BACKUP_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS cargas_expected_arrival_backup (
@@ -84,6 +90,7 @@ def main():
             params["appointments"] = appointments
 
         where_clause = " AND ".join(filters)
+        where_params = {k: v for k, v in params.items() if k != "offset_hours"}
 
         preview_sql = text(
             f"""
@@ -122,14 +129,19 @@ def main():
         )
         db.session.execute(backup_insert, {**params, "reason": f"offset_hours={args.offset_hours}"})
 
+        # antes do UPDATE: dias do rollup das cargas afetadas voltam ao vivo
+        resumo_diario.invalidar_onde(text(where_clause).bindparams(**where_params))
+
         update_sql = text(
             f"""
             UPDATE cargas
-            SET expected_arrival_date = expected_arrival_date + make_interval(hours => :offset_hours)
+            SET expected_arrival_date = expected_arrival_date + make_interval(hours => :offset_hours),
+                updated_at = NOW()
             WHERE {where_clause}
             """
         )
         db.session.execute(update_sql, params)
+        eventos_cargas.publicar("correcao_expected", cargas=len(rows))
         db.session.commit()
         print("Atualização aplicada com backup em cargas_expected_arrival_backup.")
 
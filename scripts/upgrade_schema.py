@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Aplica no banco as colunas/índices novos dos models (idempotente, sem apagar dados).
+
+Uso (dry-run, só lista os comandos):
+  python scripts/upgrade_schema.py
+
+Aplicar:
+  python scripts/upgrade_schema.py --apply
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from db import db
+from db import init_db
+from flask import Flask
+
+
+# Em ordem; cada comando pode ser reexecutado sem efeito.
+DDL = [
+    # upload delta: fingerprint da linha da planilha
+    "ALTER TABLE cargas ADD COLUMN IF NOT EXISTS upload_fingerprint VARCHAR(16)",
+    # painel incremental: cursor de alterações (/pc/listar?since=)
+    "ALTER TABLE cargas ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_cargas_updated_at ON cargas (updated_at)",
+    # painel: hot set (ativas=1) e paginação por (expected_arrival_date, id)
+    "CREATE INDEX IF NOT EXISTS ix_cargas_ativas ON cargas (expected_arrival_date, id) "
+    "WHERE status IN ('arrival_scheduled', 'arrival', 'checkin')",
+    "CREATE INDEX IF NOT EXISTS ix_cargas_fechadas_end_time ON cargas (end_time) WHERE status = 'closed'",
+    # transferin: versão (ETag) do /transferin/listar
+    "ALTER TABLE transferencias ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    # dashboard: rollup diário (api/resumo_diario.py); popular com `flask consolidar-resumo-diario`
+    "CREATE TABLE IF NOT EXISTS cargas_daily_stats ("
+    "dia DATE NOT NULL, status VARCHAR(20) NOT NULL, aa_responsavel VARCHAR(80) NOT NULL DEFAULT '', "
+    "notas INTEGER NOT NULL DEFAULT 0, units BIGINT NOT NULL DEFAULT 0, "
+    "tempo_total_segundos BIGINT NOT NULL DEFAULT 0, soma_units_por_hora DOUBLE PRECISION NOT NULL DEFAULT 0, "
+    "qtd_units_por_hora INTEGER NOT NULL DEFAULT 0, "
+    "PRIMARY KEY (dia, status, aa_responsavel))",
+    # coluna sem leitor (a lista de atrasos do dashboard é calculada em cargas)
+    "ALTER TABLE cargas_daily_stats DROP COLUMN IF EXISTS atrasadas",
+    "CREATE TABLE IF NOT EXISTS cargas_daily_stats_dias ("
+    "dia DATE PRIMARY KEY, consolidado BOOLEAN NOT NULL DEFAULT false, calculado_em TIMESTAMPTZ)",
+]
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser()
+    p.add_argument("--apply", action="store_true", help="Executa os comandos. Sem essa flag executa dry-run")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    app = Flask(__name__)
+    init_db(app)
+
+    for sql in DDL:
+        print(f"- {sql}")
+
+    if not args.apply:
+        print("Dry-run concluído. Use --apply para efetivar.")
+        return
+
+    with app.app_context():
+        for sql in DDL:
+            db.session.execute(text(sql))
+        db.session.commit()
+        print(f"Schema atualizado ({len(DDL)} comandos).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 // /static/js/painel.js
 // Versão limpa (sem funções duplicadas) + suporte a ARRIVAL_SCHEDULED + SLA 4h em ARRIVAL
-// Requisitos do backend (/pc/listar):
+// Atualização: eventos SSE de /pc/stream disparam o delta; sem stream, polling.
+// Requisitos do backend (/pc/listar?since=<cursor>, resposta {cargas, cursor, completo, removidas}):
 // - status: "arrival_scheduled" | "arrival" | "checkin" | "closed" | "no_show" | "deleted"
 // - tempo_sla_segundos (number | null) para status arrival e arrival_scheduled (quando aplicável)
 // - start_time (ISO | null) para status checkin
@@ -10,6 +11,8 @@
 document.addEventListener("DOMContentLoaded", () => {
     setarFiltrosDataHoje();
     carregarCargas();
+    conectarStream();
+    setInterval(pollSemStream, PAINEL_POLL_MS);
 
     // Se seus botões de filtro chamam via onclick no HTML, ok.
     // Se preferir, pode ativar listeners aqui:
@@ -17,8 +20,23 @@ document.addEventListener("DOMContentLoaded", () => {
     // document.getElementById("btnLimpar")?.addEventListener("click", limparFiltros);
 });
 
+const PAINEL_POLL_MS = 15000;
+// Snapshot completo de tempos em tempos (remoções definitivas não vêm no delta).
+const PAINEL_RESYNC_MS = 10 * 60 * 1000;
+const PAINEL_DELTA_DEBOUNCE_MS = 300;
+// /pc/stream sem vaga (503): o EventSource desiste; nova tentativa depois disso.
+const PAINEL_STREAM_RETRY_MS = 60 * 1000;
+
 let timers = {};
 let cargasGlobais = [];
+let cursorCargas = null;
+let filtrosCarregados = null;
+let etagListar = { url: null, etag: null };
+let cargasSelecionadas = new Set();
+let cargasVisiveis = [];
+let ultimoSnapshotMs = 0;
+let streamAberto = false;
+let deltaAgendado = null;
 
 function can(cap) {
     return Boolean(window.AUTH_CAPS && window.AUTH_CAPS[cap]);
@@ -28,30 +46,188 @@ function getCargaById(cargaId) {
     return cargasGlobais.find(c => String(c.id) === String(cargaId)) || null;
 }
 
+// format=columnar (api/compacto.py): {colunas, tempo, linhas} -> array de objetos,
+// colunas de "tempo" (epoch em segundos) voltam a ISO. Array (formato legado) passa direto.
+function decodificarColunar(dados) {
+    if (!dados || Array.isArray(dados)) return dados;
+    const tempo = new Set(dados.tempo || []);
+    const colunas = dados.colunas || [];
+    return (dados.linhas || []).map(valores => {
+        const obj = {};
+        colunas.forEach((coluna, i) => {
+            const v = valores[i];
+            obj[coluna] = tempo.has(coluna) && v != null ? new Date(v * 1000).toISOString() : v;
+        });
+        return obj;
+    });
+}
+
 // =====================================================
 // 🔄 CARREGAR CARGAS
 // =====================================================
 
+// /pc/listar?since=<cursor> devolve só o que mudou desde o último poll;
+// since vazio devolve o snapshot completo. Os filtros de data/status/appointment
+// vão para o servidor (sem data: só o hot set, ativas=1); a tela refiltra localmente.
 function carregarCargas() {
-    fetch("/pc/listar")
-        .then(res => res.json())
+    const filtros = parametrosServidor();
+    const snapshot = !cursorCargas
+        || filtros !== filtrosCarregados
+        || (Date.now() - ultimoSnapshotMs) > PAINEL_RESYNC_MS;
+    const since = snapshot ? "" : cursorCargas;
+
+    buscarPaginas(filtros, since)
         .then(data => {
-            if (!Array.isArray(data)) {
-                console.error("Resposta inesperada em /pc/listar:", data);
-                cargasGlobais = [];
-                renderizarTabela([]);
+            if (!data) return;
+            if (data.naoModificado) {
+                // 304: nada mudou desde a última resposta desta URL
+                if (snapshot && filtros === filtrosCarregados) ultimoSnapshotMs = Date.now();
                 return;
             }
-            cargasGlobais = data;
+
+            const recebidas = data.cargas.map(marcarRecebimento);
+            if (data.completo) {
+                cargasGlobais = recebidas;
+                filtrosCarregados = filtros;
+                ultimoSnapshotMs = Date.now();
+            } else {
+                mesclarCargas(recebidas, data.removidas || []);
+            }
+            if (data.cursor) cursorCargas = data.cursor;
             aplicarFiltros();
         })
         .catch(err => {
             console.error("Erro ao carregar cargas:", err);
-            cargasGlobais = [];
-            renderizarTabela([]);
         });
 }
 
+// Segue o "proxima" até a última página; o cursor vale o da primeira.
+// A primeira página vai com If-None-Match: a versão cobre o conjunto inteiro,
+// então 304 nela vale para todas as páginas. Pede format=columnar (menor na rede).
+async function buscarPaginas(filtros, since) {
+    const base = `/pc/listar?${filtros}&format=columnar&since=${encodeURIComponent(since)}`;
+    let url = base;
+    let resultado = null;
+
+    const headers = etagListar.url === base ? { "If-None-Match": etagListar.etag } : {};
+    const primeira = await fetch(base, { headers });
+    if (primeira.status === 304) return { naoModificado: true };
+    etagListar = { url: base, etag: primeira.headers.get("ETag") };
+
+    while (url) {
+        const resposta = url === base ? primeira : await fetch(url);
+        const data = await resposta.json();
+        if (data) data.cargas = decodificarColunar(data.cargas);
+        if (!data || !Array.isArray(data.cargas)) {
+            console.error("Resposta inesperada em /pc/listar:", data);
+            return null;
+        }
+
+        if (resultado) {
+            resultado.cargas.push(...data.cargas);
+        } else {
+            resultado = data;
+        }
+        url = data.proxima ? `${base}&apos=${encodeURIComponent(data.proxima)}` : null;
+    }
+
+    return resultado;
+}
+
+function parametrosServidor() {
+    const params = new URLSearchParams();
+    const dataInicio = document.getElementById("filtroDataInicio")?.value;
+    const dataFim = document.getElementById("filtroDataFim")?.value;
+    const appointment = (document.getElementById("filtroAppointment")?.value || "").trim();
+    const select = document.getElementById("filtroStatus");
+
+    if (dataInicio) params.set("de", dataInicio);
+    if (dataFim) params.set("ate", dataFim);
+    if (!dataInicio && !dataFim) params.set("ativas", "1");
+    if (appointment) params.set("appointment", appointment);
+    if (select) {
+        Array.from(select.selectedOptions).forEach(option => params.append("status", option.value));
+    }
+
+    return params.toString();
+}
+
+// =====================================================
+// 📡 STREAM (SSE)
+// =====================================================
+
+// Com o stream aberto o polling fica parado (só o resync periódico);
+// se cair, o EventSource reconecta sozinho e o polling cobre o intervalo.
+function conectarStream() {
+    if (!window.EventSource) return;
+
+    const stream = new EventSource("/pc/stream");
+
+    stream.onopen = () => {
+        streamAberto = true;
+        // eventos perdidos enquanto estava desconectado
+        carregarCargas();
+    };
+
+    stream.onerror = () => {
+        streamAberto = false;
+        // resposta de erro (ex.: 503 no limite de streams) fecha o EventSource de vez;
+        // enquanto isso o polling cobre
+        if (stream.readyState === EventSource.CLOSED) {
+            setTimeout(conectarStream, PAINEL_STREAM_RETRY_MS);
+        }
+    };
+
+    stream.addEventListener("carga", ev => {
+        let evento = {};
+        try {
+            evento = JSON.parse(ev.data);
+        } catch (e) {
+            console.error("Evento inválido em /pc/stream:", ev.data);
+        }
+        if (evento.snapshot) cursorCargas = null;
+        agendarDelta();
+    });
+}
+
+// Rajadas de eventos (upload em lotes, varredura) viram um único delta.
+function agendarDelta() {
+    if (deltaAgendado) return;
+    deltaAgendado = setTimeout(() => {
+        deltaAgendado = null;
+        carregarCargas();
+    }, PAINEL_DELTA_DEBOUNCE_MS);
+}
+
+function pollSemStream() {
+    const resyncVencido = (Date.now() - ultimoSnapshotMs) > PAINEL_RESYNC_MS;
+    if (!streamAberto || resyncVencido) carregarCargas();
+}
+
+// removidas: ids alterados que saíram do filtro do servidor (status/aa/ativas)
+function mesclarCargas(recebidas, removidas = []) {
+    const porId = new Map(cargasGlobais.map(c => [String(c.id), c]));
+    removidas.forEach(id => porId.delete(String(id)));
+    recebidas.forEach(c => porId.set(String(c.id), c));
+    cargasGlobais = Array.from(porId.values())
+        .sort((a, b) => String(a.expected_arrival_date ?? "").localeCompare(String(b.expected_arrival_date ?? "")));
+}
+
+// tempo_sla_segundos é relativo ao momento da resposta; guarda o prazo absoluto
+// para que cargas que não vieram no delta continuem com o timer certo.
+function marcarRecebimento(carga) {
+    if (typeof carga.tempo_sla_segundos === "number") {
+        carga.sla_deadline_ms = Date.now() + carga.tempo_sla_segundos * 1000;
+    }
+    return carga;
+}
+
+function atualizarTempoSLA(carga) {
+    if (typeof carga.sla_deadline_ms === "number") {
+        carga.tempo_sla_segundos = Math.round((carga.sla_deadline_ms - Date.now()) / 1000);
+    }
+}
+
 // =====================================================
 // 🧱 RENDERIZAR TABELA
 // =====================================================
@@ -68,8 +244,11 @@ function renderizarTabela(cargas) {
     }
 
     tabela.innerHTML = "";
+    cargasVisiveis = cargas;
+    atualizarContadorSelecao();
 
     cargas.forEach(carga => {
+        atualizarTempoSLA(carga);
 
         const tr = document.createElement("tr");
         tr.id = `row-carga-${carga.id}`;
@@ -85,6 +264,7 @@ function renderizarTabela(cargas) {
         }
 
         tr.innerHTML = `
+            <td><input type="checkbox" ${cargasSelecionadas.has(String(carga.id)) ? "checked" : ""} onchange="alternarSelecao('${carga.id}', this.checked)"></td>
             <td>${renderAppointmentLink(carga.appointment_id)}</td>
             <td>${carga.truck_tipo ?? "-"}</td>
             <td>${formatarData(carga.expected_arrival_date)}</td>
@@ -290,6 +470,76 @@ function renderizarBotaoAcao(carga) {
     return "-";
 }
 
+// =====================================================
+// ☑️ AÇÕES EM LOTE (/pc/bulk)
+// =====================================================
+function alternarSelecao(cargaId, marcada) {
+    if (marcada) cargasSelecionadas.add(String(cargaId));
+    else cargasSelecionadas.delete(String(cargaId));
+    atualizarContadorSelecao();
+}
+
+function selecionarTodas(marcada) {
+    cargasVisiveis.forEach(c => alternarSelecao(c.id, marcada));
+    aplicarFiltros();
+}
+
+function limparSelecao() {
+    cargasSelecionadas.clear();
+    const todas = document.getElementById("selecionarTodas");
+    if (todas) todas.checked = false;
+    aplicarFiltros();
+}
+
+function atualizarContadorSelecao() {
+    const el = document.getElementById("contadorSelecionadas");
+    if (el) el.innerText = `${cargasSelecionadas.size} selecionadas`;
+}
+
+const ROTULOS_LOTE = { carga_chegou: "CARGA CHEGOU", finalizar: "finalizar", deletar: "deletar" };
+
+function executarEmLote(action) {
+    const ids = Array.from(cargasSelecionadas);
+    if (!ids.length) {
+        alert("Selecione ao menos uma carga.");
+        return;
+    }
+
+    let payload = {};
+    if (action === "deletar") {
+        const motivo = (prompt(`Motivo da exclusão de ${ids.length} carga(s):`) || "").trim();
+        if (!motivo) return;
+        payload = { motivo };
+    } else if (!confirm(`Confirma ${ROTULOS_LOTE[action]} para ${ids.length} carga(s)?`)) {
+        return;
+    }
+
+    fetch("/pc/bulk", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ acoes: ids.map(id => ({ id: Number(id), action, payload })) })
+    })
+        .then(res => res.json())
+        .then(resp => {
+            if (resp?.error) {
+                alert(resp.error);
+                return;
+            }
+
+            const falhas = (resp.resultados || []).filter(r => !r.ok);
+            if (falhas.length) {
+                const linhas = falhas.map(r => `${getCargaById(r.id)?.appointment_id ?? r.id}: ${r.error}`);
+                alert(`${resp.ok} ok, ${falhas.length} com falha:\n${linhas.join("\n")}`);
+            }
+            limparSelecao();
+            carregarCargas();
+        })
+        .catch(err => {
+            console.error("Erro na ação em lote:", err);
+            alert("Erro na ação em lote.");
+        });
+}
+
 let expertCargaSelecionada = null;
 
 function expertGerenciarCarga(cargaId) {
@@ -358,6 +608,8 @@ function deletarHardExpert() {
         .then(resp => {
             if (resp?.error) return alert(resp.error);
             fecharModalExpertCarga();
+            // remoção não aparece no delta: força snapshot completo
+            cursorCargas = null;
             carregarCargas();
         })
         .catch(() => alert("Erro ao deletar carga."));
@@ -368,7 +620,10 @@ function deletarHardExpert() {
 function cargaChegou(cargaId) {
     fetch(`/pc/carga-chegou/${cargaId}`, { method: "POST" })
         .then(res => res.json())
-        .then(() => carregarCargas())
+        .then(resp => {
+            if (resp?.error) alert(resp.error);
+            carregarCargas();
+        })
         .catch(err => {
             console.error("Erro ao marcar CARGA CHEGOU:", err);
             alert("Erro ao marcar CARGA CHEGOU.");
@@ -448,6 +703,8 @@ function confirmarAA() {
         .then(resp => {
             if (resp?.error) {
                 alert(resp.error);
+                // 409: outro operador já mudou a carga
+                carregarCargas();
                 return;
             }
             fecharModalAA();
@@ -521,6 +778,7 @@ function confirmarDelete() {
         .then(resp => {
             if (resp?.error) {
                 alert(resp.error);
+                carregarCargas();
                 return;
             }
             fecharModalDelete();
@@ -655,6 +913,12 @@ function formatarStatusLabel(status) {
 // 🎚 FILTROS
 // =====================================================
 function aplicarFiltros() {
+    // filtro do servidor mudou: recarrega (o render vem no fim do carregamento)
+    if (filtrosCarregados !== null && parametrosServidor() !== filtrosCarregados) {
+        carregarCargas();
+        return;
+    }
+
     const dataInicio = document.getElementById("filtroDataInicio")?.value;
     const dataFim = document.getElementById("filtroDataFim")?.value;
     const appointment = (document.getElementById("filtroAppointment")?.value || "").toLowerCase();
@@ -684,7 +948,7 @@ function aplicarFiltros() {
         // APPOINTMENT
         if (appointment) {
             const id = (carga.appointment_id ?? "").toString().toLowerCase();
-            if (!id.includes(appointment)) return false;
+            if (!id.startsWith(appointment)) return false;
         }
 
         return true;
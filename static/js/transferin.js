@@ -2,11 +2,28 @@ let transferenciaSelecionada = null;
 let transferenciaAppointmentSelecionada = "";
 let timersTransfer = {};
 let transferenciasCache = [];
+let etagTransferencias = { url: null, etag: null };
 
 function can(cap) {
     return Boolean(window.AUTH_CAPS && window.AUTH_CAPS[cap]);
 }
 
+// format=columnar (api/compacto.py): {colunas, tempo, linhas} -> array de objetos,
+// colunas de "tempo" (epoch em segundos) voltam a ISO. Array (formato legado) passa direto.
+function decodificarColunar(dados) {
+    if (!dados || Array.isArray(dados)) return dados;
+    const tempo = new Set(dados.tempo || []);
+    const colunas = dados.colunas || [];
+    return (dados.linhas || []).map(valores => {
+        const obj = {};
+        colunas.forEach((coluna, i) => {
+            const v = valores[i];
+            obj[coluna] = tempo.has(coluna) && v != null ? new Date(v * 1000).toISOString() : v;
+        });
+        return obj;
+    });
+}
+
 document.addEventListener("DOMContentLoaded", () => {
     carregarTransferencias();
 });
@@ -19,10 +36,18 @@ function carregarTransferencias() {
     const origem = document.getElementById("filtroTransferOrigem")?.value || "";
     const status = document.getElementById("filtroTransferStatus")?.value || "";
 
-    const params = new URLSearchParams({ appointment, origem, status });
+    const params = new URLSearchParams({ appointment, origem, status, format: "columnar" });
 
-    fetch(`/transferin/listar?${params.toString()}`)
-        .then(r => r.json())
+    const url = `/transferin/listar?${params.toString()}`;
+    const headers = etagTransferencias.url === url ? { "If-None-Match": etagTransferencias.etag } : {};
+
+    fetch(url, { headers })
+        .then(r => {
+            // 304: mesma versão da última resposta desta URL, redesenha do cache
+            if (r.status === 304) return transferenciasCache;
+            etagTransferencias = { url, etag: r.headers.get("ETag") };
+            return r.json().then(decodificarColunar);
+        })
         .then(renderizarTransferencias)
         .catch(err => {
             console.error(err);
@@ -58,7 +83,7 @@ function renderizarTransferencias(lista) {
             <td>${t.vrid || "-"}</td>
             <td>${t.origem || "-"}</td>
             <td>${formatarData(t.late_stow_deadline)}</td>
-            <td id="timer-transfer-${t.id}">${formatarTempoPrazo(t.tempo_prazo_segundos, t.finalizada)}</td>
+            <td id="timer-transfer-${t.id}">${formatarTempoPrazo(tempoPrazoAtual(t), t.finalizada)}</td>
             <td><span class="badge-transfer badge-${statusCard}">${statusCard}</span></td>
             <td>${renderComentarioLateStow(t)}</td>
             <td>
@@ -69,12 +94,20 @@ function renderizarTransferencias(lista) {
 
         tbody.appendChild(tr);
 
-        if (!t.finalizada && typeof t.tempo_prazo_segundos === "number") {
-            iniciarTimerPrazo(t.id, t.tempo_prazo_segundos);
+        if (!t.finalizada && typeof tempoPrazoAtual(t) === "number") {
+            iniciarTimerPrazo(t.id, tempoPrazoAtual(t));
         }
     });
 }
 
+// Calculado a partir do prazo absoluto: a lista pode vir do cache (304).
+function tempoPrazoAtual(t) {
+    if (t.finalizada || !t.late_stow_deadline) return null;
+    const deadline = Date.parse(t.late_stow_deadline);
+    if (isNaN(deadline)) return null;
+    return Math.round((deadline - Date.now()) / 1000);
+}
+
 function renderComentarioLateStow(t) {
     if (!can("transferin_edit")) return "-";
     if (!t.prazo_estourado) return "-";
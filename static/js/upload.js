@@ -1,37 +1,88 @@
-function enviarPlanilha() {
+const UPLOAD_POLL_MS = 1000;
+
+function enviarPlanilha(preview = false) {
     const fileInput = document.getElementById("fileInput");
-    const file = fileInput.files[0];
+    const files = Array.from(fileInput.files);
 
-    if (!file) {
+    if (!files.length) {
         alert("Selecione um arquivo!");
         return;
     }
 
     const formData = new FormData();
-    formData.append("file", file);
+    files.forEach(file => formData.append("file", file));
+
+    document.getElementById("resultado").innerHTML = `<p>Enviando ${files.length > 1 ? `${files.length} arquivos` : "arquivo"}...</p>`;
 
-    fetch("/upload/processar", {
+    fetch(preview ? "/upload/processar?preview=1" : "/upload/processar", {
         method: "POST",
         body: formData
     })
     .then(response => response.json())
     .then(data => {
-        const erros = Array.isArray(data.erros) ? data.erros : [];
-        const errosHtml = erros.length
-            ? `<details><summary>Erros (${erros.length})</summary><pre>${erros.join("\n")}</pre></details>`
-            : "";
-
-        document.getElementById("resultado").innerHTML =
-            `<p>${data.message}</p>
-             <p>Cargas inseridas: ${data.inseridas}</p>
-             <p>Cargas atualizadas: ${data.atualizadas ?? 0}</p>
-             <p>Ignoradas: ${data.ignoradas}</p>
-             <p>Appointments repetidos no arquivo: ${data.repetidas_no_arquivo ?? 0}</p>
-             ${data.observacao ? `<p><strong>Obs.:</strong> ${data.observacao}</p>` : ""}
-             ${errosHtml}`;
+        if (!data.status_url) {
+            renderResultado(data);
+            return;
+        }
+        acompanharJob(data.status_url, data.observacao);
     })
     .catch(error => {
         console.error(error);
         alert("Erro no upload.");
     });
 }
+
+function acompanharJob(statusUrl, observacao) {
+    fetch(statusUrl, { headers: { "Accept": "application/json" } })
+    .then(response => response.json().catch(() => ({})).then(job => {
+        if (!response.ok) {
+            throw new Error(job.error || `HTTP ${response.status}`);
+        }
+        return job;
+    }))
+    .then(job => {
+        if (job.status === "concluido" || job.status === "erro") {
+            renderResultado({ ...job, observacao });
+            return;
+        }
+
+        renderResultado({
+            ...job,
+            message: `${job.message} (${job.linhas ?? 0} linhas processadas)`
+        });
+        setTimeout(() => acompanharJob(statusUrl, observacao), UPLOAD_POLL_MS);
+    })
+    .catch(error => {
+        console.error(error);
+        renderResultado({ status: "erro", message: `Erro ao consultar andamento do upload: ${error.message}` });
+    });
+}
+
+function renderResultado(data) {
+    const erros = Array.isArray(data.erros) ? data.erros : [];
+    const errosHtml = erros.length
+        ? `<details><summary>Erros (${erros.length})</summary><pre>${erros.join("\n")}</pre></details>`
+        : "";
+
+    document.getElementById("resultado").innerHTML =
+        `<p>${data.message}</p>
+         <p>Cargas inseridas: ${data.inseridas ?? 0}</p>
+         <p>Cargas atualizadas: ${data.atualizadas ?? 0}</p>
+         <p>Sem alteração: ${data.inalteradas ?? 0}</p>
+         <p>Ignoradas: ${data.ignoradas ?? 0}</p>
+         <p>Appointments repetidos no arquivo: ${data.repetidas_no_arquivo ?? 0}</p>
+         <p>Linhas repetidas descartadas (vale a última): ${data.repetidas ?? 0}</p>
+         ${data.preview ? `<p>Ficariam no_show: ${data.no_show ?? 0} (novas: ${data.no_show_novas ?? 0})</p>` : ""}
+         ${data.observacao ? `<p><strong>Obs.:</strong> ${data.observacao}</p>` : ""}
+         ${errosHtml}
+         ${data.preview ? renderExemplos(data.exemplos || {}) : ""}`;
+}
+
+function renderExemplos(exemplos) {
+    return Object.entries(exemplos)
+        .filter(([, itens]) => itens.length)
+        .map(([categoria, itens]) =>
+            `<details><summary>Exemplos: ${categoria} (${itens.length})</summary><pre>${itens.map(i => JSON.stringify(i)).join("\n")}</pre></details>`
+        )
+        .join("");
+}
@@ -0,0 +1,119 @@
+import unittest
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga
+from api import cache_versionado, coalescencia
+from api import dashboard
+from api.dashboard import _agregados_cargas, _cargas_atrasadas, dashboard_bp
+from api.painel import painel_bp
+
+
+class MemoriaBackendTests(unittest.TestCase):
+    def test_lru_and_ttl(self):
+        backend = cache_versionado.MemoriaBackend(max_entradas=2)
+        backend.gravar("a", (200, [], b"a"), None)
+        backend.gravar("b", (200, [], b"b"), None)
+        backend.obter("a")
+        backend.gravar("c", (200, [], b"c"), None)
+
+        self.assertIsNone(backend.obter("b"))
+        self.assertEqual(backend.obter("a"), (200, [], b"a"))
+
+        backend.gravar("d", (200, [], b"d"), 0)
+        self.assertIsNone(backend.obter("d"))
+
+
+class DashboardCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(dashboard_bp)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.now(timezone.utc)
+        self.carga = Carga(
+            appointment_id="C1",
+            expected_arrival_date=agora,
+            priority_last_update=agora,
+            status="arrival",
+        )
+        db.session.add(self.carga)
+        db.session.commit()
+
+        for alvo in ("api.auth.has_capability", "api.dashboard.has_capability"):
+            permissao = mock.patch(alvo, return_value=True)
+            permissao.start()
+            self.addCleanup(permissao.stop)
+
+        self.backend = cache_versionado.MemoriaBackend()
+        cache_versionado.usar_backend(self.backend)
+        self.addCleanup(cache_versionado.usar_backend, cache_versionado.MemoriaBackend())
+
+        calculo = mock.patch("api.dashboard._agregados_cargas", side_effect=_agregados_cargas)
+        self.calculo = calculo.start()
+        self.addCleanup(calculo.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _stats(self, fim):
+        coalescencia.invalidar()
+        hoje = datetime.now(timezone.utc).date()
+        inicio = (hoje - timedelta(days=10)).isoformat()
+        return self.client.get("/dashboard/stats", query_string={"dataInicio": inicio, "dataFim": fim}).get_json()
+
+    def test_same_range_is_served_from_cache_until_a_write(self):
+        hoje = datetime.now(timezone.utc).date().isoformat()
+        primeira = self._stats(hoje)
+        self.assertEqual(self._stats(hoje), primeira)
+        self.assertEqual(self.calculo.call_count, 1)
+
+        resposta = self.client.post(f"/pc/checkin/{self.carga.id}", json={"aa_responsavel": "aa1"})
+        self.assertEqual(resposta.status_code, 200)
+
+        depois = self._stats(hoje)
+        self.assertEqual(self.calculo.call_count, 2)
+        self.assertEqual((depois["total_notas_pendentes"], depois["total_notas_andamento"]), (0, 1))
+
+    def test_past_ranges_keep_aggregates_but_recompute_live_lists(self):
+        ontem = (datetime.now(timezone.utc).date() - timedelta(days=1)).isoformat()
+        hoje = datetime.now(timezone.utc).date().isoformat()
+        self.assertGreater(dashboard.DASHBOARD_CACHE_TTL_PASSADO, dashboard.DASHBOARD_CACHE_TTL)
+
+        atrasadas = mock.patch("api.dashboard._cargas_atrasadas", side_effect=_cargas_atrasadas)
+        listas = atrasadas.start()
+        self.addCleanup(atrasadas.stop)
+
+        with mock.patch("api.dashboard.DASHBOARD_CACHE_TTL", 0):
+            primeira = self._stats(ontem)
+            self.assertEqual(self._stats(ontem), primeira)
+            self.assertEqual(self.calculo.call_count, 1)
+            self.assertEqual(listas.call_count, 2)
+
+            self._stats(hoje)
+            self._stats(hoje)
+            self.assertEqual(self.calculo.call_count, 3)
+
+    def test_version_bump_from_another_worker_invalidates(self):
+        hoje = datetime.now(timezone.utc).date().isoformat()
+        self._stats(hoje)
+
+        # evento de escrita recebido pelo LISTEN (ou backend compartilhado incrementado)
+        cache_versionado.dados_alterados()
+        self._stats(hoje)
+        self.assertEqual(self.calculo.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask, jsonify, request
+
+from db import db
+from api import coalescencia
+
+
+class CoalescenciaTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.chamadas = 0
+
+        @self.app.get("/lento")
+        @coalescencia.compartilhar
+        def lento():
+            self.chamadas += 1
+            time.sleep(0.2)
+            return jsonify({"n": self.chamadas, "q": request.args.get("q")})
+
+        self.client = self.app.test_client()
+        coalescencia.invalidar()
+
+    def _em_paralelo(self, url, quantidade):
+        respostas = [None] * quantidade
+
+        def pedir(i):
+            respostas[i] = self.app.test_client().get(url).get_json()
+
+        threads = [threading.Thread(target=pedir, args=(i,)) for i in range(quantidade)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return respostas
+
+    def test_concurrent_identical_requests_share_one_computation(self):
+        respostas = self._em_paralelo("/lento?q=a", 8)
+        self.assertEqual(self.chamadas, 1)
+        self.assertEqual(respostas, [{"n": 1, "q": "a"}] * 8)
+
+        # outra query string é outra chave
+        self.assertEqual(self.client.get("/lento?q=b").get_json(), {"n": 2, "q": "b"})
+
+    def test_window_reuses_result_until_a_commit(self):
+        with mock.patch.object(coalescencia, "COALESCER_JANELA", 60):
+            self.client.get("/lento")
+            self.client.get("/lento")
+            self.assertEqual(self.chamadas, 1)
+
+            with self.app.app_context():
+                db.session.commit()
+
+            self.assertEqual(self.client.get("/lento").get_json()["n"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,279 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga, Transferencia
+from api import cache_versionado, coalescencia
+from api.dashboard import dashboard_bp
+
+
+def _dt(dia, hora=12):
+    return datetime(2026, 3, dia, hora, 0, tzinfo=timezone.utc)
+
+
+class DashboardStatsTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(dashboard_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        cargas = [
+            # (status, created_at, end_time, deleted_at, units, aa, tempo, uph)
+            ("closed", _dt(1), _dt(10), None, 100, "aa1", 3600, 100.0),
+            ("closed", _dt(1), _dt(10, 18), None, 50, "aa2", 1800, 100.0),
+            ("closed", _dt(1), _dt(11), None, 300, "aa1", 7200, 150.0),
+            ("closed", _dt(1), _dt(11), None, 20, None, None, None),
+            ("closed", _dt(1), _dt(20), None, 999, "aa1", 3600, 999.0),  # fora do intervalo
+            ("checkin", _dt(10), None, None, 10, "aa2", None, None),
+            ("arrival", _dt(10), None, None, 10, None, None, None),
+            ("arrival_scheduled", _dt(11), None, None, 10, None, None, None),
+            ("arrival", _dt(1), None, None, 10, None, None, None),  # criada fora do intervalo
+            ("deleted", _dt(1), None, _dt(11), 7, None, None, None),
+            ("deleted", _dt(1), None, _dt(11, 15), 7, None, None, None),
+            ("no_show", _dt(10), None, None, 40, None, None, None),
+            ("no_show", _dt(12), None, None, 60, None, None, None),
+        ]
+        for i, (status, criada, fim, deletada, units, aa, tempo, uph) in enumerate(cargas):
+            db.session.add(Carga(
+                appointment_id=f"D{i}",
+                expected_arrival_date=_dt(28),
+                priority_last_update=criada,
+                created_at=criada,
+                status=status,
+                end_time=fim,
+                deleted_at=deletada,
+                units=units,
+                aa_responsavel=aa,
+                tempo_total_segundos=tempo,
+                units_por_hora=uph,
+            ))
+        db.session.commit()
+
+        for alvo in ("api.auth.has_capability", "api.dashboard.has_capability"):
+            permissao = mock.patch(alvo, return_value=True)
+            permissao.start()
+            self.addCleanup(permissao.stop)
+        coalescencia.invalidar()
+        cache_versionado.limpar()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_aggregates_from_single_grouped_scan(self):
+        data = self.client.get("/dashboard/stats?dataInicio=2026-03-10&dataFim=2026-03-12").get_json()
+
+        self.assertEqual(
+            {k: v for k, v in data.items() if k.startswith("total_") and "atrasad" not in k and "late" not in k},
+            {
+                "total_units": 470,
+                "total_units_no_show": 100,
+                "total_notas_fechadas": 4,
+                "total_notas_pendentes": 2,
+                "total_notas_andamento": 1,
+                "total_notas_deletadas": 2,
+                "total_notas_no_show": 2,
+            },
+        )
+        self.assertEqual(data["unidades_por_dia"], {"2026-03-10": 150, "2026-03-11": 320})
+        self.assertEqual(data["notas_por_dia"], {"2026-03-10": 2, "2026-03-11": 2})
+        self.assertEqual(data["notas_deletadas_por_dia"], {"2026-03-11": 2})
+        self.assertEqual(data["no_show_por_dia"], {"2026-03-10": 1, "2026-03-12": 1})
+        self.assertEqual(data["por_login"], {
+            "aa1": {"units": 400, "notas": 2, "horas_produzidas": 3.0, "produtividade_media": 125.0},
+            "aa2": {"units": 50, "notas": 1, "horas_produzidas": 0.5, "produtividade_media": 100.0},
+        })
+        self.assertEqual(list(data["por_login"]), ["aa1", "aa2"])
+        self.assertEqual(data["produtividade_por_aa"], data["por_login"])
+
+    def test_empty_range(self):
+        data = self.client.get("/dashboard/stats?dataInicio=2025-01-01&dataFim=2025-01-02").get_json()
+        self.assertEqual(data["total_notas_fechadas"], 0)
+        self.assertEqual(data["unidades_por_dia"], {})
+        self.assertEqual(data["por_login"], {})
+
+
+class DashboardListasTests(unittest.TestCase):
+    def _uri(self):
+        return "sqlite://"
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = self._uri()
+        db.init_app(self.app)
+        self.app.register_blueprint(dashboard_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.now(timezone.utc)
+        horas = lambda h: agora - timedelta(hours=h)
+        cargas = [
+            # (appointment, status, expected, end_time, atraso_registrado, atraso_segundos)
+            ("ATRASADA", "arrival", horas(6), None, False, 0),
+            ("NO_PRAZO", "arrival", horas(1), None, False, 0),
+            ("HISTORICO", "checkin", horas(2), None, True, 900),
+            ("FECHADA_ATRASADA", "closed", horas(10), horas(5), True, 0),
+            ("FECHADA_NO_PRAZO", "closed", horas(10), horas(8), True, 300),
+            ("NO_SHOW", "no_show", horas(30), None, True, 500),
+            ("VIRA_NO_SHOW", "arrival_scheduled", horas(30), None, True, 500),
+            ("AGENDADA", "arrival_scheduled", horas(5), None, False, 0),
+            ("FORA", "arrival", horas(24 * 5), None, True, 500),
+        ]
+        for appt, status, expected, fim, registrado, segundos in cargas:
+            db.session.add(Carga(
+                appointment_id=appt,
+                expected_arrival_date=expected,
+                priority_last_update=expected,
+                status=status,
+                end_time=fim,
+                atraso_registrado=registrado,
+                atraso_segundos=segundos,
+            ))
+        for appt, horas_deletada in (("DEL1", 3), ("DEL2", 1)):
+            db.session.add(Carga(
+                appointment_id=appt,
+                expected_arrival_date=horas(24 * 5),
+                priority_last_update=horas(24 * 5),
+                status="deleted",
+                deleted_at=horas(horas_deletada),
+            ))
+
+        transferencias = [
+            # (appointment, expected, deadline, finalizada, prazo_estourado, segundos)
+            ("T_ABERTA", horas(3), horas(1), False, False, 0),
+            ("T_HISTORICO", horas(4), horas(2), True, True, 600),
+            ("T_NO_PRAZO", horas(2), agora + timedelta(hours=1), False, False, 0),
+            ("T_FINALIZADA", horas(5), horas(3), True, False, 0),
+            ("T_SEM_PRAZO", horas(5), None, False, True, 100),
+        ]
+        for appt, expected, deadline, finalizada, estourado, segundos in transferencias:
+            db.session.add(Transferencia(
+                appointment_id=appt,
+                expected_arrival_date=expected,
+                late_stow_deadline=deadline,
+                finalizada=finalizada,
+                prazo_estourado=estourado,
+                prazo_estourado_segundos=segundos,
+            ))
+        db.session.commit()
+
+        for alvo in ("api.auth.has_capability", "api.dashboard.has_capability"):
+            permissao = mock.patch(alvo, return_value=True)
+            permissao.start()
+            self.addCleanup(permissao.stop)
+        coalescencia.invalidar()
+        cache_versionado.limpar()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _stats(self):
+        hoje = datetime.now(timezone.utc).date()
+        params = {"dataInicio": (hoje - timedelta(days=3)).isoformat(), "dataFim": hoje.isoformat()}
+        return self.client.get("/dashboard/stats", query_string=params).get_json()
+
+    def test_delay_and_deleted_lists(self):
+        data = self._stats()
+
+        atrasadas = {c["appointment_id"]: c["tempo_atraso_segundos"] for c in data["cargas_atrasadas"]}
+        self.assertEqual(list(atrasadas), ["FECHADA_ATRASADA", "ATRASADA", "AGENDADA", "HISTORICO"])
+        self.assertEqual(data["total_cargas_atrasadas"], 4)
+        self.assertEqual(atrasadas["FECHADA_ATRASADA"], 3600)
+        self.assertAlmostEqual(atrasadas["ATRASADA"], 2 * 3600, delta=2)
+        self.assertAlmostEqual(atrasadas["AGENDADA"], 3600, delta=2)
+        self.assertEqual(atrasadas["HISTORICO"], 900)
+
+        late = {t["appointment_id"]: (t["status"], t["tempo_atraso_segundos"]) for t in data["transferencias_late_stow"]}
+        self.assertEqual(list(late), ["T_HISTORICO", "T_ABERTA"])
+        self.assertEqual(data["total_transferencias_late_stow"], 2)
+        self.assertEqual(late["T_HISTORICO"], ("finalizada", 600))
+        self.assertEqual(late["T_ABERTA"][0], "em_aberto")
+        self.assertAlmostEqual(late["T_ABERTA"][1], 3600, delta=2)
+
+        self.assertEqual([c["appointment_id"] for c in data["cargas_deletadas"]], ["DEL2", "DEL1"])
+
+    def test_lists_are_limited_but_totals_count_everything(self):
+        with mock.patch("api.dashboard.LIMITE_ATRASADAS", 2), mock.patch("api.dashboard.LIMITE_LATE_STOW", 1), \
+                mock.patch("api.dashboard.LIMITE_DELETADAS", 1):
+            data = self._stats()
+
+        self.assertEqual([c["appointment_id"] for c in data["cargas_atrasadas"]], ["FECHADA_ATRASADA", "ATRASADA"])
+        self.assertEqual(data["total_cargas_atrasadas"], 4)
+        self.assertEqual([t["appointment_id"] for t in data["transferencias_late_stow"]], ["T_HISTORICO"])
+        self.assertEqual(data["total_transferencias_late_stow"], 2)
+        self.assertEqual([c["appointment_id"] for c in data["cargas_deletadas"]], ["DEL2"])
+
+
+class DashboardParaleloTests(DashboardListasTests):
+    """Mesmos cenários com SQLite em arquivo: pool com uma conexão por grupo."""
+
+    def _uri(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        return "sqlite:///" + os.path.join(pasta, "dashboard.db")
+
+    def test_groups_run_on_pool_threads_with_same_payload(self):
+        from api import dashboard
+
+        threads = set()
+        originais = {nome: getattr(dashboard, nome) for nome in ("_agregados_cargas", "_cargas_atrasadas")}
+
+        def _registrando(nome):
+            def fn(*args):
+                threads.add(threading.current_thread().name)
+                return originais[nome](*args)
+            return fn
+
+        with mock.patch.multiple(dashboard, **{nome: _registrando(nome) for nome in originais}):
+            paralelo = self._stats()
+        self.assertTrue(threads)
+        self.assertTrue(all(nome.startswith("dashboard-consulta") for nome in threads))
+
+        coalescencia.invalidar()
+        cache_versionado.limpar()
+        with mock.patch("api.dashboard.DASHBOARD_PARALELO", False):
+            sequencial = self._stats()
+        for dados in (paralelo, sequencial):
+            for c in dados["cargas_atrasadas"] + dados["transferencias_late_stow"]:
+                c.pop("tempo_atraso_segundos")
+        self.assertEqual(paralelo, sequencial)
+
+    def test_deadline_returns_503_and_is_not_cached(self):
+        from api import dashboard
+
+        original = dashboard._transferencias_late_stow
+
+        def _lenta(*args):
+            time.sleep(0.5)
+            return original(*args)
+
+        hoje = datetime.now(timezone.utc).date().isoformat()
+        with mock.patch("api.dashboard.DASHBOARD_PRAZO", 0.1), mock.patch("api.dashboard._transferencias_late_stow", _lenta):
+            resposta = self.client.get("/dashboard/stats", query_string={"dataInicio": hoje, "dataFim": hoje})
+        self.assertEqual(resposta.status_code, 503)
+
+        coalescencia.invalidar()
+        resposta = self.client.get("/dashboard/stats", query_string={"dataInicio": hoje, "dataFim": hoje})
+        self.assertEqual(resposta.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import queue
+import threading
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga
+from api import eventos_cargas
+from api.painel import painel_bp
+
+
+class EventosCargasTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.fila = eventos_cargas.assinar()
+
+    def tearDown(self):
+        eventos_cargas.cancelar(self.fila)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _nova_carga(self):
+        agora = datetime.now(timezone.utc)
+        carga = Carga(appointment_id="A1", expected_arrival_date=agora, priority_last_update=agora, status="arrival")
+        db.session.add(carga)
+        db.session.flush()
+        return carga
+
+    def test_event_is_delivered_only_after_commit(self):
+        carga = self._nova_carga()
+        eventos_cargas.publicar("checkin", id=carga.id)
+        self.assertTrue(self.fila.empty())
+
+        db.session.commit()
+        self.assertEqual(json.loads(self.fila.get_nowait()), {"tipo": "checkin", "id": carga.id})
+
+    def test_rollback_discards_pending_events(self):
+        carga = self._nova_carga()
+        eventos_cargas.publicar("checkin", id=carga.id)
+        db.session.rollback()
+
+        db.session.commit()
+        with self.assertRaises(queue.Empty):
+            self.fila.get_nowait()
+
+    def test_stream_sends_published_event(self):
+        resposta = self.app.test_client().get("/pc/stream")
+        self.assertEqual(resposta.mimetype, "text/event-stream")
+
+        corpo = iter(resposta.response)
+        self.assertIn("retry:", next(corpo).decode())
+
+        eventos_cargas.publicar("upload", inseridas=3, atualizadas=0)
+        db.session.commit()
+        evento = next(corpo).decode()
+        resposta.close()
+
+        self.assertTrue(evento.startswith("event: carga\ndata: "))
+        self.assertEqual(json.loads(evento.split("data: ", 1)[1])["inseridas"], 3)
+
+    def test_stream_over_the_limit_answers_503_until_a_slot_frees(self):
+        client = self.app.test_client()
+        with mock.patch("api.painel._vagas_stream", threading.BoundedSemaphore(1)):
+            aberta = client.get("/pc/stream")
+            self.assertEqual(aberta.status_code, 200)
+
+            recusada = client.get("/pc/stream")
+            self.assertEqual(recusada.status_code, 503)
+            self.assertIn("Retry-After", recusada.headers)
+
+            aberta.close()
+            segunda = client.get("/pc/stream")
+            self.assertEqual(segunda.status_code, 200)
+            segunda.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+import gzip
+import json
+import unittest
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga
+from api.painel import _ler_painel, _serializar_linhas, painel_bp
+
+
+class PainelListarIncrementalTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        antigo = datetime.now(timezone.utc) - timedelta(days=30)
+        for appt in ("A1", "A2"):
+            db.session.add(Carga(
+                appointment_id=appt,
+                expected_arrival_date=antigo,
+                priority_last_update=antigo,
+                status="closed",
+                updated_at=antigo,
+            ))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_without_since_keeps_legacy_list(self):
+        data = self.client.get("/pc/listar").get_json()
+        self.assertEqual(sorted(c["appointment_id"] for c in data), ["A1", "A2"])
+
+    def test_since_returns_only_rows_changed_after_cursor(self):
+        with mock.patch("api.painel.PC_CURSOR_MARGEM", timedelta(0)):
+            snapshot = self.client.get("/pc/listar?since=").get_json()
+            self.assertTrue(snapshot["completo"])
+            self.assertEqual(len(snapshot["cargas"]), 2)
+
+            vazio = self.client.get("/pc/listar", query_string={"since": snapshot["cursor"]}).get_json()
+            self.assertFalse(vazio["completo"])
+            self.assertEqual(vazio["cargas"], [])
+
+            Carga.query.filter_by(appointment_id="A2").one().units = 50
+            db.session.commit()
+
+            delta = self.client.get("/pc/listar", query_string={"since": vazio["cursor"]}).get_json()
+            self.assertEqual([(c["appointment_id"], c["units"]) for c in delta["cargas"]], [("A2", 50)])
+
+    def test_if_none_match_returns_304_until_a_write(self):
+        primeira = self.client.get("/pc/listar?since=")
+        etag = primeira.headers["ETag"]
+
+        repetida = self.client.get("/pc/listar?since=", headers={"If-None-Match": etag})
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida.data, b"")
+
+        Carga.query.filter_by(appointment_id="A1").one().units = 7
+        db.session.commit()
+
+        depois = self.client.get("/pc/listar?since=", headers={"If-None-Match": etag})
+        self.assertEqual(depois.status_code, 200)
+        self.assertNotEqual(depois.headers["ETag"], etag)
+
+    def test_invalid_cursor_falls_back_to_full_snapshot(self):
+        data = self.client.get("/pc/listar?since=ontem").get_json()
+        self.assertTrue(data["completo"])
+        self.assertEqual(len(data["cargas"]), 2)
+
+
+class PainelListarFiltrosTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.now(timezone.utc)
+        self.base = datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc)
+        for i, (status, end_time) in enumerate([
+            ("arrival", None),
+            ("checkin", None),
+            ("arrival_scheduled", None),
+            ("closed", agora - timedelta(hours=2)),
+            ("closed", agora - timedelta(days=3)),
+            ("no_show", None),
+        ]):
+            db.session.add(Carga(
+                appointment_id=f"92{i}",
+                expected_arrival_date=self.base + timedelta(hours=i),
+                priority_last_update=agora,
+                status=status,
+                end_time=end_time,
+                aa_responsavel="aa1" if status == "checkin" else None,
+            ))
+        db.session.add(Carga(
+            appointment_id="X1",
+            expected_arrival_date=self.base - timedelta(days=5),
+            priority_last_update=agora,
+            status="arrival",
+        ))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _ids(self, query_string):
+        data = self.client.get("/pc/listar", query_string={"since": "", **query_string}).get_json()
+        return [c["appointment_id"] for c in data["cargas"]]
+
+    def test_hot_set_keeps_open_and_recently_closed(self):
+        self.assertEqual(self._ids({"ativas": "1"}), ["X1", "920", "921", "922", "923"])
+
+    def test_status_aa_appointment_and_window_filters(self):
+        self.assertEqual(self._ids({"status": "closed,no_show"}), ["923", "924", "925"])
+        self.assertEqual(self._ids({"aa": "aa1"}), ["921"])
+        self.assertEqual(self._ids({"appointment": "X"}), ["X1"])
+        self.assertEqual(self._ids({"de": "2026-03-10", "ate": "2026-03-10", "status": "arrival"}), ["920"])
+
+    def test_delta_applies_the_same_filters_and_reports_rows_that_left(self):
+        with mock.patch("api.painel.PC_CURSOR_MARGEM", timedelta(0)):
+            snapshot = self.client.get("/pc/listar", query_string={"since": "", "ativas": "1"}).get_json()
+
+            saiu = Carga.query.filter_by(appointment_id="920").one()
+            saiu.status = "closed"
+            saiu.end_time = datetime.now(timezone.utc) - timedelta(days=3)
+            Carga.query.filter_by(appointment_id="922").one().units = 5
+            Carga.query.filter_by(appointment_id="925").one().units = 9  # no_show: nunca esteve no conjunto
+            db.session.commit()
+
+            delta = self.client.get("/pc/listar", query_string={"since": snapshot["cursor"], "ativas": "1"}).get_json()
+
+        self.assertFalse(delta["completo"])
+        self.assertEqual([(c["appointment_id"], c["units"]) for c in delta["cargas"]], [("922", 5)])
+        ids = {c.appointment_id: c.id for c in Carga.query.all()}
+        self.assertEqual(delta["removidas"], sorted([ids["920"], ids["925"]]))
+
+    def test_lean_rows_keep_response_format(self):
+        agora = datetime(2026, 3, 10, 15, 0, tzinfo=timezone.utc)
+        carga = Carga.query.filter_by(appointment_id="921").one()
+        carga.start_time = datetime(2026, 3, 10, 14, 0)  # naive do SQLite = UTC
+        carga.atraso_comentario = "pneu"
+        db.session.commit()
+
+        linhas = _ler_painel(Carga.query.filter(Carga.appointment_id == "921"))
+        self.assertEqual(_serializar_linhas(linhas, agora), [{
+            "id": carga.id,
+            "appointment_id": "921",
+            "truck_type": None,
+            "truck_tipo": None,
+            "expected_arrival_date": "2026-03-10T13:00:00+00:00",
+            "status": "checkin",
+            "units": 0,
+            "cartons": 0,
+            "aa_responsavel": "aa1",
+            "start_time": "2026-03-10T14:00:00+00:00",
+            "tempo_total_segundos": None,
+            "tempo_sla_segundos": 2 * 3600,
+            "atraso_segundos": 0,
+            "atraso_registrado": False,
+            "atraso_comentario": "pneu",
+            "priority_score": 0.0,
+        }])
+
+    def test_open_rows_report_current_atraso_not_the_stored_marker(self):
+        agora = datetime(2026, 3, 10, 19, 0, tzinfo=timezone.utc)
+        carga = Carga.query.filter_by(appointment_id="921").one()
+        carga.atraso_registrado = True
+        carga.atraso_segundos = 600  # gravado pela varredura quando estourou
+        db.session.commit()
+
+        linha = _serializar_linhas(_ler_painel(Carga.query.filter(Carga.appointment_id == "921")), agora)[0]
+        self.assertEqual(linha["tempo_sla_segundos"], -2 * 3600)
+        self.assertEqual((linha["atraso_segundos"], linha["atraso_registrado"]), (2 * 3600, True))
+
+    def test_keyset_pages_cover_everything_once(self):
+        vistos = []
+        params = {"since": "", "limite": "3"}
+        while True:
+            data = self.client.get("/pc/listar", query_string=params).get_json()
+            vistos += [c["appointment_id"] for c in data["cargas"]]
+            if not data["proxima"]:
+                break
+            params["apos"] = data["proxima"]
+
+        self.assertEqual(vistos, ["X1", "920", "921", "922", "923", "924", "925"])
+
+    def test_columnar_format_matches_object_rows(self):
+        objetos = self.client.get("/pc/listar?since=&limite=3").get_json()
+        colunar = self.client.get("/pc/listar?since=&limite=3&format=columnar").get_json()
+
+        self.assertEqual(colunar["proxima"], objetos["proxima"])
+        tabela = colunar["cargas"]
+        self.assertEqual(tabela["tempo"], ["expected_arrival_date", "start_time"])
+        linhas = [dict(zip(tabela["colunas"], valores)) for valores in tabela["linhas"]]
+        self.assertEqual(len(linhas), 3)
+        for linha, objeto in zip(linhas, objetos["cargas"]):
+            esperado = int(datetime.fromisoformat(objeto["expected_arrival_date"]).timestamp())
+            self.assertEqual(linha.pop("expected_arrival_date"), esperado)
+            objeto.pop("expected_arrival_date")
+            self.assertEqual(linha, objeto)
+
+        legado = self.client.get("/pc/listar?format=columnar").get_json()
+        self.assertEqual(len(legado["linhas"]), 7)
+
+    def test_gzip_when_accepted(self):
+        with mock.patch("api.compacto.GZIP_MIN_BYTES", 0):
+            simples = self.client.get("/pc/listar?since=")
+            comprimida = self.client.get("/pc/listar?since=", headers={"Accept-Encoding": "gzip, deflate"})
+
+        self.assertNotIn("Content-Encoding", simples.headers)
+        self.assertEqual(comprimida.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", comprimida.headers["Vary"])
+        self.assertEqual(json.loads(gzip.decompress(comprimida.data))["cargas"], simples.get_json()["cargas"])
+
+        # mesma versão com e sem gzip (ETag fraca)
+        self.assertEqual(comprimida.headers["ETag"], simples.headers["ETag"])
+        repetida = self.client.get(
+            "/pc/listar?since=",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": comprimida.headers["ETag"]},
+        )
+        self.assertEqual(repetida.status_code, 304)
+
+    def test_invalid_filter_is_rejected(self):
+        resposta = self.client.get("/pc/listar?since=&de=ontem")
+        self.assertEqual(resposta.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga
+from api.painel import painel_bp
+
+
+class PainelTransicoesTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        permissao = mock.patch("api.auth.has_capability", return_value=True)
+        permissao.start()
+        self.addCleanup(permissao.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _carga(self, status, **campos):
+        agora = datetime.now(timezone.utc)
+        carga = Carga(
+            appointment_id=campos.pop("appointment_id", f"A-{status}"),
+            expected_arrival_date=campos.pop("expected", agora),
+            priority_last_update=agora,
+            status=status,
+            **campos,
+        )
+        db.session.add(carga)
+        db.session.commit()
+        return carga.id
+
+    def _recarregar(self, carga_id):
+        db.session.expire_all()
+        return db.session.get(Carga, carga_id)
+
+    def test_second_checkin_is_rejected_with_409(self):
+        carga_id = self._carga("arrival")
+
+        primeira = self.client.post(f"/pc/checkin/{carga_id}", json={"aa_responsavel": "aa1"})
+        segunda = self.client.post(f"/pc/checkin/{carga_id}", json={"aa_responsavel": "aa2"})
+
+        self.assertEqual(primeira.status_code, 200)
+        self.assertEqual(segunda.status_code, 409)
+        self.assertEqual(segunda.get_json()["status"], "checkin")
+        self.assertEqual(self._recarregar(carga_id).aa_responsavel, "aa1")
+
+    def test_finalizar_computes_totals_and_atraso_in_sql(self):
+        agora = datetime.now(timezone.utc)
+        carga_id = self._carga(
+            "checkin",
+            expected=agora - timedelta(hours=6),
+            start_time=agora - timedelta(hours=2),
+            units=500,
+        )
+
+        resposta = self.client.post(f"/pc/finalizar/{carga_id}")
+        self.assertEqual(resposta.status_code, 200)
+
+        carga = self._recarregar(carga_id)
+        self.assertEqual(carga.status, "closed")
+        self.assertAlmostEqual(carga.tempo_total_segundos, 7200, delta=2)
+        self.assertAlmostEqual(carga.units_por_hora, 250.0, delta=0.1)
+        self.assertTrue(carga.atraso_registrado)
+        self.assertAlmostEqual(carga.atraso_segundos, 7200, delta=2)
+
+        self.assertEqual(self.client.post(f"/pc/finalizar/{carga_id}").status_code, 409)
+
+    def test_missing_carga_is_404_and_wrong_status_is_409(self):
+        self.assertEqual(self.client.post("/pc/deletar/999", json={"motivo": "x"}).status_code, 404)
+
+        carga_id = self._carga("closed")
+        self.assertEqual(self.client.post(f"/pc/carga-chegou/{carga_id}").status_code, 409)
+        self.assertEqual(self.client.post(f"/pc/deletar/{carga_id}", json={"motivo": "x"}).status_code, 409)
+        self.assertEqual(self._recarregar(carga_id).status, "closed")
+
+    def test_bulk_runs_grouped_updates_and_reports_per_item(self):
+        agora = datetime.now(timezone.utc)
+        ids_checkin = [
+            self._carga("checkin", appointment_id=f"C{i}", start_time=agora - timedelta(hours=1), units=100)
+            for i in range(3)
+        ]
+        agendada = self._carga("arrival_scheduled")
+        fechada = self._carga("closed")
+
+        with mock.patch("api.painel.has_capability", return_value=True):
+            resposta = self.client.post("/pc/bulk", json={"acoes": [
+                *({"id": i, "action": "finalizar"} for i in ids_checkin),
+                {"id": agendada, "action": "deletar", "payload": {"motivo": "duplicada"}},
+                {"id": fechada, "action": "deletar", "payload": {"motivo": "duplicada"}},
+                {"id": 999, "action": "carga_chegou"},
+                {"id": agendada, "action": "carga_chegou"},
+                {"id": ids_checkin[0], "action": "voar"},
+            ]})
+
+        data = resposta.get_json()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([r["codigo"] for r in data["resultados"]], [200, 200, 200, 200, 409, 404, 400, 400])
+        self.assertEqual((data["ok"], data["falhas"]), (4, 4))
+
+        self.assertEqual({self._recarregar(i).status for i in ids_checkin}, {"closed"})
+        self.assertEqual(self._recarregar(agendada).delete_reason, "duplicada")
+        self.assertEqual(self._recarregar(fechada).status, "closed")
+
+    def test_bulk_checks_capability_per_action(self):
+        carga_id = self._carga("checkin", start_time=datetime.now(timezone.utc))
+
+        with mock.patch("api.painel.has_capability", side_effect=lambda cap: cap != "painel_finalize"):
+            data = self.client.post("/pc/bulk", json=[{"id": carga_id, "action": "finalizar"}]).get_json()
+
+        self.assertEqual(data["resultados"][0]["codigo"], 403)
+        self.assertEqual(self._recarregar(carga_id).status, "checkin")
+
+
+if __name__ == "__main__":
+    unittest.main()
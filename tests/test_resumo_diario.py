@@ -0,0 +1,110 @@
+import unittest
+from datetime import datetime, time, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga, ResumoDiarioCarga, ResumoDiarioDia
+from api import cache_versionado, coalescencia, resumo_diario, sla_varredura
+from api.dashboard import dashboard_bp
+from api.painel import painel_bp
+
+
+class ResumoDiarioTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(dashboard_bp)
+        self.app.register_blueprint(painel_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.hoje = datetime.now(timezone.utc).date()
+        self.dias = [self.hoje - timedelta(days=n) for n in (3, 2, 1)]
+
+        for i, (status, dia, aa) in enumerate([
+            ("closed", self.dias[0], "aa1"),
+            ("closed", self.dias[1], "aa1"),
+            ("closed", self.dias[1], "aa2"),
+            ("arrival", self.dias[1], None),
+            ("no_show", self.dias[2], None),
+            ("closed", self.hoje, "aa2"),
+        ]):
+            meio_dia = datetime.combine(dia, time(12), tzinfo=timezone.utc)
+            db.session.add(Carga(
+                appointment_id=f"R{i}",
+                expected_arrival_date=meio_dia,
+                priority_last_update=meio_dia,
+                created_at=meio_dia,
+                status=status,
+                end_time=meio_dia if status == "closed" else None,
+                start_time=meio_dia - timedelta(hours=1) if status == "closed" else None,
+                units=10 * (i + 1),
+                aa_responsavel=aa,
+                tempo_total_segundos=3600 if status == "closed" else None,
+                units_por_hora=10.0 * (i + 1) if status == "closed" else None,
+            ))
+        db.session.commit()
+
+        for alvo in ("api.auth.has_capability", "api.dashboard.has_capability"):
+            permissao = mock.patch(alvo, return_value=True)
+            permissao.start()
+            self.addCleanup(permissao.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _stats(self):
+        coalescencia.invalidar()
+        cache_versionado.limpar()
+        params = {"dataInicio": self.dias[0].isoformat(), "dataFim": self.hoje.isoformat()}
+        data = self.client.get("/dashboard/stats", query_string=params).get_json()
+        for chave in ("cargas_atrasadas", "cargas_deletadas", "transferencias_late_stow", "total_cargas_atrasadas"):
+            data.pop(chave)
+        return data
+
+    def _consolidados(self):
+        return {d.dia for d in ResumoDiarioDia.query.filter_by(consolidado=True)}
+
+    def test_consolidated_days_give_same_payload_as_live(self):
+        ao_vivo = self._stats()
+
+        self.assertEqual(resumo_diario.consolidar(self.dias + [self.hoje]), 3)
+        self.assertEqual(self._consolidados(), set(self.dias))
+        self.assertEqual(self._stats(), ao_vivo)
+
+        # dias consolidados saem do rollup (hoje continua ao vivo)
+        db.session.execute(ResumoDiarioCarga.__table__.update().values(units=0))
+        db.session.commit()
+        parcial = self._stats()
+        self.assertEqual(parcial["total_units"], 60)
+        self.assertEqual(ao_vivo["total_units"], 10 + 20 + 30 + 60)
+
+    def test_transition_invalidates_the_day_it_leaves(self):
+        resumo_diario.consolidar(self.dias)
+        carga = Carga.query.filter_by(appointment_id="R3").one()
+
+        resposta = self.client.post(f"/pc/checkin/{carga.id}", json={"aa_responsavel": "aa3"})
+        self.assertEqual(resposta.status_code, 200)
+
+        self.assertEqual(self._consolidados(), {self.dias[0], self.dias[2]})
+        data = self._stats()
+        self.assertEqual((data["total_notas_pendentes"], data["total_notas_andamento"]), (0, 1))
+
+    def test_sweeper_consolidates_pending_days(self):
+        resumo_diario.consolidar([self.dias[0]])
+        resultado = sla_varredura.varrer()
+
+        self.assertEqual(resultado["resumo_dias"], 2)
+        self.assertEqual(self._consolidados(), set(self.dias))
+        self.assertEqual(sla_varredura.varrer()["resumo_dias"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime, timezone, timedelta
+
+from flask import Flask
+
+from db import db
+from models import Carga, Transferencia
+from api import sla_varredura
+
+
+class SlaVarreduraTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.agora = datetime(2026, 3, 10, 15, 0, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _carga(self, appt, status, expected, **extra):
+        c = Carga(
+            appointment_id=appt,
+            status=status,
+            expected_arrival_date=expected,
+            priority_last_update=expected,
+            **extra,
+        )
+        db.session.add(c)
+        return c
+
+    def _recarregar(self, appt):
+        db.session.expire_all()
+        return Carga.query.filter_by(appointment_id=appt).one()
+
+    def test_no_show_and_persistent_atraso(self):
+        self._carga("NS", "arrival_scheduled", self.agora - timedelta(hours=25))
+        self._carga("LATE", "arrival", self.agora - timedelta(hours=5))
+        self._carga("OK", "arrival", self.agora - timedelta(hours=3))
+        db.session.commit()
+
+        resultado = sla_varredura.varrer(self.agora)
+
+        self.assertEqual(resultado["no_show"], 1)
+        self.assertEqual(self._recarregar("NS").status, "no_show")
+        late = self._recarregar("LATE")
+        self.assertTrue(late.atraso_registrado)
+        self.assertEqual(late.atraso_segundos, 3600)
+        self.assertFalse(self._recarregar("OK").atraso_registrado)
+
+        # atraso em aberto é marcado uma vez; o valor corrente é calculado pelo painel
+        self.assertEqual(sla_varredura.varrer(self.agora + timedelta(minutes=10))["atraso_ativo"], 0)
+        self.assertEqual(self._recarregar("LATE").atraso_segundos, 3600)
+
+    def test_closed_atraso_is_recalculated_from_end_time(self):
+        expected = self.agora - timedelta(hours=6)
+        self._carga("C1", "closed", expected, end_time=expected + timedelta(hours=4, minutes=10), atraso_segundos=99999, atraso_registrado=True)
+        self._carga("C2", "closed", expected, end_time=expected + timedelta(hours=2), atraso_segundos=50, atraso_registrado=True)
+        self._carga("C3", "closed", expected, atraso_segundos=1200, atraso_registrado=True)
+        db.session.commit()
+
+        sla_varredura.varrer(self.agora)
+
+        self.assertEqual((self._recarregar("C1").atraso_segundos, self._recarregar("C1").atraso_registrado), (600, True))
+        self.assertEqual((self._recarregar("C2").atraso_segundos, self._recarregar("C2").atraso_registrado), (0, False))
+        self.assertEqual((self._recarregar("C3").atraso_segundos, self._recarregar("C3").atraso_registrado), (0, False))
+        self.assertEqual(sla_varredura.varrer(self.agora)["atraso_fechadas"], 0)
+
+    def test_transferencias_do_dia_are_synced_and_late_stow_marked(self):
+        self._carga("T1", "arrival", self.agora - timedelta(hours=1), truck_type="TRANSSHIP", truck_tipo="Transferência", units=10)
+        self._carga("V1", "arrival", self.agora - timedelta(hours=1), truck_type="OTHER", truck_tipo="VDD")
+        db.session.commit()
+
+        sla_varredura.varrer(self.agora)
+        t = Transferencia.query.one()
+        self.assertEqual((t.appointment_id, t.units, t.prazo_estourado), ("T1", 10, False))
+
+        self._recarregar("T1").units = 20
+        Transferencia.query.one().late_stow_deadline = self.agora - timedelta(minutes=30)
+        db.session.commit()
+
+        sla_varredura.varrer(self.agora)
+        db.session.expire_all()
+        t = Transferencia.query.one()
+        self.assertEqual((t.units, t.prazo_estourado, t.prazo_estourado_segundos), (20, True, 1800))
+
+
+if __name__ == "__main__":
+    unittest.main()
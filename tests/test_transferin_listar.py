@@ -0,0 +1,93 @@
+import unittest
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Transferencia
+from api.transferin import transferin_bp
+
+
+class TransferinListarCondicionalTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(transferin_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        agora = datetime.now(timezone.utc)
+        db.session.add(Transferencia(
+            appointment_id="T1",
+            expected_arrival_date=agora,
+            late_stow_deadline=agora + timedelta(hours=4),
+            created_at=agora,
+        ))
+        db.session.commit()
+
+        permissao = mock.patch("api.auth.has_capability", return_value=True)
+        permissao.start()
+        self.addCleanup(permissao.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_etag_changes_only_when_a_row_is_written(self):
+        primeira = self.client.get("/transferin/listar")
+        etag = primeira.headers["ETag"]
+        self.assertEqual(len(primeira.get_json()), 1)
+
+        self.assertEqual(self.client.get("/transferin/listar", headers={"If-None-Match": etag}).status_code, 304)
+
+        # mesma versão, outros filtros: outra URL, outra ETag
+        filtrada = self.client.get("/transferin/listar?origem=GIG1", headers={"If-None-Match": etag})
+        self.assertEqual(filtrada.status_code, 200)
+
+        Transferencia.query.one().vrid = "V1"
+        db.session.commit()
+
+        depois = self.client.get("/transferin/listar", headers={"If-None-Match": etag})
+        self.assertEqual(depois.status_code, 200)
+        self.assertEqual(depois.get_json()[0]["vrid"], "V1")
+
+    def test_etag_changes_when_a_deadline_passes_without_writes(self):
+        deadline = Transferencia.query.one().late_stow_deadline.replace(tzinfo=timezone.utc)
+
+        class Relogio(datetime):
+            agora = deadline - timedelta(minutes=1)
+
+            @classmethod
+            def now(cls, tz=None):
+                return cls.agora
+
+        with mock.patch("api.transferin.datetime", Relogio):
+            antes = self.client.get("/transferin/listar")
+            self.assertFalse(antes.get_json()[0]["prazo_estourado"])
+
+            # (o SQLite devolve naive e a rota lê naive como horário local: folga de sobra)
+            Relogio.agora = deadline + timedelta(hours=4)
+            depois = self.client.get("/transferin/listar", headers={"If-None-Match": antes.headers["ETag"]})
+
+        self.assertEqual(depois.status_code, 200)
+        self.assertTrue(depois.get_json()[0]["prazo_estourado"])
+
+    def test_columnar_format(self):
+        objeto = self.client.get("/transferin/listar").get_json()[0]
+        tabela = self.client.get("/transferin/listar?format=columnar").get_json()
+
+        self.assertEqual(tabela["tempo"], ["expected_arrival_date", "late_stow_deadline", "finished_at"])
+        linha = dict(zip(tabela["colunas"], tabela["linhas"][0]))
+        self.assertEqual(set(linha), set(objeto))
+        self.assertEqual(linha["late_stow_deadline"], int(datetime.fromisoformat(objeto["late_stow_deadline"]).timestamp()))
+        self.assertIsNone(linha["finished_at"])
+        self.assertEqual(linha["appointment_id"], "T1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import io
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from db import db
+from models import Carga
+from api.upload import _fingerprints_existentes, _upsert_cargas, _ler_planilha, _ingerir, _ingerir_arquivos, _novo_resumo, _preview_arquivos
+
+EXPORT_CSV = Path(__file__).resolve().parents[1] / "export (1).csv"
+
+
+def _registro(appointment_id, status="arrival", units=10):
+    return {
+        "appointment_id": appointment_id,
+        "expected_arrival_date": datetime(2026, 3, 1, 11, 0, tzinfo=timezone.utc),
+        "priority_last_update": datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc),
+        "priority_score": 1.0,
+        "prioridade_maxima": True,
+        "status": status,
+        "cartons": 1,
+        "units": units,
+        "truck_type": "OTHER",
+        "truck_tipo": "VDD",
+        "upload_fingerprint": f"{appointment_id}-{status}-{units}",
+    }
+
+
+class UploadBulkUpsertTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.agora = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_insert_then_update_by_appointment(self):
+        _upsert_cargas([_registro("A1"), _registro("A2")], self.agora)
+        db.session.commit()
+        self.assertEqual(set(_fingerprints_existentes(["A1", "A2", "A3"])), {"A1", "A2"})
+
+        _upsert_cargas([_registro("A1", units=99)], self.agora)
+        db.session.commit()
+
+        self.assertEqual(Carga.query.count(), 2)
+        self.assertEqual(Carga.query.filter_by(appointment_id="A1").one().units, 99)
+
+    def test_checkin_and_closed_status_are_not_overwritten(self):
+        _upsert_cargas([_registro("A1"), _registro("A2"), _registro("A3")], self.agora)
+        db.session.commit()
+        Carga.query.filter_by(appointment_id="A1").one().status = "checkin"
+        Carga.query.filter_by(appointment_id="A2").one().status = "closed"
+        db.session.commit()
+
+        _upsert_cargas(
+            [_registro("A1", "arrival_scheduled"), _registro("A2", "arrival_scheduled"), _registro("A3", "arrival_scheduled")],
+            self.agora,
+        )
+        db.session.commit()
+        db.session.expire_all()
+
+        status = {c.appointment_id: c.status for c in Carga.query.all()}
+        self.assertEqual(status, {"A1": "checkin", "A2": "closed", "A3": "arrival_scheduled"})
+
+
+    def test_csv_export_is_ingested_in_chunks(self):
+        linhas = EXPORT_CSV.read_bytes().splitlines(keepends=True)
+        # repete algumas linhas no fim para cair em outro lote
+        conteudo = b"".join(linhas + linhas[43:45])
+        file = FileStorage(stream=io.BytesIO(conteudo), filename="export.csv")
+
+        with mock.patch("api.upload.UPLOAD_CHUNK_ROWS", 7):
+            lotes = _ler_planilha(file)
+            resumo = _ingerir(lotes, datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc), _novo_resumo())
+
+        self.assertEqual(resumo["linhas"], len(linhas) - 1 + 2)
+        self.assertEqual(resumo["repetidas_no_arquivo"], 2)
+        self.assertEqual(resumo["inseridas"], Carga.query.count())
+        # as cópias caem no mesmo lote que as originais: a última vence, nada é "atualizado"
+        self.assertEqual(resumo["atualizadas"], 0)
+        self.assertEqual(resumo["repetidas"], 1)
+        self.assertEqual(Carga.query.filter_by(appointment_id="91585056969").one().units, 706)
+
+    def test_reupload_of_same_file_skips_unchanged_rows(self):
+        agora = datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc)
+        conteudo = EXPORT_CSV.read_bytes()
+
+        primeiro = _ingerir(_ler_planilha(FileStorage(io.BytesIO(conteudo), filename="e.csv")), agora, _novo_resumo())
+        segundo = _ingerir(_ler_planilha(FileStorage(io.BytesIO(conteudo), filename="e.csv")), agora, _novo_resumo())
+
+        self.assertGreater(primeiro["inseridas"], 0)
+        self.assertEqual(segundo["inseridas"], 0)
+        self.assertEqual(segundo["atualizadas"], 0)
+        self.assertEqual(segundo["inalteradas"], primeiro["inseridas"])
+
+        alterado = conteudo.replace(b'"706","706"', b'"706","707"')
+        terceiro = _ingerir(_ler_planilha(FileStorage(io.BytesIO(alterado), filename="e.csv")), agora, _novo_resumo())
+        self.assertEqual(terceiro["atualizadas"], 1)
+        self.assertEqual(Carga.query.filter_by(appointment_id="91585056969").one().units, 707)
+
+    def test_reupload_with_duplicated_appointment_reports_no_updates(self):
+        agora = datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc)
+        linhas = EXPORT_CSV.read_bytes().splitlines(keepends=True)
+        conteudo = b"".join(linhas + linhas[43:45])
+
+        def _enviar():
+            file = FileStorage(io.BytesIO(conteudo), filename="e.csv")
+            return _ingerir(_ler_planilha(file), agora, _novo_resumo())
+
+        primeiro = _enviar()
+        segundo = _enviar()
+        previsto = _preview_arquivos([FileStorage(io.BytesIO(conteudo), filename="e.csv")], agora)
+
+        self.assertEqual(primeiro["atualizadas"], 0)
+        for resumo in (segundo, previsto):
+            self.assertEqual(resumo["inseridas"], 0)
+            self.assertEqual(resumo["atualizadas"], 0)
+            self.assertEqual(resumo["inalteradas"], primeiro["inseridas"])
+            self.assertEqual(resumo["repetidas"], 1)
+            self.assertEqual(resumo["repetidas_no_arquivo"], 2)
+
+    def test_rows_rejected_by_database_do_not_discard_the_batch(self):
+        agora = datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc)
+        # sem Priority Score Last Updated Date: priority_last_update é NOT NULL em cargas
+        conteudo = EXPORT_CSV.read_bytes().replace(b'"0.25","2026/02/05 09:47 BRT"', b'"0.25",""')
+        total = len(EXPORT_CSV.read_bytes().splitlines()) - 1
+
+        with mock.patch("api.upload.UPLOAD_CHUNK_ROWS", 20):
+            resumo = _ingerir(_ler_planilha(FileStorage(io.BytesIO(conteudo), filename="e.csv")), agora, _novo_resumo())
+
+        self.assertEqual(resumo["inseridas"], Carga.query.count())
+        self.assertEqual(resumo["inseridas"] + resumo["ignoradas"], total)
+        self.assertIsNone(Carga.query.filter_by(appointment_id="91585056969").one_or_none())
+        self.assertEqual(len(resumo["erros"]), 1)
+        self.assertTrue(resumo["erros"][0].startswith("Linha 44: não gravada no banco"))
+
+    def test_preview_reports_diff_without_writing(self):
+        agora = datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc)
+        conteudo = EXPORT_CSV.read_bytes()
+
+        previsto = _preview_arquivos([FileStorage(io.BytesIO(conteudo), filename="e.csv")], agora)
+        self.assertEqual(Carga.query.count(), 0)
+
+        gravado = _ingerir(_ler_planilha(FileStorage(io.BytesIO(conteudo), filename="e.csv")), agora, _novo_resumo())
+        for k in ("linhas", "inseridas", "atualizadas", "ignoradas"):
+            self.assertEqual(previsto[k], gravado[k], k)
+        self.assertEqual(len(previsto["exemplos"]["inseridas"]), min(gravado["inseridas"], 20))
+
+        alterado = conteudo.replace(b'"706","706"', b'"706","707"')
+        segundo = _preview_arquivos([FileStorage(io.BytesIO(alterado), filename="e.csv")], datetime(2026, 2, 20, tzinfo=timezone.utc))
+        self.assertEqual(segundo["inseridas"], 0)
+        self.assertEqual(segundo["no_show"], segundo["atualizadas"])
+        mudanca = next(e for e in segundo["exemplos"]["atualizadas"] if e["appointment_id"] == "91585056969")
+        self.assertEqual(mudanca["campos"]["units"], {"antes": 706, "depois": 707})
+        self.assertEqual(mudanca["campos"]["status"], {"antes": "arrival_scheduled", "depois": "no_show"})
+        self.assertEqual(Carga.query.filter_by(appointment_id="91585056969").one().units, 706)
+
+    def test_preview_counts_new_rows_inserted_as_no_show(self):
+        agora = datetime(2026, 2, 20, tzinfo=timezone.utc)
+        conteudo = EXPORT_CSV.read_bytes()
+
+        previsto = _preview_arquivos([FileStorage(io.BytesIO(conteudo), filename="e.csv")], agora)
+        _ingerir(_ler_planilha(FileStorage(io.BytesIO(conteudo), filename="e.csv")), agora, _novo_resumo())
+
+        no_show = Carga.query.filter_by(status="no_show").count()
+        self.assertGreater(no_show, 0)
+        self.assertEqual(previsto["no_show"], no_show)
+        self.assertEqual(previsto["no_show_novas"], no_show)
+        self.assertIsNone(previsto["exemplos"]["no_show"][0]["status_atual"])
+
+    def test_multiple_files_are_merged_last_file_wins(self):
+        agora = datetime(2026, 2, 15, 12, 0, tzinfo=timezone.utc)
+        conteudo = EXPORT_CSV.read_bytes()
+        alterado = conteudo.replace(b'"706","706"', b'"706","707"')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            arquivos = []
+            for nome, dados in (("janela1.csv", conteudo), ("janela2.csv", alterado)):
+                caminho = Path(tmp) / nome
+                caminho.write_bytes(dados)
+                arquivos.append((str(caminho), nome, "text/csv"))
+
+            resumo = _ingerir_arquivos(arquivos, agora, _novo_resumo())
+
+        linhas = len(conteudo.splitlines()) - 1
+        self.assertEqual(resumo["linhas"], 2 * linhas)
+        self.assertEqual(resumo["inseridas"], Carga.query.count())
+        self.assertEqual(resumo["atualizadas"], 0)
+        self.assertEqual(resumo["repetidas"], resumo["inseridas"])
+        self.assertEqual(Carga.query.filter_by(appointment_id="91585056969").one().units, 707)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import io
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from flask import Flask
+
+from db import db
+from models import Carga
+from api import upload_jobs
+from api.upload import upload_bp
+
+EXPORT_CSV = Path(__file__).resolve().parents[1] / "export (1).csv"
+
+
+class UploadJobsTests(unittest.TestCase):
+    def test_job_lifecycle_reports_progress(self):
+        job_id = upload_jobs.criar_job("planilha.csv")
+        job = upload_jobs.obter_job(job_id)
+        self.assertEqual(job["status"], "pendente")
+        self.assertIsNone(job["iniciado_em"])
+
+        upload_jobs.atualizar_job(job_id, status="processando", linhas=5000, inseridas=10, erros=["Linha 2: x"])
+        job = upload_jobs.obter_job(job_id)
+        self.assertEqual((job["status"], job["linhas"], job["inseridas"]), ("processando", 5000, 10))
+        self.assertIsNotNone(job["iniciado_em"])
+        self.assertEqual(job["erros"], ["Linha 2: x"])
+
+        upload_jobs.atualizar_job(job_id, status="concluido")
+        self.assertIsNotNone(upload_jobs.obter_job(job_id)["finalizado_em"])
+
+    def test_unknown_job_returns_none(self):
+        self.assertIsNone(upload_jobs.obter_job("nao-existe"))
+
+
+class UploadJobEndpointTests(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.app.register_blueprint(upload_bp)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        permissao = mock.patch("api.auth.has_capability", return_value=True)
+        permissao.start()
+        self.addCleanup(permissao.stop)
+
+        # executa o job na hora, na thread do teste (em vez do pool de upload_jobs)
+        inline = mock.patch("api.upload_jobs.submeter", side_effect=lambda job_id, fn, *args: fn(job_id, *args))
+        self.submeter = inline.start()
+        self.addCleanup(inline.stop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_upload_runs_as_job_and_status_reports_counts(self):
+        resposta = self.client.post(
+            "/upload/processar",
+            data={"file": (io.BytesIO(EXPORT_CSV.read_bytes()), "export.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(resposta.status_code, 202)
+        dados = resposta.get_json()
+        self.assertEqual(dados["status_url"], f"/upload/status/{dados['job_id']}")
+        self.submeter.assert_called_once()
+
+        job = self.client.get(dados["status_url"]).get_json()
+        self.assertEqual(job["status"], "concluido")
+        self.assertEqual(job["linhas"], len(EXPORT_CSV.read_bytes().splitlines()) - 1)
+        self.assertEqual(job["inseridas"], Carga.query.count())
+        self.assertGreater(job["inseridas"], 0)
+        self.assertEqual((job["atualizadas"], job["inalteradas"]), (0, 0))
+        self.assertIsNotNone(job["finalizado_em"])
+
+    def test_status_of_unknown_job_is_404(self):
+        resposta = self.client.get("/upload/status/nao-existe")
+        self.assertEqual(resposta.status_code, 404)
+        self.assertIn("error", resposta.get_json())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
-from datetime import timezone
+from datetime import datetime, timezone
 
-from api.upload import _to_utc_aware, _status_do_sistema
+import pandas as pd
+
+from api.upload import _to_utc_aware, _status_do_sistema, _normalize_type, _normalizar_planilha
 
 
 class UploadTimeParsingTests(unittest.TestCase):
@@ -23,5 +25,59 @@ class UploadTimeParsingTests(unittest.TestCase):
         self.assertEqual(_status_do_sistema("ARRIVAL_SCHEDULED"), "arrival_scheduled")
 
 
+class UploadNormalizacaoVetorizadaTests(unittest.TestCase):
+    def setUp(self):
+        self.agora = datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc)
+        self.df = pd.DataFrame({
+            "Appointment Id": ["A1", "A2", " ", None, "A1", "A5", "A6"],
+            "Type": ["OTHER", "trans-ship", "CARP", "OTHER", "CARP", None, "XPTO"],
+            "expected arrival date": [
+                "2026/03/01 08:00 BRT",
+                "2026-03-09 08:15:00",
+                "2026/03/01 08:00 BRT",
+                "2026/03/01 08:00 BRT",
+                "2026-03-09T08:00:00-03:00",
+                "lixo",
+                "2026/03/09 10:00 BRT",
+            ],
+            "Priority Score Last Updated Date": ["2026/02/28 08:00 BRT", None, None, None, None, None, "2026/03/09 11:00 BRT"],
+            "Status": ["ARRIVAL_SCHEDULED", "ARRIVED", "ARRIVAL", "ARRIVAL", "CLOSED", "ARRIVAL", None],
+            "Units": ["10", "5", "1", "1", "3", "1", "0"],
+        })
+
+    def test_matches_row_level_helpers(self):
+        norm, _ = _normalizar_planilha(self.df, self.agora)
+
+        for i, raw in enumerate(self.df["expected arrival date"]):
+            esperado = _to_utc_aware(raw)
+            obtido = norm["expected_arrival_date"].iloc[i]
+            if esperado is None:
+                self.assertTrue(pd.isna(obtido))
+            else:
+                self.assertEqual(obtido.to_pydatetime(), esperado)
+
+        for i, raw in enumerate(self.df["Type"]):
+            truck_type, truck_tipo = _normalize_type(raw)
+            self.assertEqual(None if pd.isna(norm["truck_type"].iloc[i]) else norm["truck_type"].iloc[i], truck_type)
+            self.assertEqual(None if pd.isna(norm["truck_tipo"].iloc[i]) else norm["truck_tipo"].iloc[i], truck_tipo)
+
+    def test_status_no_show_and_prioridade(self):
+        norm, resumo = _normalizar_planilha(self.df, self.agora)
+
+        self.assertEqual(norm["status"].iloc[0], "no_show")  # ARRIVAL_SCHEDULED vencido há mais de 24h
+        self.assertEqual(norm["status"].iloc[1], "arrival")
+        self.assertTrue(pd.isna(norm["status"].iloc[4]))  # CLOSED -> ignora
+        self.assertTrue(bool(norm["prioridade_maxima"].iloc[0]))
+        self.assertFalse(bool(norm["prioridade_maxima"].iloc[6]))
+        self.assertEqual(resumo["repetidas_no_arquivo"], 1)
+
+    def test_valid_mask_and_row_errors(self):
+        norm, _ = _normalizar_planilha(self.df, self.agora)
+
+        self.assertEqual(norm["valida"].tolist(), [True, True, False, False, False, False, False])
+        erros = norm[norm["erro"].notna()]
+        self.assertEqual(erros["linha"].tolist(), [7])
+
+
 if __name__ == "__main__":
     unittest.main()